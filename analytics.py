@@ -0,0 +1,192 @@
+import datetime
+
+import numpy as np
+
+from config import RESTAURANT_ASSIGNMENTS
+from records import ordinal_to_date
+
+# Vectorized delivery rollups over NumPy columns of the history. Weeks start on Monday
+# (ordinal 1, 0001-01-01, is a Monday).
+
+RECORD_DTYPE = np.dtype([("mushroom_id", np.int32), ("box_number", np.int32), ("restaurant_id", np.int32),
+                         ("pack_date", np.int32), ("ship_date", np.int32)])
+ROLLING_WINDOWS = (7, 30)
+REPORT_WEEKS = 8
+
+
+def week_start(ordinals):
+    return (ordinals - 1) // 7 * 7 + 1
+
+
+class DeliveryFrame:
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def from_records(cls, records):
+        rows = ((r.mushroom_id, r.box_number, r.restaurant_id, r.pack_date, r.ship_date) for r in records)
+        return cls(np.fromiter(rows, dtype=RECORD_DTYPE))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getattr__(self, field):
+        if field in RECORD_DTYPE.names:
+            return self.data[field]
+        raise AttributeError(field)
+
+    def between(self, start=None, end=None):
+        mask = np.ones(len(self.data), dtype=bool)
+        if start is not None:
+            mask &= self.data["pack_date"] >= start
+        if end is not None:
+            mask &= self.data["pack_date"] <= end
+        return DeliveryFrame(self.data[mask])
+
+
+def restaurant_by_week(frame):
+    # (restaurant ids, week start ordinals, counts[restaurant, week])
+    if not len(frame):
+        return np.array([], dtype=np.int32), np.array([], dtype=np.int32), np.zeros((0, 0), dtype=np.int64)
+    restaurants, rows = np.unique(frame.restaurant_id, return_inverse=True)
+    weeks = week_start(frame.pack_date)
+    first = weeks.min()
+    columns = (weeks - first) // 7
+    width = int(columns.max()) + 1
+    counts = np.bincount(rows * width + columns, minlength=len(restaurants) * width)
+    return restaurants, first + 7 * np.arange(width, dtype=np.int32), counts.reshape(len(restaurants), width)
+
+
+def lead_times(frame):
+    # Pack-to-ship days: summary statistics plus {days: deliveries}. Deliveries shipped
+    # before they were packed are data errors, counted apart rather than as 0 days
+    if not len(frame):
+        return None
+    days = frame.ship_date.astype(np.int64) - frame.pack_date
+    valid = days[days >= 0]
+    lead = {
+        "deliveries": len(valid),
+        "shipped_before_packed": len(days) - len(valid),
+        "histogram": {},
+    }
+    if not len(valid):
+        return lead
+    median, p90, p99 = np.percentile(valid, [50, 90, 99])
+    lead.update({
+        "mean": float(valid.mean()),
+        "median": float(median),
+        "p90": float(p90),
+        "p99": float(p99),
+        "min": int(valid.min()),
+        "max": int(valid.max()),
+        "histogram": {day: int(n) for day, n in enumerate(np.bincount(valid)) if n},
+    })
+    return lead
+
+
+def rolling_volume(frame, windows=ROLLING_WINDOWS):
+    # (day ordinals, daily counts, {window: trailing sums})
+    if not len(frame):
+        return np.array([], dtype=np.int32), np.array([], dtype=np.int64), {window: np.array([]) for window in windows}
+    first = int(frame.pack_date.min())
+    daily = np.bincount(frame.pack_date - first)
+    totals = np.cumsum(daily)
+    rolling = {}
+    for window in windows:
+        sums = totals.copy()
+        sums[window:] -= totals[:-window]
+        rolling[window] = sums
+    return first + np.arange(len(daily), dtype=np.int32), daily, rolling
+
+
+def restaurant_trends(frame):
+    # {restaurant id: (change in deliveries per week, mean per week)}
+    restaurants, weeks, counts = restaurant_by_week(frame)
+    if not len(restaurants):
+        return {}
+    x = np.arange(len(weeks), dtype=float)
+    x -= x.mean()
+    denominator = float(x @ x)
+    means = counts.mean(axis=1)
+    slopes = (counts - means[:, None]) @ x / denominator if denominator else np.zeros(len(restaurants))
+    return {int(r): (float(slope), float(mean)) for r, slope, mean in zip(restaurants, slopes, means)}
+
+
+def summarize(frame, weeks=REPORT_WEEKS):
+    restaurants, week_starts, counts = restaurant_by_week(frame)
+    days, daily, rolling = rolling_volume(frame)
+    return {
+        "deliveries": len(frame),
+        "restaurant_weeks": (restaurants, week_starts[-weeks:], counts[:, -weeks:]),
+        "restaurant_totals": dict(zip(restaurants.tolist(), counts.sum(axis=1).tolist())),
+        "lead_times": lead_times(frame),
+        "rolling": {window: (int(sums[-1]) if len(sums) else 0) for window, sums in rolling.items()},
+        "busiest_day": (int(days[daily.argmax()]), int(daily.max())) if len(daily) else None,
+        "last_day": int(days[-1]) if len(days) else None,
+        "trends": restaurant_trends(frame),
+    }
+
+
+def _restaurant(restaurant_id):
+    return RESTAURANT_ASSIGNMENTS.get(restaurant_id, f"Restaurant {restaurant_id}")
+
+
+def report_sections(summary):
+    # ("heading", text, level), ("bullets", [text, ...]) or ("table", headers, rows, weights)
+    sections = [("heading", "Analytics", 1)]
+    if not summary["deliveries"]:
+        sections.append(("bullets", ["No deliveries in the selected range."]))
+        return sections
+
+    lead = summary["lead_times"]
+    sections.append(("heading", "Pack-to-Ship Lead Time", 2))
+    bullets = []
+    if lead["deliveries"]:
+        bullets.append(f"Average: {lead['mean']:.1f} days (median {lead['median']:.0f},"
+                       f" 90% within {lead['p90']:.0f}, longest {lead['max']})")
+    for days, deliveries in sorted(lead["histogram"].items())[:8]:
+        bullets.append(f"{days} day{'s' if days != 1 else ''}: {deliveries} deliveries"
+                       f" ({deliveries / lead['deliveries']:.0%})")
+    if lead["shipped_before_packed"]:
+        bullets.append(f"Shipped before packed (check dates): {lead['shipped_before_packed']} deliveries")
+    sections.append(("bullets", bullets))
+
+    sections.append(("heading", "Recent Volume", 2))
+    last_day = ordinal_to_date(summary["last_day"])
+    bullets = [f"Last {window} days to {last_day}: {volume} deliveries ({volume / window:.1f} per day)"
+               for window, volume in summary["rolling"].items()]
+    day, deliveries = summary["busiest_day"]
+    bullets.append(f"Busiest day: {ordinal_to_date(day)} with {deliveries} deliveries")
+    sections.append(("bullets", bullets))
+
+    sections.append(("heading", "Restaurant Trends", 2))
+    rows = []
+    for restaurant_id, (slope, mean) in summary["trends"].items():
+        rows.append([_restaurant(restaurant_id), str(summary["restaurant_totals"][restaurant_id]), f"{mean:.1f}",
+                     f"{slope:+.2f}"])
+    sections.append(("table", ["Restaurant", "Deliveries", "Per Week", "Weekly Change"], rows, [3, 2, 2, 2]))
+
+    restaurants, week_starts, counts = summary["restaurant_weeks"]
+    sections.append(("heading", f"Deliveries per Restaurant, Last {len(week_starts)} Weeks", 2))
+    headers = ["Restaurant"] + [datetime.date.fromordinal(int(week)).strftime("%b %d") for week in week_starts]
+    rows = [[_restaurant(int(r))] + [str(n) for n in row] for r, row in zip(restaurants, counts.tolist())]
+    sections.append(("table", headers, rows, [3] + [1] * len(week_starts)))
+    return sections
+
+
+def render_text(sections):
+    # Plain-text layout for the CLI and the GUI's analytics window
+    lines = []
+    for section in sections:
+        if section[0] == "heading":
+            lines += ["", section[1], ("=" if section[2] == 1 else "-") * len(section[1])]
+        elif section[0] == "bullets":
+            lines += [f"  * {text}" for text in section[1]]
+        else:
+            headers, rows = section[1], section[2]
+            widths = [max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))]
+            for row in [headers] + rows:
+                cells = [str(cell).ljust(width) if i == 0 else str(cell).rjust(width)
+                         for i, (cell, width) in enumerate(zip(row, widths))]
+                lines.append("  " + "  ".join(cells))
+    return "\n".join(lines).strip("\n") + "\n"
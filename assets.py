@@ -0,0 +1,97 @@
+import copy
+import io
+import math
+import os
+import threading
+
+from metrics import count, timed
+from pdf import encode_image
+
+# Branding parsed once per process: the scaled logo (for python-docx and the PDF writer)
+# and the .docx template. Entries are checked against the file's mtime and size on use.
+
+# Logos print at most this wide, which is also the PDF layout's limit (144 pt)
+LOGO_MAX_INCHES = 2.0
+# Larger logos are scaled down to this resolution once, instead of embedding the original
+LOGO_DPI = 300
+
+
+class Logo:
+    __slots__ = ("data", "width_inches", "pdf")
+
+    def __init__(self, data, width_inches, pdf):
+        self.data = data  # image file bytes for python-docx
+        self.width_inches = width_inches
+        self.pdf = pdf  # PdfImage
+
+
+@timed("assets.logo")
+def load_logo(path):
+    from PIL import Image
+
+    img = Image.open(path)
+    img.load()
+    dpi = img.info.get("dpi", (96, 96))[0] or 96
+    width_inches = min(img.width / dpi, LOGO_MAX_INCHES)
+    target = math.ceil(width_inches * LOGO_DPI)
+    if img.width <= target:
+        with open(path, "rb") as f:
+            data = f.read()
+        return Logo(data, width_inches, encode_image(path))
+    img = img.resize((target, max(1, round(img.height * target / img.width))), Image.LANCZOS)
+    dpi = target / width_inches
+    buffer = io.BytesIO()
+    if img.mode in ("RGB", "L") and path.lower().endswith((".jpg", ".jpeg")):
+        img.save(buffer, "JPEG", quality=90, dpi=(dpi, dpi))
+    else:
+        img.save(buffer, "PNG", optimize=True, dpi=(dpi, dpi))
+    return Logo(buffer.getvalue(), width_inches, encode_image(img, dpi))
+
+
+@timed("assets.template")
+def load_template(path):
+    from docx import Document
+
+    return Document(path)
+
+
+class AssetCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._entries = {}
+
+    def _get(self, kind, path, load):
+        stat = os.stat(path) if path else None
+        stamp = None if stat is None else (stat.st_mtime_ns, stat.st_size)
+        key = (kind, os.path.abspath(path) if path else None)
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                count("assets.hits")
+                return entry[1]
+        value = load(path)
+        count("assets.misses")
+        with self.lock:
+            self._entries[key] = (stamp, value)
+        return value
+
+    def logo(self, path):
+        return self._get("logo", path, load_logo)
+
+    def document(self, template_path=None):
+        # A copy of the parsed template, so nothing leaks into the next document
+        template = self._get("template", template_path or None, load_template)
+        with self.lock:
+            return copy.deepcopy(template)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+
+
+ASSETS = AssetCache()
+
+
+def existing(path):
+    # Settings hold "" for "none"; a file that has gone missing is skipped the same way
+    return path if path and os.path.exists(path) else None
@@ -0,0 +1,397 @@
+import datetime
+import hashlib
+import json
+import lzma
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from itertools import islice
+
+from filelock import FileLock
+from metrics import timed
+from records import parse_labels
+
+# Deduplicated backups: labels are cut into content-defined chunks, each stored once as
+# an lzma segment named by its SHA-256, and a backup is a manifest listing its segments.
+#
+#   backups/segments/ab/ab12....xz     newline-separated labels, lzma
+#   backups/logs_backup_<ts>.manifest.json
+#   backups/catalog.json               every backup's description
+
+BACKUP_DIR = "backups"
+SEGMENT_DIR = "segments"
+MANIFEST_SUFFIX = ".manifest.json"
+LEGACY_SUFFIX = ".json"
+LEGACY_PREFIX = "logs_backup_"
+CATALOG_FILE = "catalog.json"
+LOCK_FILE = "backups.lock"
+PREVIEW_ROWS = 50
+
+# Chunks average ~1024 labels (about 90 KB before compression)
+CHUNK_MASK = 0x3FF
+MIN_CHUNK = 256
+MAX_CHUNK = 8192
+
+# Preset 1 compresses ~10x faster than the default 6 for ~13% larger segments
+LZMA_PRESET = 1
+# Segments younger than this are never garbage-collected; a backup may still be writing
+GC_GRACE_SECONDS = 600
+
+_lock = threading.Lock()
+# Cross-process lock per backups folder, for garbage collection and reused segments
+_folder_locks = {}
+
+
+def chunk_labels(labels):
+    # Yields lists of labels; boundaries depend only on the labels themselves
+    chunk = []
+    for label in labels:
+        chunk.append(label)
+        if len(chunk) >= MAX_CHUNK or (len(chunk) >= MIN_CHUNK and
+                                       zlib.crc32(label.encode("utf-8")) & CHUNK_MASK == 0):
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _is_legacy(filename):
+    return filename.startswith(LEGACY_PREFIX) and filename.endswith(LEGACY_SUFFIX) \
+        and not filename.endswith(MANIFEST_SUFFIX)
+
+
+def _checksum(segments):
+    data = "\n".join(f"{digest}:{count}" for digest, count in segments)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def describe_records(records):
+    # Entry count, pack date range and per-restaurant counts of any record iterable
+    restaurants = Counter()
+    first = last = None
+    for record in records:
+        restaurants[record.restaurant_id] += 1
+        day = record.pack_date
+        if first is None or day < first:
+            first = day
+        if last is None or day > last:
+            last = day
+    return {"records": sum(restaurants.values()), "first_pack": first, "last_pack": last,
+            "restaurants": dict(restaurants)}
+
+
+class BackupError(ValueError):
+    pass
+
+
+class BackupStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.segment_folder = os.path.join(self.folder, SEGMENT_DIR)
+
+    def _segment_path(self, digest):
+        return os.path.join(self.segment_folder, digest[:2], digest + ".xz")
+
+    def _folder_lock(self):
+        path = os.path.abspath(os.path.join(self.folder, LOCK_FILE))
+        if path not in _folder_locks:
+            _folder_locks[path] = FileLock(path)
+        return _folder_locks[path]
+
+    def _reuse_segment(self, path):
+        # Returns the size of an existing segment after touching it, or None
+        with _lock, self._folder_lock():
+            if not os.path.exists(path):
+                return None
+            os.utime(path)
+            return os.path.getsize(path)
+
+    def _write_atomic(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    # --- Creating ---
+
+    @timed("backup.create")
+    def create(self, records, reason="manual", total=None, job=None):
+        os.makedirs(self.folder, exist_ok=True)
+        segments = []
+        new_segments = new_bytes = size = count = 0
+        restaurants = Counter()
+        first = last = None
+
+        def labels():
+            nonlocal first, last
+            for record in records:
+                restaurants[record.restaurant_id] += 1
+                day = record.pack_date
+                if first is None or day < first:
+                    first = day
+                if last is None or day > last:
+                    last = day
+                yield record.label()
+
+        for chunk in chunk_labels(labels()):
+            data = "\n".join(chunk).encode("utf-8")
+            digest = hashlib.sha256(data).hexdigest()
+            path = self._segment_path(digest)
+            reused = self._reuse_segment(path)
+            if reused is not None:
+                size += reused
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                compressed = lzma.compress(data, preset=LZMA_PRESET)
+                self._write_atomic(path, compressed)
+                new_segments += 1
+                new_bytes += len(compressed)
+                size += len(compressed)
+            segments.append([digest, len(chunk)])
+            count += len(chunk)
+            if job is not None:
+                job.progress(count, total, "backing up")
+
+        now = datetime.datetime.now()
+        name = f"logs_backup_{now.strftime('%Y-%m-%d_%H%M%S')}"
+        # Two backups in the same second get distinct names
+        suffix = 1
+        while os.path.exists(os.path.join(self.folder, name + MANIFEST_SUFFIX)):
+            suffix += 1
+            name = f"logs_backup_{now.strftime('%Y-%m-%d_%H%M%S')}_{suffix}"
+        entry = {"name": name, "file": name + MANIFEST_SUFFIX, "created": now.isoformat(timespec="seconds"),
+                 "reason": reason, "records": count, "first_pack": first, "last_pack": last,
+                 "restaurants": dict(restaurants), "size": size, "new_bytes": new_bytes,
+                 "checksum": _checksum(segments)}
+        manifest = dict(entry, version=1, segments=segments)
+        self._write_atomic(os.path.join(self.folder, entry["file"]), json.dumps(manifest).encode("utf-8"))
+        with _lock:
+            catalog = self._load_catalog()
+            catalog[entry["file"]] = entry
+            self._save_catalog(catalog)
+        manifest["new_segments"] = new_segments
+        return manifest
+
+    # --- Listing ---
+
+    def list(self):
+        # Catalog entries, newest first; unknown values are None until describe()
+        if not os.path.isdir(self.folder):
+            return []
+        with _lock:
+            catalog = self._load_catalog()
+            files = {filename for filename in os.listdir(self.folder)
+                     if filename.endswith(MANIFEST_SUFFIX) or _is_legacy(filename)}
+            changed = False
+            for filename in set(catalog) - files:
+                del catalog[filename]
+                changed = True
+            for filename in files - set(catalog):
+                entry = self._entry(filename)
+                if entry is not None:
+                    catalog[filename] = entry
+                    changed = True
+            if changed:
+                self._save_catalog(catalog)
+        backups = sorted(catalog.values(), key=lambda backup: (backup["created"], backup["name"]), reverse=True)
+        return backups
+
+    def _entry(self, filename):
+        path = os.path.join(self.folder, filename)
+        if _is_legacy(filename):
+            created = datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec="seconds")
+            return {"name": filename, "file": filename, "created": created, "reason": "full copy", "records": None,
+                    "first_pack": None, "last_pack": None, "restaurants": None, "size": os.path.getsize(path),
+                    "checksum": None}
+        try:
+            manifest = self._manifest(filename[:-len(MANIFEST_SUFFIX)])
+        except BackupError:
+            return None
+        segments = manifest["segments"]
+        if "size" not in manifest:
+            manifest["size"] = sum(os.path.getsize(self._segment_path(digest)) for digest, _ in segments
+                                   if os.path.exists(self._segment_path(digest)))
+        entry = {key: manifest.get(key) for key in ("name", "created", "records", "first_pack", "last_pack",
+                                                    "restaurants", "size", "new_bytes")}
+        entry.update(file=filename, reason=manifest.get("reason", "manual"), checksum=_checksum(segments))
+        if entry["restaurants"] is not None:
+            entry["restaurants"] = {int(r): n for r, n in entry["restaurants"].items()}
+        return entry
+
+    def _load_catalog(self):
+        try:
+            with open(os.path.join(self.folder, CATALOG_FILE), "r", encoding="utf-8") as f:
+                catalog = json.load(f)["backups"]
+            for entry in catalog.values():
+                if entry.get("restaurants") is not None:
+                    entry["restaurants"] = {int(r): n for r, n in entry["restaurants"].items()}
+            return catalog
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {}  # Rebuilt from the manifests
+
+    def _save_catalog(self, catalog):
+        os.makedirs(self.folder, exist_ok=True)
+        self._write_atomic(os.path.join(self.folder, CATALOG_FILE),
+                           json.dumps({"version": 1, "backups": catalog}).encode("utf-8"))
+
+    def describe(self, name):
+        # Describes a backup the catalog has no description for
+        filename = name if name.endswith(LEGACY_SUFFIX) else name + MANIFEST_SUFFIX
+        records, _ = self.records(filename)
+        description = describe_records(records)
+        if _is_legacy(filename):
+            with open(os.path.join(self.folder, filename), "rb") as f:
+                description["checksum"] = hashlib.sha256(f.read()).hexdigest()
+        with _lock:
+            catalog = self._load_catalog()
+            entry = catalog.get(filename) or self._entry(filename)
+            if entry is None:
+                raise BackupError(f"Unreadable backup {name}")
+            entry.update(description)
+            catalog[filename] = entry
+            self._save_catalog(catalog)
+        return entry
+
+    def _manifest(self, name):
+        try:
+            with open(os.path.join(self.folder, name + MANIFEST_SUFFIX), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise BackupError(f"Unreadable backup {name}: {e}")
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("segments"), list):
+            raise BackupError(f"Unreadable backup {name}: not a backup manifest")
+        manifest["name"] = name
+        manifest.setdefault("created", "")
+        manifest.setdefault("records", sum(count for _, count in manifest["segments"]))
+        return manifest
+
+    # --- Restoring ---
+
+    def iter_labels(self, name):
+        if _is_legacy(name):
+            with open(os.path.join(self.folder, name), "r", encoding="utf-8") as f:
+                labels = json.load(f)
+            if not isinstance(labels, list):
+                raise BackupError("Invalid backup file format!")
+            yield from labels
+            return
+        if name.endswith(MANIFEST_SUFFIX):
+            name = name[:-len(MANIFEST_SUFFIX)]
+        for digest, count in self._manifest(name)["segments"]:
+            yield from self._segment_labels(name, digest, count)
+
+    def _segment_labels(self, name, digest, count):
+        try:
+            with open(self._segment_path(digest), "rb") as f:
+                data = lzma.decompress(f.read())
+        except (OSError, lzma.LZMAError) as e:
+            raise BackupError(f"Backup {name} is damaged: segment {digest[:12]} ({e})")
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise BackupError(f"Backup {name} is damaged: segment {digest[:12]} does not match its hash")
+        labels = data.decode("utf-8").split("\n")
+        if len(labels) != count:
+            raise BackupError(f"Backup {name} is damaged: segment {digest[:12]} has {len(labels)} entries")
+        return labels
+
+    @timed("backup.restore")
+    def records(self, name):
+        records, skipped = [], 0
+        batch = []
+        for label in self.iter_labels(name):
+            batch.append(label)
+            if len(batch) >= MAX_CHUNK:
+                parsed, bad = parse_labels(batch)
+                records.extend(parsed)
+                skipped += bad
+                batch = []
+        parsed, bad = parse_labels(batch)
+        records.extend(parsed)
+        return records, skipped + bad
+
+    def preview(self, name, rows=PREVIEW_ROWS):
+        records, _ = parse_labels(list(islice(self.iter_labels(name), rows)))
+        return records
+
+    # --- Comparing ---
+
+    @timed("backup.diff")
+    def diff(self, name, records):
+        # (missing, added); segments both sides share are skipped without decompressing
+        if _is_legacy(name):
+            backup_digests = {}
+        else:
+            manifest = self._manifest(name[:-len(MANIFEST_SUFFIX)] if name.endswith(MANIFEST_SUFFIX) else name)
+            backup_digests = {digest: count for digest, count in manifest["segments"]}
+        current = Counter()
+        shared = set()
+        for chunk in chunk_labels(record.label() for record in records):
+            digest = hashlib.sha256("\n".join(chunk).encode("utf-8")).hexdigest()
+            if digest in backup_digests:
+                shared.add(digest)
+            else:
+                current.update(chunk)
+        backup = Counter()
+        if _is_legacy(name):
+            backup.update(self.iter_labels(name))
+        else:
+            for digest in backup_digests:
+                if digest not in shared:
+                    backup.update(self._segment_labels(name, digest, backup_digests[digest]))
+        return list((backup - current).elements()), list((current - backup).elements())
+
+    # --- Deleting ---
+
+    def delete(self, name):
+        if name.endswith(MANIFEST_SUFFIX):
+            name = name[:-len(MANIFEST_SUFFIX)]
+        filename = name if name.endswith(LEGACY_SUFFIX) else name + MANIFEST_SUFFIX
+        os.remove(os.path.join(self.folder, filename))
+        with _lock:
+            catalog = self._load_catalog()
+            if catalog.pop(filename, None) is not None:
+                self._save_catalog(catalog)
+        return self.collect_garbage()
+
+    def prune(self, reason, keep):
+        made = [backup for backup in self.list() if backup["reason"] == reason]
+        for backup in made[keep:]:
+            os.remove(os.path.join(self.folder, backup["file"]))
+        return self.collect_garbage() if len(made) > keep else 0
+
+    @timed("backup.collect_garbage")
+    def collect_garbage(self):
+        if not os.path.isdir(self.segment_folder):
+            return 0
+        with _lock, self._folder_lock():
+            used = set()
+            for filename in os.listdir(self.folder):
+                if filename.endswith(MANIFEST_SUFFIX):
+                    try:
+                        used.update(digest for digest, _ in self._manifest(filename[:-len(MANIFEST_SUFFIX)])["segments"])
+                    except BackupError:
+                        return 0  # Never delete what an unreadable manifest might still need
+            removed = 0
+            cutoff = time.time() - GC_GRACE_SECONDS
+            for prefix in os.listdir(self.segment_folder):
+                prefix_folder = os.path.join(self.segment_folder, prefix)
+                for filename in os.listdir(prefix_folder):
+                    path = os.path.join(prefix_folder, filename)
+                    if filename[:-len(".xz")] in used or os.path.getmtime(path) > cutoff:
+                        continue
+                    os.remove(path)
+                    removed += 1
+            return removed
+
+    def usage(self):
+        # Bytes on disk: (segments, manifests and old full copies)
+        segments = other = 0
+        for root, _, files in os.walk(self.folder):
+            for filename in files:
+                size = os.path.getsize(os.path.join(root, filename))
+                if root.startswith(self.segment_folder):
+                    segments += size
+                else:
+                    other += size
+        return segments, other
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import generate
+from exports import write_csv, write_excel, write_summary_pdf
+
+# Usage: python benchmarks/bench_exports.py [--rows 1000000] [--memory]
+# Records are generated on the fly (datagen.py), so the numbers reflect the exporter alone.
+# benchmarks/suite.py covers exports too, alongside loading, filtering and invoices.
+
+
+def summary_pdf(path, records):
+    write_summary_pdf(path, records, {}, "benchmark")
+    return path
+
+
+def run(name, export, rows, memory):
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    path = export(generate(rows))
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if memory else None
+    if memory:
+        tracemalloc.stop()
+    size = os.path.getsize(path)
+    line = f"{name:<24} {rows:>9} rows  {elapsed:7.2f}s  {rows / elapsed:>9.0f} rows/s  {size / 1e6:7.1f} MB"
+    if peak is not None:
+        line += f"  peak {peak / 1e6:6.1f} MB"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure CSV, Excel and PDF export throughput")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--memory", action="store_true", help="track peak Python memory (slower)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        run("csv", lambda records: write_csv(os.path.join(folder, "out.csv"), records), args.rows, args.memory)
+        for split_by in ("none", "restaurant", "month"):
+            run(f"excel (split={split_by})",
+                lambda records: write_excel(os.path.join(folder, f"out_{split_by}.xlsx"), records, split_by=split_by),
+                args.rows, args.memory)
+        run("summary pdf (native)", lambda records: summary_pdf(os.path.join(folder, "summary.pdf"), records),
+            args.rows, args.memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from datagen import generate, parse_rows, write_logs
+
+# Usage: python benchmarks/bench_service.py [--rows 100k] [--clients 32] [--requests 4000] [--batch 50]
+# Load test of `python -m cli serve` on localhost with keep-alive clients. Phases:
+#   add       single deliveries, like the packing floor scanners
+#   batch     --batch deliveries per request, like the order system
+#   mixed     page queries, tracking number lookups and counts between single adds
+#   stream    one client streams the whole history while the others keep adding
+
+FUTURE_PACK = datetime.date(2030, 1, 1)
+
+
+class Client:
+    # One keep-alive HTTP/1.1 connection
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port, limit=1 << 20)
+        data = b"" if body is None else json.dumps(body).encode()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n"
+                          .encode() + data)
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding") == "chunked":
+            return status, await self._chunks()
+        return status, await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+    async def _chunks(self):
+        lines = 0
+        while True:
+            size = int((await self.reader.readline()).strip(), 16)
+            chunk = await self.reader.readexactly(size + 2)
+            if not size:
+                return lines
+            lines += chunk.count(b"\n") - 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Boxes:
+    # Tracking numbers no other request uses: boxes 1-1000 of consecutive pack days
+    def __init__(self):
+        self.next = 0
+
+    def take(self, n):
+        first, self.next = self.next, self.next + n
+        return [[1 + i % 2, i % 1000 + 1, 1 + i % 3, self.pack_date(i), self.pack_date(i + 1000)]
+                for i in range(first, first + n)]
+
+    def tracking_number(self, i):
+        return f"{self.pack_date(i)}-BOX{i % 1000 + 1:03d}"
+
+    @staticmethod
+    def pack_date(i):
+        return (FUTURE_PACK + datetime.timedelta(days=i // 1000)).isoformat()
+
+
+async def counters(client):
+    status, body = await client.request("GET", "/metrics")
+    return json.loads(body)["counters"]
+
+
+async def phase(name, port, clients, requests, make_request, added_per_request=0, background=None):
+    # make_request(i) -> (method, path, body); requests are shared out between the clients
+    connections = [Client(port) for _ in range(clients)]
+    before = await counters(connections[0])
+    latencies = []
+    failures = []
+    remaining = iter(range(requests))
+
+    async def run(client):
+        for i in remaining:
+            method, path, body = make_request(i)
+            started = time.perf_counter()
+            status, data = await client.request(method, path, body)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                failures.append((status, data[:200]))
+
+    started = time.perf_counter()
+    extra = asyncio.ensure_future(background()) if background else None
+    await asyncio.gather(*(run(client) for client in connections))
+    elapsed = time.perf_counter() - started
+    extra_result = await extra if extra else None
+    after = await counters(connections[0])
+    for client in connections:
+        client.close()
+    writes = after.get("service.add_writes", 0) - before.get("service.add_writes", 0)
+    fsyncs = after.get("journal.commits", 0) - before.get("journal.commits", 0)
+    latencies.sort()
+    line = (f"{name:<8} {requests:>6} req  {clients:>3} clients  {requests / elapsed:>8.0f} req/s"
+            f"  p50 {statistics.median(latencies) * 1000:6.1f} ms"
+            f"  p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.1f} ms"
+            f"  p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.1f} ms")
+    if added_per_request:
+        line += f"  {requests * added_per_request / elapsed:>8.0f} deliveries/s  {writes} writes, {fsyncs} commits"
+    if extra_result:
+        line += f"  | {extra_result}"
+    print(line)
+    if failures:
+        print(f"  {len(failures)} failed, e.g. {failures[0]}")
+    return len(failures)
+
+
+def start_service(folder):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "cli.py"), "--log-file", os.path.join(folder, "logs.ndjson"),
+         "--settings", os.path.join(folder, "settings.json"), "serve", "--port", "0"],
+        cwd=folder, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    line = process.stderr.readline()
+    if not line.startswith("Serving on"):
+        process.kill()
+        raise RuntimeError(f"the service did not start: {line}{process.stderr.read()}")
+    return process, int(line.split()[2].rpartition(":")[2])
+
+
+async def load_test(port, args):
+    boxes = Boxes()
+    rng = random.Random(7)
+    failed = 0
+
+    def add(i):
+        return "POST", "/deliveries", dict(zip(("mushroom_id", "box_number", "restaurant_id", "pack_date",
+                                                "ship_date"), boxes.take(1)[0]))
+
+    failed += await phase("add", port, args.clients, args.requests, add, added_per_request=1)
+
+    def batch(i):
+        return "POST", "/deliveries", {"deliveries": boxes.take(args.batch)}
+
+    failed += await phase("batch", port, args.clients, max(1, args.requests // 10), batch, added_per_request=args.batch)
+
+    def mixed(i):
+        kind = i % 4
+        if kind == 0:
+            return add(i)
+        if kind == 1:
+            return "GET", f"/deliveries/{boxes.tracking_number(rng.randrange(boxes.next))}", None
+        if kind == 2:
+            return "GET", f"/deliveries?restaurant={rng.randint(1, 3)}&limit=50&newest=1", None
+        return "GET", "/deliveries/count?search=lion", None
+
+    failed += await phase("mixed", port, args.clients, args.requests, mixed)
+
+    async def stream():
+        client = Client(port)
+        started = time.perf_counter()
+        status, lines = await client.request("GET", "/deliveries/stream")
+        elapsed = time.perf_counter() - started
+        client.close()
+        return f"streamed {lines} deliveries in {elapsed:.2f}s ({lines / elapsed:.0f}/s)"
+
+    failed += await phase("stream", port, max(1, args.clients - 1), args.requests // 4, add, added_per_request=1,
+                          background=stream)
+
+    # Every acknowledged delivery has to be there
+    client = Client(port)
+    status, body = await client.request("GET", f"/deliveries/count?start={FUTURE_PACK.isoformat()}")
+    client.close()
+    logged, posted = json.loads(body)["count"], boxes.next
+    print(f"logged {logged} of {posted} posted deliveries")
+    return failed + (logged != posted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the HTTP service on localhost")
+    parser.add_argument("--rows", type=parse_rows, default=100_000, help="deliveries logged before the test")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=4000, help="requests in the add and mixed phases")
+    parser.add_argument("--batch", type=int, default=50, help="deliveries per request in the batch phase")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_logs(os.path.join(folder, "logs.ndjson"), generate(args.rows))
+        process, port = start_service(folder)
+        try:
+            failed = asyncio.run(load_test(port, args))
+        finally:
+            # Ctrl+C, so the service closes the store as it would for a user
+            process.send_signal(signal.SIGINT if os.name != "nt" else signal.SIGTERM)
+            process.wait()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
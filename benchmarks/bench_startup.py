@@ -0,0 +1,107 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Usage: python benchmarks/bench_startup.py [--runs 5] [--top 15] [--data FOLDER]
+# Every run is a fresh interpreter in an empty folder; --data copies the settings and logs
+# from FOLDER so real log sizes are included.
+
+# Runs in the child: prints seconds since process start when the first frame is idle
+FIRST_FRAME = """
+import time, sys
+started = float(sys.argv[1])
+import tkinter as tk
+from main import MushroomApp
+root = tk.Tk()
+app = MushroomApp(root)
+
+def ready():
+    print(f"FRAME {time.time() - started:.4f}", flush=True)
+    app.on_close()
+
+root.after_idle(lambda: root.after(0, ready))
+root.mainloop()
+"""
+
+
+def import_times(cwd):
+    # Cumulative import time (ms) of each module main.py pulls in directly
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=cwd,
+                            env=child_env(), capture_output=True, text=True, check=True)
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        # Depth 0 is interpreter startup (site, encodings) apart from main itself
+        if depth == 1 or name == "main":
+            totals[name] = int(cumulative) / 1000
+    return totals
+
+
+def first_frame(cwd):
+    started = time.time()
+    result = subprocess.run([sys.executable, "-c", FIRST_FRAME, repr(started)], cwd=cwd, env=child_env(),
+                            capture_output=True, text=True, timeout=120)
+    for line in result.stdout.splitlines():
+        if line.startswith("FRAME "):
+            return float(line.split()[1])
+    raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "no frame")
+
+
+def child_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    env.setdefault("USE_MOCK_SQUARE", "1")
+    return env
+
+
+def prepare(folder, data):
+    if not data:
+        return
+    for name in os.listdir(data):
+        if name in ("settings.json", "logs.ndjson", "logs.json", "logs.db") or name.startswith(("logs.ndjson.", "logs.json.")):
+            shutil.copy(os.path.join(data, name), folder)
+
+
+def summary(values):
+    return f"median {statistics.median(values) * 1000:7.0f} ms   min {min(values) * 1000:7.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GUI import time and time to first interactive frame")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    parser.add_argument("--data", help="folder with settings.json/logs.ndjson to start with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        prepare(folder, args.data)
+        runs = [import_times(folder) for _ in range(args.runs)]
+        print(f"import main: {summary([run['main'] / 1000 for run in runs])}")
+        medians = {name: statistics.median(run.get(name, 0) for run in runs) for name in runs[0] if name != "main"}
+        for name, ms in sorted(medians.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {name:<32} {ms:8.1f} ms")
+
+        try:
+            frames = [first_frame(folder) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"first frame: skipped ({e})")
+            return
+        print(f"first interactive frame (process start to idle mainloop): {summary(frames)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import datetime
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import MUSHROOM_TYPES, RESTAURANT_ASSIGNMENTS
+from logfile import is_ndjson, write_labels
+from records import DeliveryRecord
+
+# Seeded, realistic delivery histories for the benchmarks: the same seed always gives
+# the same history, so results from different releases are comparable.
+
+START_DATE = datetime.date(2023, 1, 1)
+DAYS = 730
+# Monday .. Sunday
+WEEKDAY_WEIGHTS = (1.0, 1.0, 1.1, 1.1, 1.2, 0.6, 0.3)
+SHIP_LAGS = (0, 1, 2, 3)
+SHIP_LAG_WEIGHTS = (0.15, 0.6, 0.2, 0.05)
+
+
+def _popularity(ids):
+    # The first entries of a catalog are the busiest, Zipf-style
+    return [1 / (rank + 1) for rank in range(len(ids))]
+
+
+def generate(rows, seed=42, days=DAYS, start=START_DATE):
+    rng = random.Random(seed)
+    mushrooms = list(MUSHROOM_TYPES)
+    restaurants = list(RESTAURANT_ASSIGNMENTS)
+    mushroom_weights = _popularity(mushrooms)
+    restaurant_weights = _popularity(restaurants)
+    first_day = start.toordinal()
+    day_weights = [WEEKDAY_WEIGHTS[datetime.date.fromordinal(first_day + d).weekday()] for d in range(days)]
+    total_weight = sum(day_weights)
+
+    emitted = 0
+    cumulative = 0.0
+    for d, weight in enumerate(day_weights):
+        # Rounding the running total keeps the exact row count across all days
+        cumulative += weight
+        n = round(rows * cumulative / total_weight) - emitted
+        emitted += n
+        pack_date = first_day + d
+        boxes = dict.fromkeys(mushrooms, 0)
+        for mushroom_id, restaurant_id, lag in zip(rng.choices(mushrooms, mushroom_weights, k=n),
+                                                   rng.choices(restaurants, restaurant_weights, k=n),
+                                                   rng.choices(SHIP_LAGS, SHIP_LAG_WEIGHTS, k=n)):
+            boxes[mushroom_id] += 1
+            yield DeliveryRecord(mushroom_id, boxes[mushroom_id], restaurant_id, pack_date, pack_date + lag)
+
+
+def write_logs(path, records):
+    # A log snapshot as the app loads it: NDJSON, or the old JSON list for *.json
+    with open(path, "w", encoding="utf-8") as f:
+        if is_ndjson(path):
+            write_labels(f, (record.label() for record in records))
+        else:
+            json.dump([record.label() for record in records], f, indent=4)
+    return path
+
+
+def parse_rows(value):
+    # "10k", "2.5M", "10000"
+    value = value.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic log history")
+    parser.add_argument("rows", type=parse_rows, help="deliveries, e.g. 100k or 1M")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--days", type=int, default=DAYS)
+    parser.add_argument("--out", default="logs.ndjson", help="*.json writes the old JSON list format")
+    args = parser.parse_args()
+    print(write_logs(args.out, generate(args.rows, args.seed, args.days)))
+
+
+if __name__ == "__main__":
+    main()
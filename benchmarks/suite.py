@@ -0,0 +1,486 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+LOGO = os.path.join(ROOT, "logo.png")
+
+from datagen import generate, parse_rows, write_logs
+from metrics import REGISTRY
+from records import DeliveryRecord
+from partitions import HOT_MONTHS
+from storage import MemoryLogStore, SQLiteLogStore
+
+# Usage:
+#   python benchmarks/suite.py [--rows 10k,100k,1M] [--only load,filter] [--repeat 3] [--memory] [--out FILE]
+#   python benchmarks/suite.py --compare baseline.json results.json [--tolerance 0.15] [--min-delta 0.005]
+#
+# Headless timings of the hot paths on seeded synthetic histories (datagen.py); each
+# benchmark reports the median of --repeat runs. 10M rows needs several GB of RAM.
+
+SUITE_VERSION = 1
+DEFAULT_ROWS = "10k,100k,1M"
+# Threads logging into one journal at once in logs.add_concurrent
+WRITERS = 8
+
+# (start offset in days, length in days, search) relative to the first pack date
+FILTER_CASES = (
+    (None, None, ""),
+    (None, None, "restaurant b"),
+    (300, 30, ""),
+    (300, 30, "lion's mane"),
+    (0, 7, "box01"),
+    (None, None, "no such delivery"),
+)
+
+
+class Benchmark:
+    def __init__(self, name, run, setup=None, teardown=None, max_rows=None, requires=()):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.teardown = teardown
+        self.max_rows = max_rows
+        self.requires = requires
+
+
+class Context:
+    # Data shared by every benchmark at one history size; built on first use
+    def __init__(self, folder, rows, seed):
+        self.folder = folder
+        self.rows = rows
+        self.seed = seed
+        # Row cap of the benchmark being run (None: the whole history)
+        self.limit = None
+        self._records = None
+        self._memory_store = None
+        self._sealed_store = None
+        self._sqlite_store = None
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def records(self, limit=None):
+        if self._records is None:
+            self._records = list(generate(self.rows, self.seed))
+        return self._records if limit is None or limit >= self.rows else self._records[:limit]
+
+    def logs_file(self, ext="ndjson"):
+        path = self.path(f"history.{ext}")
+        if not os.path.exists(path):
+            write_logs(path, self.records())
+        return path
+
+    def memory_store(self):
+        if self._memory_store is None:
+            self._memory_store = MemoryLogStore()
+            self._memory_store.add_many(list(self.records()))
+        return self._memory_store
+
+    def sealed_store(self):
+        # The journal store with every month of the history sealed into the archive
+        if self._sealed_store is None:
+            path = self.path("sealed.ndjson")
+            shutil.copy(self.logs_file(), path)
+            self._sealed_store = MemoryLogStore(path)
+            self._sealed_store.load()
+            self._sealed_store.save()
+        return self._sealed_store
+
+    def sqlite_store(self):
+        if self._sqlite_store is None:
+            self._sqlite_store = SQLiteLogStore(self.path("history.db"))
+            self._sqlite_store.replace_all(self.records())
+        return self._sqlite_store
+
+
+def _clean(path):
+    for extra in glob.glob(path + ".*"):
+        if os.path.isdir(extra):
+            shutil.rmtree(extra)
+        else:
+            os.remove(extra)
+
+
+# --- Benchmarks ---
+
+def setup_load(ext, hot_months=None):
+    # hot_months=None keeps the whole history in the hot log, as before partitioning
+    def setup(ctx):
+        path = ctx.path(f"logs.{ext}")
+        _clean(path)
+        shutil.copy(ctx.logs_file(ext), path)
+        return MemoryLogStore(path, hot_months)
+
+    return setup
+
+
+def setup_load_sealed(ctx):
+    # A history whose months were sealed by an earlier save
+    store = setup_load("ndjson", HOT_MONTHS)(ctx)
+    store.load()
+    store.save()
+    store.close()
+    return MemoryLogStore(store.journal.snapshot_path)
+
+
+def run_load(store):
+    store.load()
+    return {"records": store.count()}
+
+
+def run_seal(store):
+    store.load()
+    store.save()
+    return {"records": store.count()}
+
+
+def run_load_recent(store):
+    # Until the window can show the newest deliveries; the rest is still loading
+    store.load(background=True)
+    return {"records": len(store.records)}
+
+
+def teardown_journal(store):
+    store.close()
+    _clean(store.journal.snapshot_path)
+
+
+def setup_save(ctx):
+    path = ctx.path("logs.ndjson")
+    _clean(path)
+    store = MemoryLogStore(path, hot_months=None)
+    store.records = list(ctx.records())
+    return store
+
+
+def run_save(store):
+    store.save()
+    return {"bytes": os.path.getsize(store.journal.snapshot_path)}
+
+
+def setup_add_concurrent(ctx):
+    path = ctx.path("shared.ndjson")
+    _clean(path)
+    store = MemoryLogStore(path, hot_months=None)
+    store.load()
+    # Copies: adding hands out rids, and the history is shared with other benchmarks
+    return store, [DeliveryRecord(r.mushroom_id, r.box_number, r.restaurant_id, r.pack_date, r.ship_date)
+                   for r in ctx.records(ctx.limit)]
+
+
+def run_add_concurrent(state):
+    # Stations logging one delivery at a time; group commit shares the fsyncs out
+    store, records = state
+    appends = REGISTRY.snapshot()["operations"].get("journal.append", {}).get("calls", 0)
+    threads = [threading.Thread(target=lambda part: [store.add(record) for record in part],
+                                args=(records[i::WRITERS],)) for i in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    appends = REGISTRY.snapshot()["operations"]["journal.append"]["calls"] - appends
+    return {"records": store.count(), "fsyncs": appends}
+
+
+def run_filter(store):
+    # What update_filtered_logs does per keystroke: a count plus a five-row preview
+    first = store.query(limit=1)
+    first_day = next(iter(first)).pack_date if first else 0
+    for offset, days, search in FILTER_CASES:
+        start = first_day + offset if offset is not None else None
+        end = start + days - 1 if offset is not None else None
+        store.count(start, end, search)
+        list(store.query(start, end, search, limit=5))
+    return {"filters": len(FILTER_CASES)}
+
+
+def export(name):
+    def run(ctx):
+        import exports
+
+        records = ctx.records(ctx.limit)
+        path = ctx.path(f"export_{name}")
+        if name == "csv":
+            exports.write_csv(path + ".csv", records, total=len(records))
+        elif name == "excel":
+            exports.write_excel(path + ".xlsx", records, total=len(records))
+        elif name == "summary_pdf":
+            counts = ctx.memory_store().count_by("mushroom_id")
+            exports.write_summary_pdf(path + ".pdf", records, counts, "benchmark", total=len(records))
+        elif name == "summary_pdf_analytics":
+            counts = ctx.memory_store().count_by("mushroom_id")
+            exports.write_summary_pdf(path + ".pdf", records, counts, "benchmark", total=len(records),
+                                      analytics=exports.summary_analytics(records))
+        elif name == "summary_docx":
+            counts = ctx.memory_store().count_by("mushroom_id")
+            exports.write_summary_docx(path + ".docx", records, counts, "benchmark", total=len(records))
+        elif name == "invoice_pdf":
+            exports.write_invoice_pdf(path + ".pdf", records[-1])
+        elif name == "invoice_docx":
+            exports.write_invoice_docx(path + ".docx", records[-1])
+        elif name == "invoice_pdf_logo":
+            exports.write_invoice_pdf(path + ".pdf", records[-1], LOGO)
+        elif name == "invoice_docx_logo":
+            exports.write_invoice_docx(path + ".docx", records[-1], LOGO)
+        return {"bytes": sum(os.path.getsize(p) for p in glob.glob(path + ".*"))}
+
+    return run
+
+
+def setup_manager(limit):
+    def setup(ctx):
+        from manager import TraceabilityManager
+
+        # Copies: adding to a store assigns record ids, and the shared records belong to ctx.memory_store()
+        records = [DeliveryRecord(r.mushroom_id, r.box_number, r.restaurant_id, r.pack_date, r.ship_date)
+                   for r in ctx.records(limit)]
+        store = MemoryLogStore()
+        store.add_many(records)
+        return ctx, TraceabilityManager(store)
+
+    return setup
+
+
+def run_invoice_doc(state):
+    ctx, manager = state
+    path = ctx.path("invoice.docx")
+    manager.generate_invoice_doc(path)
+    return {"records": manager.store.count(), "bytes": os.path.getsize(path)}
+
+
+def run_invoice_pdf(state):
+    ctx, manager = state
+    path = ctx.path("invoice.pdf")
+    manager.generate_invoice_pdf(path)
+    return {"records": manager.store.count(), "bytes": os.path.getsize(path)}
+
+
+def run_invoice_batch(state):
+    # Month invoices for the whole history, all rendered (a fresh folder has no manifest to reuse)
+    ctx, manager = state
+    folder = ctx.path("invoices")
+    shutil.rmtree(folder, ignore_errors=True)
+    entries = manager.generate_invoice_batch(folder)
+    return {"records": manager.store.count(), "invoices": len(entries),
+            "bytes": sum(entry["bytes"] for entry in entries)}
+
+
+def run_square(state):
+    # Mock client with a fixed latency and a few simulated rate-limit failures
+    from manager import MockSquareClient
+
+    ctx, manager = state
+    manager.client = MockSquareClient(latency=0.002, failure_rate=0.02, seed=ctx.seed, verbose=False)
+    results = manager.create_square_invoices(rate=1e9, max_workers=8)
+    return {"invoices": len(results), "failed": sum(not result.success for result in results),
+            "attempts": sum(result.attempts for result in results)}
+
+
+BENCHMARKS = [
+    Benchmark("logs.load", run_load, setup_load("ndjson"), teardown_journal),
+    Benchmark("logs.load_recent", run_load_recent, setup_load("ndjson"), teardown_journal),
+    Benchmark("logs.load_json", run_load, setup_load("json"), teardown_journal),
+    # The first save after upgrading: every month of the history is sealed
+    Benchmark("logs.seal", run_seal, setup_load("ndjson", HOT_MONTHS), teardown_journal),
+    Benchmark("logs.load_sealed", run_load, setup_load_sealed, teardown_journal),
+    Benchmark("logs.save", run_save, setup_save, teardown_journal),
+    Benchmark("logs.add_concurrent", run_add_concurrent, setup_add_concurrent,
+              lambda state: teardown_journal(state[0]), max_rows=10_000),
+    Benchmark("filter.journal", run_filter, lambda ctx: ctx.memory_store()),
+    Benchmark("filter.sealed", run_filter, lambda ctx: ctx.sealed_store()),
+    Benchmark("filter.sqlite", run_filter, lambda ctx: ctx.sqlite_store()),
+    Benchmark("export.csv", export("csv")),
+    Benchmark("export.excel", export("excel"), max_rows=1_000_000, requires=("openpyxl",)),
+    Benchmark("export.summary_pdf", export("summary_pdf")),
+    Benchmark("export.summary_pdf_analytics", export("summary_pdf_analytics"), requires=("numpy",)),
+    # python-docx tables slow down with every row (10k rows take ~14 s), so .docx is measured at 2k
+    Benchmark("export.summary_docx", export("summary_docx"), max_rows=2_000, requires=("docx",)),
+    Benchmark("export.invoice_pdf", export("invoice_pdf"), max_rows=1),
+    Benchmark("export.invoice_docx", export("invoice_docx"), max_rows=1, requires=("docx",)),
+    # With the repository's logo; after the first repeat it comes from the asset cache
+    Benchmark("export.invoice_pdf_logo", export("invoice_pdf_logo"), max_rows=1, requires=("PIL",)),
+    Benchmark("export.invoice_docx_logo", export("invoice_docx_logo"), max_rows=1, requires=("docx",)),
+    Benchmark("manager.invoice_doc", run_invoice_doc, setup_manager(1_000), max_rows=1_000, requires=("docx",)),
+    Benchmark("manager.invoice_pdf", run_invoice_pdf, setup_manager(100_000), max_rows=100_000),
+    Benchmark("manager.invoice_batch", run_invoice_batch, setup_manager(1_000_000), max_rows=1_000_000),
+    Benchmark("square.mock", run_square, setup_manager(5_000), max_rows=5_000),
+]
+
+
+# --- Running ---
+
+def missing_module(names):
+    for name in names:
+        try:
+            __import__(name)
+        except ImportError:
+            return name
+    return None
+
+
+def measure(benchmark, ctx, memory=False):
+    state = benchmark.setup(ctx) if benchmark.setup else ctx
+    try:
+        if memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        extra = benchmark.run(state)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+        if benchmark.teardown:
+            benchmark.teardown(state)
+    return elapsed, peak, extra or {}
+
+
+def run_benchmark(benchmark, ctx, repeat, memory):
+    rows = min(ctx.rows, benchmark.max_rows) if benchmark.max_rows else ctx.rows
+    result = {"benchmark": benchmark.name, "rows": rows, "history_rows": ctx.rows}
+    missing = missing_module(benchmark.requires)
+    if missing:
+        result["skipped"] = f"{missing} is not installed"
+        return result
+    if rows < ctx.rows:
+        result["capped"] = True
+    ctx.limit = rows
+    times = []
+    extra = {}
+    for _ in range(repeat):
+        elapsed, _, extra = measure(benchmark, ctx)
+        times.append(elapsed)
+    median = statistics.median(times)
+    result.update(seconds=median, min_seconds=min(times), runs=times,
+                  rows_per_second=rows / median if median else None, extra=extra)
+    if memory:
+        result["peak_bytes"] = measure(benchmark, ctx, memory=True)[1]
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_result(result):
+    name = f"{result['benchmark']:<30} {result['rows']:>10,}"
+    if "skipped" in result:
+        print(f"{name}  skipped ({result['skipped']})")
+        return
+    line = f"{name}  {result['seconds']:8.3f}s"
+    if result["rows_per_second"]:
+        line += f"  {result['rows_per_second']:>12,.0f} rows/s"
+    if result.get("peak_bytes") is not None:
+        line += f"  peak {result['peak_bytes'] / 1e6:7.1f} MB"
+    print(line, flush=True)
+
+
+def run_suite(sizes, names, repeat, memory, seed):
+    selected = [b for b in BENCHMARKS if not names or any(b.name == n or b.name.startswith(n + ".") for n in names)]
+    if not selected:
+        raise SystemExit(f"no benchmark matches {', '.join(names)}")
+    results = []
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            ctx = Context(folder, rows, seed)
+            for benchmark in selected:
+                # Capped benchmarks are measured once, at the first size that reaches the cap
+                if benchmark.max_rows and any(r["benchmark"] == benchmark.name and r["rows"] == benchmark.max_rows
+                                              for r in results):
+                    continue
+                result = run_benchmark(benchmark, ctx, repeat, memory)
+                print_result(result)
+                results.append(result)
+            for store in (ctx._sealed_store, ctx._sqlite_store):
+                if store is not None:
+                    store.close()
+    return results
+
+
+def compare(baseline_path, results_path, tolerance, min_delta):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["benchmark"], r["rows"]): r for r in json.load(f)["results"] if "seconds" in r}
+    with open(results_path, "r", encoding="utf-8") as f:
+        current = json.load(f)["results"]
+    regressions = 0
+    for result in current:
+        old = baseline.get((result["benchmark"], result["rows"]))
+        if old is None or "seconds" not in result:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else 1.0
+        flag = ""
+        # Millisecond-scale benchmarks jitter by more than the tolerance; only count real time lost
+        if ratio > 1 + tolerance and result["seconds"] - old["seconds"] >= min_delta:
+            flag = "  SLOWER"
+            regressions += 1
+        elif ratio < 1 - tolerance and old["seconds"] - result["seconds"] >= min_delta:
+            flag = "  faster"
+        print(f"{result['benchmark']:<30} {result['rows']:>10,}  {old['seconds']:8.3f}s -> {result['seconds']:8.3f}s"
+              f"  x{ratio:5.2f}{flag}")
+    print(f"{regressions} regression(s) beyond {tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the traceability hot paths on synthetic histories")
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help="history sizes, e.g. 10k,100k,1M,10M (default: %(default)s)")
+    parser.add_argument("--only", help="comma-separated benchmarks or groups (logs, filter, export, manager, square)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true", help="add a tracemalloc run for peak memory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="results file (default: benchmark_<date>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RESULTS"), help="compare two result files")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="slowdown ratio counted as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="smallest slowdown in seconds counted as a regression (default: %(default)s)")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare, args.tolerance, args.min_delta)
+    if args.list:
+        for benchmark in BENCHMARKS:
+            cap = f" (capped at {benchmark.max_rows:,} rows)" if benchmark.max_rows else ""
+            print(f"{benchmark.name}{cap}")
+        return 0
+
+    sizes = [parse_rows(value) for value in args.rows.split(",")]
+    names = [name.strip() for name in args.only.split(",")] if args.only else []
+    started = datetime.datetime.now()
+    results = run_suite(sizes, names, max(1, args.repeat), args.memory, args.seed)
+    report = {
+        "suite": SUITE_VERSION,
+        "created": started.isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    out = args.out or f"benchmark_{started.strftime('%Y-%m-%d_%H%M%S')}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from tkinter import ttk
+
+# Virtualized delivery list: the Treeview only holds the rows on screen, read from the
+# store a page at a time. Items are keyed by record id, so selections survive scrolling.
+
+COLUMNS = (
+    ("mushroom_id", "Mushroom Type", 140),
+    ("box_number", "Box", 60),
+    ("restaurant_id", "Restaurant", 130),
+    ("pack_date", "Packed", 100),
+    ("ship_date", "Shipped", 100),
+)
+PAGE_SIZE = 200
+CACHED_PAGES = 8
+
+
+class LogBrowser(ttk.Frame):
+    def __init__(self, master, store, height=15, start=None, end=None, search=None):
+        super().__init__(master)
+        self.store = store
+        self.filters = (start, end, search)
+        self.sort_by = None  # None is insertion order
+        self.descending = False
+        self.visible = height
+        self.offset = 0
+        self.total = 0
+        self.pages = OrderedDict()
+        self.selected = set()
+        self._shown = []
+        self._syncing = False
+
+        self.tree = ttk.Treeview(self, columns=[field for field, _, _ in COLUMNS], show="headings",
+                                 height=height, selectmode="extended")
+        for field, heading, width in COLUMNS:
+            self.tree.heading(field, text=heading, command=lambda field=field: self.sort(field))
+            self.tree.column(field, width=width, anchor="w")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scrollbar)
+        self.status = ttk.Label(self)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.status.grid(row=1, column=0, columnspan=2, sticky="w", pady=(4, 0))
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1, "units"))
+        self.tree.bind("<Up>", lambda e: self.step(-1))
+        self.tree.bind("<Down>", lambda e: self.step(1))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        self.tree.bind("<Next>", lambda e: self.scroll(1, "pages"))
+        self.tree.bind("<Home>", lambda e: self.scroll_to(0))
+        self.tree.bind("<End>", lambda e: self.scroll_to(self.total))
+        self.refresh()
+
+    # --- Data ---
+
+    def set_filters(self, start=None, end=None, search=None):
+        # Rows that drop out of view must not stay selected for a delete
+        self.filters = (start, end, search)
+        self.selected = set()
+        self.offset = 0
+        self.refresh()
+
+    def refresh(self):
+        # Re-reads the count and drops cached pages, e.g. after a delete
+        self.pages.clear()
+        self.total = self.store.count(*self.filters)
+        self.scroll_to(self.offset)
+
+    def _page(self, number):
+        page = self.pages.get(number)
+        if page is None:
+            start, end, search = self.filters
+            page = list(self.store.query(start, end, search, limit=PAGE_SIZE, offset=number * PAGE_SIZE,
+                                         newest_first=self.descending, sort_by=self.sort_by))
+            self.pages[number] = page
+            if len(self.pages) > CACHED_PAGES:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(number)
+        return page
+
+    def _rows(self, offset, count):
+        rows = []
+        number = offset // PAGE_SIZE
+        skip = offset - number * PAGE_SIZE
+        while len(rows) < count:
+            page = self._page(number)
+            rows.extend(page[skip:skip + count - len(rows)])
+            if len(page) < PAGE_SIZE:
+                break
+            number += 1
+            skip = 0
+        return rows
+
+    def sort(self, field):
+        # Clicking the sorted column again flips the direction
+        if self.sort_by == field:
+            self.descending = not self.descending
+        else:
+            self.sort_by, self.descending = field, False
+        for column, heading, _ in COLUMNS:
+            arrow = (" ▼" if self.descending else " ▲") if column == field else ""
+            self.tree.heading(column, text=heading + arrow)
+        self.offset = 0
+        self.refresh()
+
+    # --- Rendering ---
+
+    def scroll_to(self, offset):
+        self.offset = max(0, min(offset, self.total - self.visible))
+        records = self._rows(self.offset, self.visible)
+        self._syncing = True
+        self.tree.delete(*self.tree.get_children())
+        for record in records:
+            self.tree.insert("", "end", iid=str(record.rid), values=record.row())
+        self._shown = [str(record.rid) for record in records]
+        self.tree.selection_set([iid for iid in self._shown if int(iid) in self.selected])
+        # The selection event fires later; it must not drop rids scrolled out of view
+        self.after_idle(self._done_syncing)
+        self._update_scrollbar()
+
+    def _done_syncing(self):
+        self._syncing = False
+
+    def _update_scrollbar(self):
+        if self.total:
+            first = self.offset / self.total
+            last = min(self.offset + self.visible, self.total) / self.total
+        else:
+            first, last = 0, 1
+        self.scrollbar.set(first, last)
+        shown = f"{self.offset + 1:,}-{self.offset + len(self._shown):,} of {self.total:,}" if self._shown else "0"
+        picked = f", {len(self.selected):,} selected" if self.selected else ""
+        self.status.config(text=f"Showing {shown}{picked}")
+
+    def scroll(self, amount, what="units"):
+        self.scroll_to(self.offset + amount * (self.visible - 1 if what == "pages" else 3 if what == "units" else 1))
+        return "break"
+
+    def step(self, direction):
+        # Arrow keys move the focus row and only scroll at the edges
+        focus = self.tree.focus()
+        position = self._shown.index(focus) if focus in self._shown else -1
+        target = position + direction
+        if 0 <= target < len(self._shown):
+            iid = self._shown[target]
+        else:
+            self.scroll_to(self.offset + direction)
+            if not self._shown:
+                return "break"
+            iid = self._shown[0 if direction < 0 else -1]
+        self.selected = {int(iid)}
+        self.scroll_to(self.offset)
+        self.tree.focus(iid)
+        self.tree.see(iid)
+        return "break"
+
+    def on_scrollbar(self, action, amount, what=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.total))
+        else:
+            self.scroll(int(amount), what)
+
+    def on_resize(self, event):
+        # Shows as many rows as now fit; the row height is measured from a drawn row
+        if not self._shown:
+            return
+        bbox = self.tree.bbox(self._shown[0])
+        if not bbox or bbox[3] <= 0:
+            return
+        rows = max(1, (event.height - bbox[1]) // bbox[3])
+        if rows != self.visible:
+            self.visible = rows
+            self.scroll_to(self.offset)
+
+    def on_select(self, _event):
+        if self._syncing:
+            return
+        shown = {int(iid) for iid in self._shown}
+        self.selected = (self.selected - shown) | {int(iid) for iid in self.tree.selection()}
+        self._update_scrollbar()
+
+    def selected_rids(self):
+        return sorted(self.selected)
+
+    def clear_selection(self):
+        self.selected = set()
+        self.scroll_to(self.offset)
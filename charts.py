@@ -0,0 +1,125 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from metrics import timed
+
+# Delivery charts rendered off-screen with Agg into PNG files, cached on disk under a
+# digest of the counts they draw.
+
+CACHE_DIR = "chart_cache"
+CACHE_KEEP = 40
+FIGURE_SIZE = (12, 5)
+DPI = 100
+
+# Largest span (in days) drawn with one bar per day / per week; beyond that, per month
+DAILY_SPAN = 62
+WEEKLY_SPAN = 7 * 104
+
+# Bump when the figure layout changes so stale images are not reused
+STYLE_VERSION = 1
+
+_render_lock = threading.Lock()
+
+
+def bin_dates(date_counts):
+    # {pack date ordinal: deliveries} -> (unit, [(bin start ordinal, deliveries)])
+    if not date_counts:
+        return "day", []
+    first, last = min(date_counts), max(date_counts)
+    span = last - first + 1
+    if span <= DAILY_SPAN:
+        return "day", sorted(date_counts.items())
+    bins = {}
+    if span <= WEEKLY_SPAN:
+        unit = "week"
+        for day, n in date_counts.items():
+            start = (day - 1) // 7 * 7 + 1  # Monday
+            bins[start] = bins.get(start, 0) + n
+    else:
+        unit = "month"
+        for day, n in date_counts.items():
+            start = datetime.date.fromordinal(day).replace(day=1).toordinal()
+            bins[start] = bins.get(start, 0) + n
+    return unit, sorted(bins.items())
+
+
+def chart_key(mushroom_counts, date_counts):
+    data = json.dumps([STYLE_VERSION, sorted(mushroom_counts.items()), sorted(date_counts.items())])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:20]
+
+
+@timed("charts.render")
+def render_png(path, mushroom_counts, date_counts):
+    # mushroom_counts: {mushroom name: deliveries}; date_counts: {pack date ordinal: deliveries}
+    unit, bins = bin_dates(date_counts)
+    fig = Figure(figsize=FIGURE_SIZE, dpi=DPI)
+    FigureCanvasAgg(fig)
+    fig.suptitle("Delivery Statistics", fontsize=16)
+    ax1, ax2 = fig.subplots(1, 2, gridspec_kw={"width_ratios": [1, 2]})
+
+    ax1.bar(list(mushroom_counts.keys()), list(mushroom_counts.values()), color="skyblue")
+    ax1.set_title("Deliveries per Mushroom Type")
+    ax1.set_xlabel("Mushroom Type")
+    ax1.set_ylabel("Deliveries")
+    ax1.tick_params(axis="x", rotation=45)
+
+    dates = [datetime.date.fromordinal(start) for start, _ in bins]
+    widths = {"day": 0.8, "week": 6, "month": 26}[unit]
+    ax2.bar(dates, [n for _, n in bins], width=widths, align="edge" if unit != "day" else "center",
+            color="lightgreen")
+    ax2.set_title(f"Deliveries per {unit.capitalize()} (Pack Date)")
+    ax2.set_xlabel("Pack Date" if unit == "day" else f"{unit.capitalize()} Starting")
+    ax2.set_ylabel("Deliveries")
+    ax2.tick_params(axis="x", rotation=45)
+
+    fig.tight_layout()
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    fig.savefig(tmp_path, format="png")
+    os.replace(tmp_path, path)
+    return path
+
+
+class ChartCache:
+    def __init__(self, folder=CACHE_DIR, keep=CACHE_KEEP):
+        self.folder = folder
+        self.keep = keep
+
+    def path(self, mushroom_counts, date_counts):
+        return os.path.join(self.folder, f"deliveries_{chart_key(mushroom_counts, date_counts)}.png")
+
+    def lookup(self, mushroom_counts, date_counts):
+        path = self.path(mushroom_counts, date_counts)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # Recently used images survive pruning
+        return path
+
+    def render(self, mushroom_counts, date_counts):
+        # Renders unless an identical chart is already cached; returns the PNG path
+        path = self.path(mushroom_counts, date_counts)
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        os.makedirs(self.folder, exist_ok=True)
+        # Agg itself is thread-safe per figure, but matplotlib's font cache is not
+        with _render_lock:
+            if os.path.exists(path):
+                return path  # Rendered by a job that held the lock first
+            render_png(path, mushroom_counts, date_counts)
+        self._prune()
+        return path
+
+    def _prune(self):
+        try:
+            files = [os.path.join(self.folder, name) for name in os.listdir(self.folder) if name.endswith(".png")]
+            files.sort(key=os.path.getmtime, reverse=True)
+            for old in files[self.keep:]:
+                os.remove(old)
+        except OSError:
+            pass  # Another job pruned at the same time
@@ -0,0 +1,379 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import metrics
+from config import LOG_FILE, SERVICE_HOST, SERVICE_PORT, SETTINGS_FILE
+
+# Headless entry point for scripts and cron:  python -m cli <command> ...
+# Commands import what they need, so tkinter and python-docx are never loaded up front.
+
+
+def load_settings(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def relative_date(value):
+    # "today"/"yesterday" for cron jobs; anything else is passed through for validation
+    if value in ("today", "yesterday"):
+        day = datetime.date.today() - datetime.timedelta(days=value == "yesterday")
+        return day.isoformat()
+    return value
+
+
+def parse_date(value):
+    from records import date_to_ordinal
+
+    value = relative_date(value)
+    try:
+        return date_to_ordinal(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}' (expected YYYY-MM-DD, today or yesterday)")
+
+
+def open_manager(args):
+    from manager import TraceabilityManager
+    from storage import open_store
+
+    settings = load_settings(args.settings)
+    store = open_store(settings, args.log_file)
+    skipped = store.load() if store.exists() else 0
+    if skipped:
+        print(f"warning: {skipped} unreadable log entries are left out (they stay in the log file)", file=sys.stderr)
+    return TraceabilityManager(store), settings
+
+
+def output_path(args, settings, stem, ext):
+    from exports import export_path
+
+    if args.out:
+        return args.out
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    return export_path(settings.get("export_folder", ""), stem, today, ext)
+
+
+def report_added(records):
+    print(f"Added {len(records)} deliveries.")
+
+
+def cmd_add(args, manager, settings):
+    # Same validation as bulk adds, so names and ids both work
+    record, = manager.add_deliveries([(args.mushroom, args.box, args.restaurant, args.pack, args.ship)])
+    print(record.label())
+
+
+def cmd_add_range(args, manager, settings):
+    report_added(manager.add_box_range(args.mushroom, args.first, args.last, args.restaurant, args.pack, args.ship))
+
+
+def cmd_import(args, manager, settings):
+    report_added(manager.import_deliveries(args.path))
+
+
+def cmd_list(args, manager, settings):
+    store = manager.store
+    if args.count:
+        print(store.count(args.start, args.end, args.search))
+        return
+    for record in store.query(args.start, args.end, args.search, limit=args.limit, newest_first=args.newest):
+        print(record.label())
+
+
+def cmd_compact(args, manager, settings):
+    manager.store.save()
+    print("Logs compacted.")
+
+
+def cmd_export(args, manager, settings):
+    import exports
+
+    store = manager.store
+    records = store.snapshot(args.start, args.end)
+    if args.format == "csv":
+        path = exports.write_csv(output_path(args, settings, "traceability_log", "csv"), records)
+    elif args.format == "excel":
+        split_by = args.split or settings.get("excel_split", "none")
+        path = exports.write_excel(output_path(args, settings, "traceability_log", "xlsx"), records,
+                                   split_by=split_by)
+    else:
+        from config import MUSHROOM_TYPES
+
+        engine = args.engine or settings.get("report_engine", "native")
+        counts = {MUSHROOM_TYPES.get(k, str(k)): v for k, v in store.count_by("mushroom_id", args.start, args.end).items()}
+        today = datetime.date.today().strftime("%Y-%m-%d")
+        logo_path = settings.get("logo_path", "")
+        analytics = None if args.no_analytics else exports.summary_analytics(records)
+        chart_path = None
+        if not args.no_charts:
+            from charts import CACHE_DIR, ChartCache
+
+            cache = ChartCache(os.path.join(settings.get("export_folder", "") or ".", CACHE_DIR))
+            chart_path = cache.render(counts, store.count_by("pack_date", args.start, args.end))
+        if engine == "native":
+            path = output_path(args, settings, "summary_report", "pdf")
+            warnings = exports.write_summary_pdf(path, records, counts, today, logo_path, analytics=analytics,
+                                                 chart_path=chart_path)
+        else:
+            doc_name = output_path(args, settings, "summary_report", "docx")
+            warnings = exports.write_summary_docx(doc_name, records, counts, today, logo_path, analytics=analytics,
+                                                  chart_path=chart_path)
+            path = doc_name
+            if engine == "word":
+                path = exports.convert_to_pdf(doc_name, os.path.splitext(doc_name)[0] + ".pdf")
+        for warning in warnings:
+            print(f"warning: {warning}", file=sys.stderr)
+    print(path)
+
+
+def cmd_analytics(args, manager, settings):
+    import analytics
+
+    frame = analytics.DeliveryFrame.from_records(manager.store.snapshot(args.start, args.end))
+    sys.stdout.write(analytics.render_text(analytics.report_sections(analytics.summarize(frame, args.weeks))))
+
+
+def branding(settings):
+    # (logo, invoice template) from Settings; unset or missing files are left out
+    from assets import existing
+
+    return existing(settings.get("logo_path", "")), existing(settings.get("invoice_template", ""))
+
+
+def cmd_invoice(args, manager, settings):
+    logo_path, template_path = branding(settings)
+    if args.format == "docx":
+        path = output_path(args, settings, "invoice", "docx")
+        manager.generate_invoice_doc(path, args.start, args.end, logo_path, template_path)
+    else:
+        path = output_path(args, settings, "invoice", "pdf")
+        manager.generate_invoice_pdf(path, args.start, args.end, logo_path)
+    print(path)
+
+
+def cmd_invoices(args, manager, settings):
+    from invoices import INVOICE_DIR
+
+    engine = {"pdf": "native", "docx": "docx"}.get(args.format) or settings.get("report_engine", "native")
+    folder = args.out or os.path.join(settings.get("export_folder", "") or ".", INVOICE_DIR)
+    logo_path, template_path = branding(settings)
+    entries = manager.generate_invoice_batch(folder, args.period, args.start, args.end, engine, args.workers,
+                                             logo_path=logo_path, template_path=template_path)
+    for entry in entries:
+        print(f"{entry['file']}\t{entry['invoice_number']}\t{entry['deliveries']}\t"
+              f"{'unchanged' if entry['reused'] else 'written'}")
+    print(f"{len(entries)} invoices in {folder}")
+
+
+def cmd_square(args, manager, settings):
+    from config import SQUARE_MAX_CONCURRENCY, SQUARE_RATE_LIMIT
+
+    results = manager.create_square_invoices(args.start, args.end,
+                                             max_workers=args.workers or SQUARE_MAX_CONCURRENCY,
+                                             rate=args.rate or SQUARE_RATE_LIMIT)
+    failed = [result for result in results if not result.success]
+    for result in failed:
+        print(f"failed: {result.invoice_number}: {result.errors}", file=sys.stderr)
+    print(f"Submitted {len(results) - len(failed)} of {len(results)} invoices.")
+    return 1 if failed else 0
+
+
+def cmd_serve(args, manager, settings):
+    from service import serve
+
+    def ready(address):
+        print(f"Serving on http://{address[0]}:{address[1]} (Ctrl+C to stop)", file=sys.stderr)
+
+    serve(manager, settings, args.host, args.port, args.workers, ready=ready)
+
+
+def backup_store(args, settings):
+    from backups import BACKUP_DIR, BackupStore
+
+    return BackupStore(os.path.join(args.folder or settings.get("export_folder", "") or ".", BACKUP_DIR))
+
+
+def cmd_backup(args, manager, settings):
+    backups = backup_store(args, settings)
+    if args.list:
+        from records import ordinal_to_date
+
+        for backup in backups.list():
+            records = "?" if backup["records"] is None else backup["records"]
+            packed = "" if backup["first_pack"] is None else \
+                f"{ordinal_to_date(backup['first_pack'])}..{ordinal_to_date(backup['last_pack'])}"
+            print(f"{backup['name']}\t{backup['created']}\t{records}\t{packed}\t{backup['reason']}")
+        return
+    backup = backups.create(manager.store.snapshot(), args.reason)
+    print(f"{backup['name']}: {backup['records']} deliveries, {backup['new_segments']} new segment(s),"
+          f" {backup['new_bytes']} bytes written")
+    if args.keep is not None:
+        backups.prune(args.reason, args.keep)
+
+
+def cmd_restore(args, manager, settings):
+    backups = backup_store(args, settings)
+    if args.compare or args.merge:
+        # Neither replaces anything: compare only reports, merge adds what the logs lack
+        missing, added = backups.diff(args.name, manager.store.snapshot())
+        print(f"{len(missing)} deliveries only in the backup, {len(added)} only in the current logs")
+        if args.merge and missing:
+            from records import parse_labels
+
+            records, skipped = parse_labels(missing)
+            manager.store.add_many(records)
+            print(f"Added {len(records)} deliveries from {args.name}.")
+        return
+    if not args.yes:
+        raise ValueError("restoring replaces every logged delivery; pass --yes to confirm")
+    records, skipped = backups.records(args.name)
+    if skipped:
+        print(f"warning: skipped {skipped} unreadable backup entries", file=sys.stderr)
+    manager.store.replace_all(records)
+    print(f"Restored {len(records)} deliveries from {args.name}.")
+
+
+def add_range_arguments(parser):
+    parser.add_argument("--start", type=parse_date, help="first pack date (YYYY-MM-DD, today, yesterday)")
+    parser.add_argument("--end", type=parse_date, help="last pack date (inclusive)")
+
+
+def add_delivery_arguments(parser):
+    parser.add_argument("--mushroom", required=True, help="mushroom type id or name")
+    parser.add_argument("--restaurant", required=True, help="restaurant id or name")
+    parser.add_argument("--pack", required=True, type=relative_date, help="pack date (YYYY-MM-DD, today, yesterday)")
+    parser.add_argument("--ship", required=True, type=relative_date, help="ship date (YYYY-MM-DD, today, yesterday)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Mushroom traceability from the command line")
+    parser.add_argument("--settings", default=SETTINGS_FILE, help="settings file (default: %(default)s)")
+    parser.add_argument("--log-file", default=LOG_FILE, help="log file (default: %(default)s)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write timings on exit: FILE.json, FILE.prom (Prometheus text) or - for a table on stderr")
+    parser.add_argument("--trace-memory", action="store_true", help="also record peak memory per operation (slower)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add one delivery")
+    add.add_argument("--box", required=True, type=int)
+    add_delivery_arguments(add)
+    add.set_defaults(func=cmd_add)
+
+    add_range = commands.add_parser("add-range", help="add a range of boxes with one write")
+    add_range.add_argument("--first", required=True, type=int, help="first box number")
+    add_range.add_argument("--last", required=True, type=int, help="last box number (inclusive)")
+    add_delivery_arguments(add_range)
+    add_range.set_defaults(func=cmd_add_range)
+
+    import_ = commands.add_parser("import", help="add deliveries from a CSV/XLSX file with one write")
+    import_.add_argument("path")
+    import_.set_defaults(func=cmd_import)
+
+    list_ = commands.add_parser("list", help="print deliveries matching the filters")
+    add_range_arguments(list_)
+    list_.add_argument("--search", help="substring of the delivery label")
+    list_.add_argument("--limit", type=int)
+    list_.add_argument("--newest", action="store_true", help="newest first")
+    list_.add_argument("--count", action="store_true", help="only print the number of matches")
+    list_.set_defaults(func=cmd_list)
+
+    compact = commands.add_parser("compact", help="rewrite the log snapshot and archive months that left the hot window")
+    compact.set_defaults(func=cmd_compact)
+
+    export = commands.add_parser("export", help="write a CSV, Excel or summary report")
+    export.add_argument("format", choices=["csv", "excel", "summary"])
+    export.add_argument("--out", help="output file (default: export folder, dated name)")
+    export.add_argument("--split", choices=["none", "restaurant", "month"], help="Excel sheet split")
+    export.add_argument("--engine", choices=["native", "word", "docx"], help="summary report engine")
+    export.add_argument("--no-analytics", action="store_true", help="leave the analytics out of the summary")
+    export.add_argument("--no-charts", action="store_true", help="leave the charts out of the summary")
+    add_range_arguments(export)
+    export.set_defaults(func=cmd_export)
+
+    analytics = commands.add_parser("analytics", help="print lead times, volumes and restaurant trends")
+    analytics.add_argument("--weeks", type=int, default=8, help="weeks in the restaurant table")
+    add_range_arguments(analytics)
+    analytics.set_defaults(func=cmd_analytics)
+
+    invoice = commands.add_parser("invoice", help="write an invoice document for the deliveries")
+    invoice.add_argument("--format", choices=["pdf", "docx"], default="pdf")
+    invoice.add_argument("--out", help="output file (default: export folder, dated name)")
+    add_range_arguments(invoice)
+    invoice.set_defaults(func=cmd_invoice)
+
+    invoices = commands.add_parser("invoices", help="write one invoice per restaurant and billing period, in parallel")
+    invoices.add_argument("--period", choices=["month", "week"], default="month",
+                          help="billing period (default: month)")
+    invoices.add_argument("--start", type=parse_date, help="first ship date; widened to the start of its period")
+    invoices.add_argument("--end", type=parse_date, help="last ship date; widened to the end of its period")
+    invoices.add_argument("--format", choices=["pdf", "docx"], help="default: the report engine setting")
+    invoices.add_argument("--out", help="output folder (default: <export folder>/invoices)")
+    invoices.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    invoices.set_defaults(func=cmd_invoices)
+
+    square = commands.add_parser("square", help="submit Square invoices (exit status 1 if any failed)")
+    square.add_argument("--workers", type=int, help="parallel requests")
+    square.add_argument("--rate", type=float, help="requests per second")
+    add_range_arguments(square)
+    square.set_defaults(func=cmd_square)
+
+    serve = commands.add_parser("serve", help="serve the logs over HTTP/JSON for scanners and the order system")
+    serve.add_argument("--host", default=SERVICE_HOST, help="address to listen on (default: %(default)s)")
+    serve.add_argument("--port", type=int, default=SERVICE_PORT, help="port (default: %(default)s)")
+    serve.add_argument("--workers", type=int, default=4,
+                       help="threads for exports, invoices and Square (default: %(default)s)")
+    serve.set_defaults(func=cmd_serve)
+
+    backup = commands.add_parser("backup", help="back up all deliveries (only changed segments are written)")
+    backup.add_argument("--folder", help="base folder (default: export folder); backups go in <folder>/backups")
+    backup.add_argument("--list", action="store_true", help="list backups instead of making one")
+    backup.add_argument("--reason", default="manual", help="label stored with the backup (default: manual)")
+    backup.add_argument("--keep", type=int, help="then keep only the newest KEEP backups with this reason")
+    backup.set_defaults(func=cmd_backup)
+
+    restore = commands.add_parser("restore", help="replace all deliveries with a backup")
+    restore.add_argument("name", help="backup name, as shown by 'backup --list'")
+    restore.add_argument("--folder", help="base folder (default: export folder); backups are in <folder>/backups")
+    restore.add_argument("--yes", action="store_true", help="confirm replacing the current logs")
+    restore.add_argument("--compare", action="store_true", help="only count what differs from the current logs")
+    restore.add_argument("--merge", action="store_true", help="add the backup's missing deliveries, replace nothing")
+    restore.set_defaults(func=cmd_restore)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    manager = None
+    if args.trace_memory:
+        metrics.trace_memory(True)
+    try:
+        manager, settings = open_manager(args)
+        return args.func(args, manager, settings) or 0
+    except ValueError as e:
+        errors = getattr(e, "errors", None)
+        if errors:
+            # Bulk validation lists every bad row; nothing was stored
+            for where, message in errors:
+                print(f"{where}: {message}", file=sys.stderr)
+            print(f"error: {len(errors)} invalid row(s); nothing was added", file=sys.stderr)
+        else:
+            print(f"error: {e}", file=sys.stderr)
+        return 2
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if manager is not None:
+            manager.store.close()
+        if args.metrics == "-":
+            print(metrics.render_text(metrics.REGISTRY.snapshot()), end="", file=sys.stderr)
+        elif args.metrics:
+            metrics.dump(args.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
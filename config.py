@@ -12,6 +12,10 @@ RESTAURANT_ASSIGNMENTS = {
     3: "Restaurant C"
 }
 
+# Files the GUI and the CLI share (relative to the working directory)
+LOG_FILE = "logs.ndjson"
+SETTINGS_FILE = "settings.json"
+
 # Mock values for Square API (not needed in mock mode but kept for compatibility)
 SQUARE_ACCESS_TOKEN = "mock_token"
 SQUARE_LOCATION_ID = "mock_location"
@@ -20,3 +24,17 @@ SQUARE_CUSTOMER_ID = "mock_customer"
 
 # Dynamic toggle: Read from environment variable
 USE_MOCK_SQUARE = os.getenv("USE_MOCK_SQUARE", "1") == "1"  # Defaults to mock mode
+
+# Invoice submission: parallel requests, requests per second, retries on transient errors
+SQUARE_MAX_CONCURRENCY = int(os.getenv("SQUARE_MAX_CONCURRENCY", "8"))
+SQUARE_RATE_LIMIT = float(os.getenv("SQUARE_RATE_LIMIT", "10"))
+SQUARE_MAX_RETRIES = int(os.getenv("SQUARE_MAX_RETRIES", "4"))
+
+# Mock client behaviour, for measuring throughput offline
+MOCK_SQUARE_LATENCY = float(os.getenv("MOCK_SQUARE_LATENCY", "0"))  # seconds per call
+MOCK_SQUARE_FAILURE_RATE = float(os.getenv("MOCK_SQUARE_FAILURE_RATE", "0"))  # transient (rate limited)
+MOCK_SQUARE_ERROR_RATE = float(os.getenv("MOCK_SQUARE_ERROR_RATE", "0"))  # permanent (invalid request)
+
+# Local HTTP service (python -m cli serve); only this machine can reach the default host
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8765"))
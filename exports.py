@@ -0,0 +1,330 @@
+import contextlib
+import csv
+import io
+import multiprocessing
+import os
+import re
+import threading
+
+from assets import ASSETS
+from jobs import JobCancelled
+from metrics import timed
+from pdf import PdfWriter
+from records import EXPORT_HEADERS
+
+# Document builders for the GUI's background jobs and the CLI; each takes an optional Job
+# for progress and cancellation, and none of them touch Tk.
+
+PROGRESS_EVERY = 500
+
+# CSV output is flushed to disk in chunks of this many bytes
+WRITE_BUFFER = 1 << 20
+
+# Excel's hard limit per sheet (header row included); larger exports continue on a new sheet
+EXCEL_MAX_ROWS = 1048576
+EXCEL_SPLITS = ("none", "restaurant", "month")
+
+# How invoices and summary reports are produced: "native" writes the PDF directly,
+# "word" builds a .docx and converts it through docx2pdf, "docx" stops at the .docx
+REPORT_ENGINES = ("native", "word", "docx")
+
+# Relative column widths of the delivery table in native PDFs
+TABLE_WEIGHTS = [3, 2, 3, 2.5, 2.5]
+
+TABLE_HEADERS = ["Mushroom Type", "Box Number", "Restaurant", "Pack Date", "Ship Date"]
+
+
+def export_path(folder, stem, today, ext):
+    return os.path.join(folder or ".", f"{stem}_{today}.{ext}")
+
+
+def _tracked(records, total=None, job=None):
+    # Every exporter pulls records through this generator, so nothing is materialised
+    # on the way to the file and progress/cancellation is checked as rows stream by
+    for done, record in enumerate(records, 1):
+        if job is not None and done % PROGRESS_EVERY == 0:
+            job.progress(done, total)
+        yield record
+
+
+@contextlib.contextmanager
+def atomic_output(path):
+    # Writes go to a private temp file that only replaces `path` once complete, so a
+    # cancelled or failed job never leaves half a file and parallel jobs don't collide
+    base, ext = os.path.splitext(path)
+    tmp_path = f"{base}.{os.getpid()}-{threading.get_ident()}.part{ext}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@timed("export.csv")
+def write_csv(path, records, total=None, job=None):
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "w", newline="", buffering=WRITE_BUFFER) as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_HEADERS)
+            writer.writerows(record.row() for record in _tracked(records, total, job))
+    return path
+
+
+def _sheet_title(key, part):
+    title = re.sub(r"[\\/*?:\[\]]", "-", key or "Traceability Log")
+    if part > 1:
+        suffix = f" ({part})"
+        return title[:31 - len(suffix)] + suffix
+    return title[:31]
+
+
+def _sheet_key(split_by):
+    if split_by == "restaurant":
+        return lambda record: record.restaurant_name
+    if split_by == "month":
+        return lambda record: record.pack_date_str[:7]
+    return lambda record: None
+
+
+@timed("export.excel")
+def write_excel(path, records, total=None, job=None, split_by="none"):
+    # Write-only workbooks stream each sheet's rows to a temp file instead of keeping
+    # cell objects around, so memory stays flat however long the history is
+    if split_by not in EXCEL_SPLITS:
+        raise ValueError(f"Cannot split Excel sheets by {split_by}")
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    key_of = _sheet_key(split_by)
+    sheets = {}
+
+    def sheet_for(key):
+        # [sheet, rows written, part number]
+        entry = sheets.get(key)
+        if entry is None or entry[1] >= EXCEL_MAX_ROWS:
+            part = entry[2] + 1 if entry else 1
+            sheet = workbook.create_sheet(_sheet_title(key, part))
+            sheet.append(EXPORT_HEADERS)
+            entry = sheets[key] = [sheet, 1, part]
+        return entry
+
+    for record in _tracked(records, total, job):
+        entry = sheet_for(key_of(record))
+        entry[0].append(record.row())
+        entry[1] += 1
+    if not sheets:
+        sheet_for(None)
+
+    if job is not None:
+        job.progress(total or 0, total, "saving")
+    with atomic_output(path) as tmp_path:
+        workbook.save(tmp_path)
+    return path
+
+
+def add_logo(doc, logo_path):
+    import docx.shared
+
+    # Measured, scaled and read once per process; see assets.py
+    logo = ASSETS.logo(logo_path)
+    doc.add_picture(io.BytesIO(logo.data), width=docx.shared.Inches(logo.width_inches))
+
+
+def _add_table(doc, records, total=None, job=None):
+    table = doc.add_table(rows=1, cols=5)
+    table.style = 'Table Grid'
+    hdr = table.rows[0].cells
+    for i, header in enumerate(TABLE_HEADERS):
+        hdr[i].text = header
+
+    for record in _tracked(records, total, job):
+        row = table.add_row().cells
+        for i, value in enumerate(record.row()):
+            row[i].text = value
+
+
+def _add_sections(doc, sections):
+    # Blocks from analytics.report_sections()
+    for section in sections:
+        if section[0] == "heading":
+            doc.add_heading(section[1], level=section[2])
+        elif section[0] == "bullets":
+            for text in section[1]:
+                doc.add_paragraph(text, style="List Bullet")
+        else:
+            headers, rows = section[1], section[2]
+            table = doc.add_table(rows=1, cols=len(headers))
+            table.style = 'Table Grid'
+            for cell, header in zip(table.rows[0].cells, headers):
+                cell.text = header
+            for row in rows:
+                for cell, value in zip(table.add_row().cells, row):
+                    cell.text = value
+
+
+@timed("export.summary_docx")
+def write_summary_docx(path, records, mushroom_counts, today, logo_path=None, total=None, job=None, analytics=None,
+                       chart_path=None):
+    # Returns warnings (e.g. an unreadable logo) that did not stop the report
+    warnings = []
+    doc = ASSETS.document()
+
+    # Insert logo first if available
+    if logo_path and os.path.exists(logo_path):
+        try:
+            add_logo(doc, logo_path)
+        except Exception as e:
+            warnings.append(f"Failed to insert logo: {e}")
+
+    # Add Title and Metadata
+    doc.add_heading('Mushroom Deliveries Summary', 0)
+    doc.add_paragraph(f"Export Date: {today}")
+    doc.add_paragraph(f"Total Deliveries: {sum(mushroom_counts.values())}")
+
+    # Deliveries per Mushroom Type
+    doc.add_heading('Deliveries per Mushroom Type', level=1)
+    for mushroom, count in mushroom_counts.items():
+        doc.add_paragraph(f"{mushroom}: {count} deliveries", style="List Bullet")
+
+    if chart_path:
+        import docx.shared
+
+        doc.add_picture(chart_path, width=docx.shared.Inches(6.5))
+
+    if analytics:
+        _add_sections(doc, analytics)
+
+    # Detailed Deliveries Table
+    doc.add_heading('Detailed Deliveries', level=1)
+    _add_table(doc, records, total, job)
+
+    if job is not None:
+        job.progress(total or 0, total, "saving")
+    with atomic_output(path) as tmp_path:
+        doc.save(tmp_path)
+    return warnings
+
+
+@timed("export.invoice_docx")
+def write_invoice_docx(path, record, logo_path=None, template_path=None):
+    # Starts from the invoice template when one is set; the logo goes above the title
+    doc = ASSETS.document(template_path)
+    if logo_path:
+        add_logo(doc, logo_path)
+    doc.add_heading('Mushroom Traceability Invoice', 0)
+    # Only include most recent entry
+    _add_table(doc, [record] if record else [])
+    with atomic_output(path) as tmp_path:
+        doc.save(tmp_path)
+    return path
+
+
+def _rows(records, total=None, job=None):
+    return (record.row() for record in _tracked(records, total, job))
+
+
+def _pdf_sections(pdf, sections):
+    for section in sections:
+        if section[0] == "heading":
+            pdf.heading(section[1], section[2])
+        elif section[0] == "bullets":
+            for text in section[1]:
+                pdf.paragraph(text, bullet=True)
+        else:
+            pdf.table(section[1], section[2], section[3])
+
+
+@timed("export.summary_pdf")
+def write_summary_pdf(path, records, mushroom_counts, today, logo_path=None, total=None, job=None, analytics=None,
+                      chart_path=None):
+    # Same layout as write_summary_docx; table pages are written out as they fill up
+    warnings = []
+    with atomic_output(path) as tmp_path:
+        with PdfWriter(tmp_path) as pdf:
+            pdf.new_page()
+            if logo_path and os.path.exists(logo_path):
+                try:
+                    pdf.image(ASSETS.logo(logo_path).pdf, max_width=144)
+                except Exception as e:
+                    warnings.append(f"Failed to insert logo: {e}")
+
+            pdf.heading('Mushroom Deliveries Summary', 0)
+            pdf.paragraph(f"Export Date: {today}")
+            pdf.paragraph(f"Total Deliveries: {sum(mushroom_counts.values())}")
+
+            pdf.heading('Deliveries per Mushroom Type', 1)
+            for mushroom, count in mushroom_counts.items():
+                pdf.paragraph(f"{mushroom}: {count} deliveries", bullet=True)
+
+            if chart_path:
+                pdf.image(chart_path)
+
+            if analytics:
+                _pdf_sections(pdf, analytics)
+
+            pdf.heading('Detailed Deliveries', 1)
+            pdf.table(TABLE_HEADERS, _rows(records, total, job), TABLE_WEIGHTS)
+    return warnings
+
+
+@timed("export.analytics")
+def summary_analytics(records):
+    # Report sections for the summary's analytics part, or None without NumPy
+    try:
+        import analytics
+    except ImportError:
+        return None
+    return analytics.report_sections(analytics.summarize(analytics.DeliveryFrame.from_records(records)))
+
+
+@timed("export.invoice_pdf")
+def write_invoice_pdf(path, record, logo_path=None):
+    with atomic_output(path) as tmp_path:
+        with PdfWriter(tmp_path) as pdf:
+            if logo_path:
+                pdf.new_page()
+                pdf.image(ASSETS.logo(logo_path).pdf, max_width=144)
+            pdf.heading('Mushroom Traceability Invoice', 0)
+            # Only include most recent entry
+            pdf.table(TABLE_HEADERS, _rows([record] if record else []), TABLE_WEIGHTS)
+    return path
+
+
+def _convert_in_child(doc_name, pdf_name, conn):
+    try:
+        from docx2pdf import convert
+        convert(doc_name, pdf_name)
+        conn.send(None)
+    except BaseException as e:
+        conn.send(str(e) or type(e).__name__)
+    finally:
+        conn.close()
+
+
+@timed("export.convert_to_pdf")
+def convert_to_pdf(doc_name, pdf_name, job=None):
+    # docx2pdf drives Word over COM, which is neither thread-safe nor interruptible,
+    # so each conversion gets its own process that a cancel can terminate
+    if job is not None:
+        job.progress(0, None, "converting to PDF")
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    with atomic_output(pdf_name) as tmp_path:
+        process = context.Process(target=_convert_in_child, args=(doc_name, tmp_path, sender), daemon=True)
+        process.start()
+        sender.close()
+        try:
+            while not receiver.poll(0.2):
+                if job is not None and job.cancelled:
+                    process.terminate()
+                    raise JobCancelled()
+                if not process.is_alive():
+                    break
+            error = receiver.recv() if receiver.poll() else "PDF converter exited unexpectedly"
+        finally:
+            process.join()
+            receiver.close()
+        if error:
+            raise RuntimeError(f"PDF conversion failed: {error}")
+    return pdf_name
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# Reentrant advisory lock on a side file (e.g. logs.ndjson.lock) that also works across
+# machines on a network share; it keeps the owning process's threads apart too.
+
+# Waits between attempts double up to the last one
+LOCK_RETRY_SECONDS = (0.001, 0.05)
+LOCK_TIMEOUT_SECONDS = 30
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def _lock_file(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+        wait, longest = LOCK_RETRY_SECONDS
+        while True:
+            try:
+                if os.name == "nt":
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Another station has held {self.path} for over {LOCK_TIMEOUT_SECONDS} s")
+                time.sleep(wait)
+                wait = min(wait * 2, longest)
+
+    def _unlock_file(self):
+        if os.name == "nt":
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._lock_file()
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock_file()
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def close(self):
+        with self._thread_lock:
+            if self._depth == 0 and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
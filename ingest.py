@@ -0,0 +1,197 @@
+import csv
+import datetime
+import os
+
+from config import MUSHROOM_TYPES, RESTAURANT_ASSIGNMENTS
+from records import MUSHROOM_IDS, RESTAURANT_IDS, DeliveryRecord, date_to_ordinal
+
+# Bulk delivery input: box-number ranges and CSV/XLSX imports. A whole batch is validated
+# before anything is stored, and every bad row is reported together.
+
+FIELDS = ("mushroom_id", "box_number", "restaurant_id", "pack_date", "ship_date")
+
+# Accepted (lowercased) column headers; the export headers import back unchanged
+COLUMN_NAMES = {
+    "mushroom_id": ("mushroom type", "mushroom", "mushroom id", "mushroom_id", "mushroom_type"),
+    "box_number": ("box number", "box", "box no", "box_number"),
+    "restaurant_id": ("restaurant name", "restaurant", "restaurant id", "restaurant_id"),
+    "pack_date": ("packed date", "pack date", "packed", "pack_date"),
+    "ship_date": ("shipped date", "ship date", "shipped", "ship_date"),
+}
+
+MAX_RANGE = 10000
+
+
+class BulkValidationError(ValueError):
+    def __init__(self, errors):
+        # errors: [(where, message)] for every rejected row, e.g. ("row 12", "missing ship date")
+        self.errors = errors
+        shown = "; ".join(f"{where}: {message}" for where, message in errors[:5])
+        more = f" (+{len(errors) - 5} more)" if len(errors) > 5 else ""
+        super().__init__(f"{len(errors)} invalid row(s): {shown}{more}")
+
+
+def _parse_id(value, names, ids, what):
+    # Accepts 1, "1", "1 - Blue Oyster" (the GUI dropdown format) or "Blue Oyster"
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        if value in names:
+            return value
+        raise ValueError(f"unknown {what} id {value}")
+    text = str(value or "").strip()
+    if not text:
+        raise ValueError(f"missing {what}")
+    head = text.split(" - ")[0].strip()
+    if head.isdigit() and int(head) in names:
+        return int(head)
+    if text in ids:
+        return ids[text]
+    raise ValueError(f"unknown {what} '{text}'")
+
+
+def _parse_box(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        box = value
+    else:
+        text = str(value or "").strip().upper()
+        if text.startswith("BOX"):
+            text = text[3:]
+        if not text.isdigit():
+            raise ValueError(f"invalid box number '{value}'")
+        box = int(text)
+    if box < 0:
+        raise ValueError(f"invalid box number '{value}'")
+    return box
+
+
+def _parse_date(value, what):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    text = str(value or "").strip()
+    if not text:
+        raise ValueError(f"missing {what}")
+    try:
+        return date_to_ordinal(text)
+    except ValueError:
+        raise ValueError(f"invalid {what} '{text}' (expected YYYY-MM-DD)")
+
+
+PARSERS = {
+    "mushroom_id": lambda value: _parse_id(value, MUSHROOM_TYPES, MUSHROOM_IDS, "mushroom type"),
+    "box_number": _parse_box,
+    "restaurant_id": lambda value: _parse_id(value, RESTAURANT_ASSIGNMENTS, RESTAURANT_IDS, "restaurant"),
+    "pack_date": lambda value: _parse_date(value, "pack date"),
+    "ship_date": lambda value: _parse_date(value, "ship date"),
+}
+
+
+def validate_rows(rows):
+    # rows: (where, {field: raw value}); each distinct raw value is parsed once per column
+    records = []
+    errors = []
+    parsed = {field: {} for field in FIELDS}
+    seen = {}
+    for where, row in rows:
+        values = []
+        problems = []
+        for field in FIELDS:
+            raw = row.get(field)
+            key = raw if isinstance(raw, (str, int, float, datetime.date)) else repr(raw)
+            cache = parsed[field]
+            if key not in cache:
+                try:
+                    cache[key] = (True, PARSERS[field](raw))
+                except ValueError as e:
+                    cache[key] = (False, str(e))
+            ok, value = cache[key]
+            if ok:
+                values.append(value)
+            else:
+                problems.append(value)
+        if problems:
+            errors.append((where, ", ".join(problems)))
+            continue
+        record = DeliveryRecord(*values)
+        # The tracking number (pack date + box) must be unique within the batch
+        tracking = (record.pack_date, record.box_number)
+        if tracking in seen:
+            errors.append((where, f"duplicate box {record.tracking_number} (also {seen[tracking]})"))
+            continue
+        seen[tracking] = where
+        records.append(record)
+    if errors:
+        raise BulkValidationError(errors)
+    return records
+
+
+def tuple_rows(rows):
+    # (mushroom_type, box_number, restaurant_id, pack_date, ship_date) tuples or field dicts
+    for number, row in enumerate(rows, 1):
+        yield f"row {number}", row if isinstance(row, dict) else dict(zip(FIELDS, row))
+
+
+def box_range_rows(mushroom_type, first_box, last_box, restaurant_id, pack_date, ship_date):
+    try:
+        first, last = _parse_box(first_box), _parse_box(last_box)
+    except ValueError as e:
+        raise BulkValidationError([("range", str(e))])
+    if last < first:
+        raise BulkValidationError([("range", f"last box {last} is before first box {first}")])
+    if last - first + 1 > MAX_RANGE:
+        raise BulkValidationError([("range", f"a range is limited to {MAX_RANGE} boxes")])
+    for box in range(first, last + 1):
+        yield f"box {box}", {"mushroom_id": mushroom_type, "box_number": box, "restaurant_id": restaurant_id,
+                             "pack_date": pack_date, "ship_date": ship_date}
+
+
+def _columns(header):
+    names = [str(cell or "").strip().lower() for cell in header]
+    columns = {}
+    for field, aliases in COLUMN_NAMES.items():
+        for i, name in enumerate(names):
+            if name in aliases:
+                columns[field] = i
+                break
+    return columns
+
+
+def _table_rows(table, source):
+    # Rows of one CSV/worksheet; the first row must be a header naming all five columns
+    table = iter(table)
+    header = next(table, None)
+    if header is None:
+        return
+    columns = _columns(header)
+    missing = [COLUMN_NAMES[field][0] for field in FIELDS if field not in columns]
+    if missing:
+        raise BulkValidationError([(f"{source or 'file'} header", f"missing column(s) {', '.join(missing)}")])
+    for number, cells in enumerate(table, 2):
+        if not any(cell not in (None, "") for cell in cells):
+            continue
+        cells = list(cells)
+        row = {field: cells[i] if i < len(cells) else None for field, i in columns.items()}
+        yield f"{source} row {number}" if source else f"row {number}", row
+
+
+def file_rows(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from _table_rows(csv.reader(f), "")
+    elif ext in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            # Split exports spread deliveries over several sheets
+            for sheet in workbook.worksheets:
+                yield from _table_rows(sheet.iter_rows(values_only=True), sheet.title)
+        finally:
+            workbook.close()
+    else:
+        raise ValueError(f"Unsupported file type: {ext or path} (use .csv or .xlsx)")
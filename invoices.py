@@ -0,0 +1,279 @@
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+
+from assets import ASSETS
+from config import RESTAURANT_ASSIGNMENTS
+from exports import TABLE_HEADERS, TABLE_WEIGHTS, add_logo, atomic_output, convert_to_pdf
+from metrics import count, timed
+from pdf import PdfWriter
+from records import DeliveryRecord
+
+# Batch invoicing: one invoice per restaurant and billing period of the ship date,
+# rendered in worker processes. manifest.json keeps a digest of each group, so unchanged
+# groups keep their existing file.
+
+PERIODS = ("month", "week")
+MANIFEST_FILE = "manifest.json"
+INVOICE_DIR = "invoices"
+
+# The stores filter on pack date, so queries reach back this far for late shipments
+SHIP_LOOKBACK_DAYS = 62
+
+# Below this many invoices, starting worker processes costs more than it saves
+POOL_MIN_INVOICES = 4
+
+# Bump when the invoice layout changes so unchanged groups are rendered again
+LAYOUT_VERSION = 1
+
+
+def period_bounds(ordinal, period):
+    # (first, last) date ordinals of the billing period containing `ordinal`
+    if period not in PERIODS:
+        raise ValueError(f"Unknown billing period: {period}")
+    day = datetime.date.fromordinal(ordinal)
+    if period == "week":
+        first = ordinal - day.weekday()
+        return first, first + 6
+    first = day.replace(day=1)
+    following = (first + datetime.timedelta(days=32)).replace(day=1)
+    return first.toordinal(), following.toordinal() - 1
+
+
+def period_label(first, period):
+    day = datetime.date.fromordinal(first)
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return day.strftime("%Y-%m")
+
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def invoice_name(restaurant_id, label, ext):
+    restaurant = _slug(RESTAURANT_ASSIGNMENTS.get(restaurant_id, "")) or f"restaurant-{restaurant_id}"
+    return f"invoice_{label}_{restaurant}.{ext}"
+
+
+def invoice_number(restaurant_id, label):
+    return f"INV-{label}-R{restaurant_id:02d}"
+
+
+def group_deliveries(records, period="month", start=None, end=None):
+    # {(restaurant_id, period start): [delivery tuples]} for ship dates within start..end
+    groups = {}
+    period_starts = {}  # ship date -> period start; a history only has a few thousand days
+    for record in records:
+        ship_date = record.ship_date
+        if (start is not None and ship_date < start) or (end is not None and ship_date > end):
+            continue
+        first = period_starts.get(ship_date)
+        if first is None:
+            first = period_starts[ship_date] = period_bounds(ship_date, period)[0]
+        key = (record.restaurant_id, first)
+        rows = groups.get(key)
+        if rows is None:
+            rows = groups[key] = []
+        rows.append((record.mushroom_id, record.box_number, key[0], record.pack_date, ship_date))
+    for rows in groups.values():
+        rows.sort(key=lambda row: (row[4], row[3], row[0], row[1]))
+    return groups
+
+
+def batch_records(store, period="month", start=None, end=None):
+    # The store snapshot a batch for ship dates start..end needs
+    pack_start = None if start is None else period_bounds(start, period)[0] - SHIP_LOOKBACK_DAYS
+    pack_end = None if end is None else period_bounds(end, period)[1]
+    return store.snapshot(pack_start, pack_end)
+
+
+def _stamp(path):
+    # Branding is part of an invoice's digest, so a new logo or template re-renders it
+    if not path:
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+
+def _digest(rows, engine, branding):
+    data = json.dumps([LAYOUT_VERSION, engine, branding, rows], separators=(",", ":"))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _mushroom_totals(records):
+    totals = {}
+    for record in records:
+        totals[record.mushroom_name] = totals.get(record.mushroom_name, 0) + 1
+    return sorted(totals.items())
+
+
+def _render_pdf(path, header, records, logo_path):
+    with atomic_output(path) as tmp_path:
+        with PdfWriter(tmp_path) as pdf:
+            if logo_path:
+                pdf.new_page()
+                pdf.image(ASSETS.logo(logo_path).pdf, max_width=144)
+            pdf.heading('Mushroom Traceability Invoice', 0)
+            for line in header:
+                pdf.paragraph(line)
+            pdf.heading('Deliveries per Mushroom Type', 1)
+            pdf.table(["Mushroom Type", "Boxes"], ([name, str(n)] for name, n in _mushroom_totals(records)), [3, 1])
+            pdf.heading('Invoice Details', 1)
+            pdf.table(TABLE_HEADERS, (record.row() for record in records), TABLE_WEIGHTS)
+
+
+def _render_docx(path, header, records, logo_path, template_path):
+    doc = ASSETS.document(template_path)
+    if logo_path:
+        add_logo(doc, logo_path)
+    doc.add_heading('Mushroom Traceability Invoice', 0)
+    for line in header:
+        doc.add_paragraph(line)
+    doc.add_heading('Deliveries per Mushroom Type', level=1)
+    totals = _mushroom_totals(records)
+    table = doc.add_table(rows=len(totals) + 1, cols=2)
+    table.style = 'Table Grid'
+    table.rows[0].cells[0].text, table.rows[0].cells[1].text = "Mushroom Type", "Boxes"
+    for cells, (name, n) in zip(table.rows[1:], totals):
+        cells.cells[0].text, cells.cells[1].text = name, str(n)
+    doc.add_heading('Invoice Details', level=1)
+    # Sized up front: growing a python-docx table row by row gets slower with every row
+    table = doc.add_table(rows=len(records) + 1, cols=len(TABLE_HEADERS))
+    table.style = 'Table Grid'
+    for cell, text in zip(table.rows[0].cells, TABLE_HEADERS):
+        cell.text = text
+    for cells, record in zip(table.rows[1:], records):
+        for cell, text in zip(cells.cells, record.row()):
+            cell.text = text
+    with atomic_output(path) as tmp_path:
+        doc.save(tmp_path)
+
+
+def render_invoice(task):
+    # Runs in a worker process, so the task holds plain tuples rather than records
+    path, fmt, number, first, last, rows, logo_path, template_path = task
+    records = [DeliveryRecord(*row) for row in rows]
+    header = [f"Invoice Number: {number}",
+              f"Restaurant: {records[0].restaurant_name}",
+              f"Billing Period: {datetime.date.fromordinal(first)} to {datetime.date.fromordinal(last)}",
+              f"Deliveries: {len(records)}"]
+    if fmt == "pdf":
+        _render_pdf(path, header, records, logo_path)
+    else:
+        _render_docx(path, header, records, logo_path, template_path)
+    return path
+
+
+def load_manifest(folder):
+    path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {entry["file"]: entry for entry in json.load(f)["invoices"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}  # A damaged manifest only costs a full re-render
+
+
+def _save_manifest(folder, entries):
+    path = os.path.join(folder, MANIFEST_FILE)
+    data = {"generated": datetime.datetime.now().isoformat(timespec="seconds"),
+            "invoices": sorted(entries.values(), key=lambda entry: entry["file"])}
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    return path
+
+
+def _run_pool(tasks, workers, finished):
+    # A cancel drops the invoices not yet started and waits for the running ones
+    context = multiprocessing.get_context("spawn")
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    try:
+        futures = [pool.submit(render_invoice, task) for task in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            finished(future.result())
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+@timed("invoice.batch")
+def write_invoice_batch(folder, records, period="month", start=None, end=None, engine="native", workers=None,
+                        job=None, logo_path=None, template_path=None):
+    # start/end are ship date ordinals, widened to whole billing periods
+    if engine not in ("native", "word", "docx"):
+        raise ValueError(f"Unknown report engine: {engine}")
+    if start is not None:
+        start = period_bounds(start, period)[0]
+    if end is not None:
+        end = period_bounds(end, period)[1]
+    groups = group_deliveries(records, period, start, end)
+    os.makedirs(folder, exist_ok=True)
+    previous = load_manifest(folder)
+    fmt = "pdf" if engine == "native" else "docx"
+    # The template only applies to .docx invoices
+    template_path = template_path if fmt == "docx" else None
+    branding = [_stamp(logo_path), _stamp(template_path)]
+
+    entries, tasks = {}, []
+    for (restaurant_id, first), rows in sorted(groups.items(), key=lambda item: (item[0][1], item[0][0])):
+        _, last = period_bounds(first, period)
+        label = period_label(first, period)
+        name = invoice_name(restaurant_id, label, "pdf" if engine == "word" else fmt)
+        entry = {"file": name, "invoice_number": invoice_number(restaurant_id, label), "restaurant_id": restaurant_id,
+                 "restaurant": RESTAURANT_ASSIGNMENTS.get(restaurant_id, f"Restaurant {restaurant_id}"),
+                 "period": label, "period_start": str(datetime.date.fromordinal(first)),
+                 "period_end": str(datetime.date.fromordinal(last)), "deliveries": len(rows),
+                 "digest": _digest(rows, engine, branding)}
+        entries[name] = entry
+        old = previous.get(name)
+        if old and old.get("digest") == entry["digest"] and os.path.exists(os.path.join(folder, name)):
+            entry.update(bytes=old["bytes"], sha256=old["sha256"], reused=True)
+            continue
+        path = os.path.join(folder, invoice_name(restaurant_id, label, fmt))
+        tasks.append((path, fmt, entry["invoice_number"], first, last, rows, logo_path, template_path))
+
+    total = len(tasks)
+    done = 0
+
+    def finished(path):
+        nonlocal done
+        if engine == "word":
+            # Word conversions stay one at a time; docx2pdf drives a single Word instance
+            path = convert_to_pdf(path, os.path.splitext(path)[0] + ".pdf", job)
+        entry = entries[os.path.basename(path)]
+        entry.update(bytes=os.path.getsize(path), sha256=_sha256(path), reused=False)
+        done += 1
+        if job is not None:
+            job.progress(done, total, f"{done} of {total} invoices")
+
+    if job is not None:
+        job.progress(0, total, f"{len(entries) - total} unchanged, {total} to render")
+    workers = min(workers or os.cpu_count() or 1, total)
+    try:
+        if workers > 1 and total >= POOL_MIN_INVOICES:
+            _run_pool(tasks, workers, finished)
+        else:
+            for task in tasks:
+                finished(render_invoice(task))
+    finally:
+        # Whatever finished before a cancel or failure is still recorded
+        previous.update({name: entry for name, entry in entries.items() if "sha256" in entry})
+        _save_manifest(folder, previous)
+    count("invoice.rendered", total)
+    count("invoice.reused", len(entries) - total)
+    return list(entries.values())
@@ -0,0 +1,187 @@
+import itertools
+import queue
+import threading
+import time
+
+from metrics import REGISTRY, count, record_error
+
+# Jobs run on worker threads and never touch Tk; the GUI drains their events with pump()
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Finished jobs kept around for the Jobs window
+KEEP_FINISHED = 20
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, name, func, args, events, on_done=None, on_error=None, on_progress=None):
+        self.id = job_id
+        self.name = name
+        self.func = func
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.status = QUEUED
+        self.done = 0
+        self.total = None
+        self.message = ""
+        self.result = None
+        self.error = None
+        self._events = events
+        self._cancel = threading.Event()
+        self.queued_at = time.perf_counter()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, done, total=None, message=None):
+        # Called from the job itself; doubles as its cancellation point
+        self.check()
+        self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        self._events.put(("progress", self))
+
+    def progress_text(self):
+        if self.status != RUNNING:
+            return self.message
+        if self.total:
+            text = f"{self.done * 100 // self.total}%"
+        else:
+            text = f"{self.done}" if self.done else ""
+        return f"{text} {self.message}".strip()
+
+
+class JobQueue:
+    def __init__(self, workers=2):
+        self.workers = max(1, int(workers))
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._pending = queue.Queue()
+        self._events = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        # on_callback_error(job, error), called when a callback raises inside pump()
+        self.on_callback_error = None
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads) + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, name, func, *args, on_done=None, on_error=None, on_progress=None):
+        # func(job, *args) runs on a worker thread; callbacks run later inside pump()
+        with self._lock:
+            job = Job(next(self._ids), name, func, args, self._events, on_done, on_error, on_progress)
+            self.jobs[job.id] = job
+            self._forget_finished()
+            self._start_workers()
+        self._pending.put(job)
+        self._events.put(("queued", job))
+        return job
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:-KEEP_FINISHED] if len(finished) > KEEP_FINISHED else []:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._pending.get()
+            if job is None:
+                return
+            if job.cancelled:
+                job.status = CANCELLED
+                self._events.put(("finished", job))
+                continue
+            job.status = RUNNING
+            self._events.put(("progress", job))
+            started = time.perf_counter()
+            REGISTRY.observe("jobs.wait", started - job.queued_at)
+            try:
+                job.result = job.func(job, *job.args)
+                job.status = CANCELLED if job.cancelled else DONE
+            except JobCancelled:
+                job.status = CANCELLED
+            except Exception as e:
+                job.error = e
+                job.status = FAILED
+                record_error("job", f"{job.name}: {e}")
+            REGISTRY.observe("jobs.run", time.perf_counter() - started, job.status == FAILED)
+            count("jobs." + job.status)
+            self._events.put(("finished", job))
+
+    def pump(self):
+        # Runs callbacks for everything that happened since the last call; returns the jobs that changed
+        changed = {}
+        finished = []
+        while True:
+            try:
+                kind, job = self._events.get_nowait()
+            except queue.Empty:
+                break
+            changed[job.id] = job
+            if kind == "finished":
+                finished.append(job)
+        for job in changed.values():
+            if job.on_progress is not None and job.status == RUNNING:
+                self._callback(job, job.on_progress, job)
+        for job in finished:
+            if job.status == DONE and job.on_done is not None:
+                self._callback(job, job.on_done, job.result)
+            elif job.status == FAILED and job.on_error is not None:
+                self._callback(job, job.on_error, job.error)
+        return list(changed.values())
+
+    def _callback(self, job, callback, arg):
+        # A failing callback must not cost the other jobs their events
+        try:
+            callback(arg)
+        except Exception as e:
+            record_error("job.callback", f"{job.name}: {e}")
+            if self.on_callback_error is not None:
+                self.on_callback_error(job, e)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+            return True
+        return False
+
+    def active(self):
+        return [job for job in self.jobs.values() if not job.finished]
+
+    def shutdown(self):
+        # Cancels everything; workers exit after their current step
+        for job in list(self.jobs.values()):
+            job.cancel()
+        for _ in self._threads:
+            self._pending.put(None)
+        self._threads = []
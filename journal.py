@@ -0,0 +1,497 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from filelock import FileLock
+from logfile import SnapshotReader, is_ndjson, write_labels
+from metrics import count, record_error, timed
+from records import parse_labels
+
+# Journal records are appended (and fsync'd) one JSON object per line:
+#   {"seq": 12, "op": "add", "label": "..."}
+#   {"seq": 13, "op": "del", "index": 4}
+#   {"seq": 14, "op": "add_many", "labels": ["...", "..."]}
+#   {"seq": 15, "op": "mark"}
+#   {"op": "checkpoint", "seq": 15}
+# A checkpoint means the snapshot (NDJSON, or the old .json list) already contains every
+# record up to that seq. Stations sharing one log write under a lock on `<snapshot>.lock`
+# after reading what the others appended. Entries that do not parse are kept as they are.
+
+COMPACT_EVERY = 500
+# How long a commit waits for other writers to join it, while writes overlap
+GROUP_COMMIT_WINDOW = 0.002
+# A tmp snapshot without a checkpoint may still be in the works in another instance
+STALE_TMP_SECONDS = 600
+
+
+def _fsync_dir(path):
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_durably(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _parse_entries(data):
+    # (entries, size of the whole lines, last whole line); stops at a torn line, one with
+    # no newline yet. A whole line that does not parse is skipped but stays in the file
+    entries = []
+    good_size = 0
+    last = b""
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        try:
+            entry = json.loads(line)
+            if not isinstance(entry, dict) or "op" not in entry or "seq" not in entry:
+                raise ValueError("not a journal entry")
+        except ValueError as e:
+            record_error("journal", f"Skipped unreadable journal line: {e}")
+        else:
+            entries.append(entry)
+        good_size += len(line)
+        last = line
+    return entries, good_size, last
+
+
+def _json_value(line):
+    # A kept line back as a value for the old .json list; a damaged one stays text
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line
+
+
+def _file_stamp(stat):
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _entry_size(entry):
+    return len(entry["labels"]) if entry["op"] == "add_many" else 1
+
+
+class _Batch:
+    # One caller's entries waiting for a group commit
+    def __init__(self, entries, records):
+        self.entries = entries
+        self.records = records
+        self.done = False
+        self.error = None
+
+
+class LogJournal:
+    # apply(entry, records) is called under the lock for every entry, in seq order
+    def __init__(self, snapshot_path, journal_path=None, compact_every=COMPACT_EVERY, apply=None, reload=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or snapshot_path + ".journal"
+        self.compact_every = compact_every
+        self.apply = apply
+        self.reload = reload
+        self.lock = FileLock(snapshot_path + ".lock")
+        self.seq = 0
+        self.checkpoint_seq = 0
+        self.since_checkpoint = 0
+        self.last_error = None
+        # Snapshot lines (JSON text) that did not parse, kept for the next compaction
+        self.unreadable = []
+        # Set when another instance rewrote the journal past what this one has read
+        self.reload_needed = False
+        self._compactor = None
+        self._reader = None
+        # What this instance has read of the journal file
+        self._inode = None
+        self._offset = 0
+        self._tail = b""
+        self._stamp = None
+        self._queue = []
+        self._committing = False
+        self._last_round = 1
+        self._last_append = 0.0
+        self._cond = threading.Condition()
+
+    def _pending_snapshot(self, seq):
+        return f"{self.snapshot_path}.{seq}.tmp"
+
+    def parse(self, labels):
+        # (records, skipped); what does not parse is kept in `unreadable`
+        unparsed = []
+        records, skipped = parse_labels(labels, unparsed)
+        self.unreadable.extend(json.dumps(label, ensure_ascii=False) for label in unparsed)
+        return records, skipped
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return [], 0
+        if is_ndjson(self.snapshot_path):
+            with SnapshotReader(self.snapshot_path) as reader:
+                labels, skipped = reader.read(bad=self.unreadable)
+        else:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                labels = json.load(f)
+            if not isinstance(labels, list):
+                raise ValueError("Invalid logs format detected!")
+            skipped = 0
+        records, unparsed = self.parse(labels)
+        return records, skipped + unparsed
+
+    def _pending_entries(self):
+        # Journal entries the snapshot does not contain yet; drops what a crash left behind
+        entries = self._read_journal()
+        checkpoints = {e["seq"] for e in entries if e["op"] == "checkpoint"}
+        unapplied = set()
+        for tmp in glob.glob(glob.escape(self.snapshot_path) + ".*.tmp"):
+            try:
+                seq = int(tmp[len(self.snapshot_path) + 1:-len(".tmp")])
+            except ValueError:
+                continue
+            try:
+                if seq in checkpoints:
+                    unapplied.add(seq)
+                    os.remove(tmp)
+                elif time.time() - os.path.getmtime(tmp) > STALE_TMP_SECONDS:
+                    os.remove(tmp)
+            except OSError:
+                pass
+
+        checkpoint = max(checkpoints - unapplied, default=0)
+        last_seq = checkpoint
+        pending = []
+        for entry in entries:
+            if entry["op"] == "checkpoint":
+                continue
+            last_seq = max(last_seq, entry["seq"])
+            if entry["seq"] > checkpoint:
+                pending.append(entry)
+
+        self.seq = last_seq
+        self.checkpoint_seq = checkpoint
+        self.since_checkpoint = sum(_entry_size(entry) for entry in pending)
+        self.reload_needed = False
+        return pending
+
+    def _replay(self, records, entries):
+        skipped = 0
+        for entry in entries:
+            if entry["op"] == "add":
+                batch, batch_skipped = self.parse([entry["label"]])
+                records.extend(batch)
+                skipped += batch_skipped
+            elif entry["op"] == "add_many":
+                batch, batch_skipped = self.parse(entry["labels"])
+                records.extend(batch)
+                skipped += batch_skipped
+            elif entry["op"] == "del":
+                if 0 <= entry["index"] < len(records):
+                    records.pop(entry["index"])
+        return skipped
+
+    @timed("journal.load")
+    def load(self):
+        with self.lock:
+            self._close_reader()
+            self.unreadable = []
+            records, skipped = self._read_snapshot()
+            skipped += self._replay(records, self._pending_entries())
+            return records, skipped
+
+    @timed("journal.load_recent")
+    def load_recent(self, n):
+        # (records, older, skipped); None for a .json snapshot or pending deletes
+        with self.lock:
+            if not is_ndjson(self.snapshot_path):
+                return None
+            self._close_reader()
+            self.unreadable = []
+            pending = self._pending_entries()
+            if any(entry["op"] == "del" for entry in pending):
+                return None
+            older = 0
+            labels, skipped = [], 0
+            if os.path.exists(self.snapshot_path):
+                # Kept open for load_older()
+                self._reader = SnapshotReader(self.snapshot_path)
+                labels, skipped = self._reader.tail(n, self.unreadable)
+                older = max(len(self._reader) - n, 0)
+            records, unparsed = self.parse(labels)
+            skipped += unparsed + self._replay(records, pending)
+            return records, older, skipped
+
+    @timed("journal.load_older")
+    def load_older(self, older, job=None):
+        # The lines load_recent() left; safe on any thread
+        reader = self._reader
+        try:
+            labels, skipped = reader.read(0, older, job, self.unreadable)
+        finally:
+            self._close_reader()
+        records, unparsed = self.parse(labels)
+        return records, skipped + unparsed
+
+    def _close_reader(self):
+        reader, self._reader = self._reader, None
+        if reader is not None:
+            reader.close()
+
+    def _read_file(self):
+        # (entries, size of the whole lines, last whole line, stat) of the journal file
+        with open(self.journal_path, "rb") as f:
+            return (*_parse_entries(f.read()), os.fstat(f.fileno()))
+
+    def _read_journal(self):
+        # Also drops a torn trailing line left by a crash mid-append
+        self._inode, self._offset, self._tail, self._stamp = None, 0, b"", None
+        if not os.path.exists(self.journal_path):
+            return []
+        entries, good_size, tail, stat = self._read_file()
+        if stat.st_size > good_size:
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_size)
+                stat = os.fstat(f.fileno())
+        self._inode, self._offset, self._tail, self._stamp = stat.st_ino, good_size, tail, _file_stamp(stat)
+        return entries
+
+    def _append_lines(self, lines, good_size):
+        # Whatever follows the last whole entry is a torn write from a crash
+        with open(self.journal_path, "ab") as f:
+            if os.fstat(f.fileno()).st_size > good_size:
+                f.truncate(good_size)
+            f.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            return os.fstat(f.fileno())
+
+    # --- Changes from other instances ---
+
+    def changed(self):
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return self._stamp is not None
+        return _file_stamp(stat) != self._stamp
+
+    def poll(self):
+        # Applies what other instances committed; returns how many entries
+        if not self.changed():
+            return 0
+        with self.lock:
+            return self._poll()
+
+    @timed("journal.poll")
+    def _poll(self):
+        if self.reload_needed or not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            appended = stat.st_ino == self._inode and stat.st_size >= self._offset
+            if appended and self._tail:
+                # The same inode can come back; check the last line read is still there
+                f.seek(self._offset - len(self._tail))
+                appended = f.read(len(self._tail)) == self._tail
+            if appended:
+                f.seek(self._offset)
+                entries, good_size, tail = _parse_entries(f.read())
+                self._offset += good_size
+                self._tail = tail or self._tail
+            else:
+                entries = self._reread(f, stat)
+        self._stamp = _file_stamp(stat)
+        new = 0
+        for entry in entries:
+            if entry["op"] == "checkpoint":
+                if entry["seq"] > self.checkpoint_seq:
+                    self.checkpoint_seq = entry["seq"]
+                    self.since_checkpoint = 0
+            elif entry["seq"] > self.seq:
+                self.seq = entry["seq"]
+                self.since_checkpoint += _entry_size(entry)
+                new += 1
+                if self.apply is not None:
+                    self.apply(entry, None)
+        count("journal.polled", new)
+        return new
+
+    def _reread(self, f, stat):
+        # Compacted elsewhere: returns what is past this seq, or sets reload_needed
+        f.seek(0)
+        entries, good_size, tail = _parse_entries(f.read())
+        self._inode, self._offset, self._tail = stat.st_ino, good_size, tail
+        seqs = {e["seq"] for e in entries if e["op"] != "checkpoint"}
+        if max((e["seq"] for e in entries), default=0) > self.seq and self.seq + 1 not in seqs:
+            self.reload_needed = True
+            return []
+        checkpoint = max((e["seq"] for e in entries if e["op"] == "checkpoint"), default=0)
+        if checkpoint > self.checkpoint_seq:
+            self.checkpoint_seq = checkpoint
+            self.since_checkpoint = sum(_entry_size(e) for e in entries
+                                        if e["op"] != "checkpoint" and checkpoint < e["seq"] <= self.seq)
+        return [e for e in entries if e["op"] != "checkpoint"]
+
+    # --- Writing ---
+
+    def _commit(self, entries, records):
+        # Whoever finds no commit running writes everything queued by then
+        batch = _Batch(entries, records)
+        with self._cond:
+            self._queue.append(batch)
+            while self._committing and not batch.done:
+                self._cond.wait()
+            if not batch.done:
+                self._committing = True
+        if not batch.done:
+            self._lead()
+        if batch.error is not None:
+            raise batch.error
+
+    def _lead(self):
+        batches, error = [], None
+        try:
+            if self._last_round > 1:
+                # Writes are overlapping: give the others a moment to join this fsync
+                time.sleep(min(GROUP_COMMIT_WINDOW, self._last_append))
+            with self.lock:
+                with self._cond:
+                    batches, self._queue = self._queue, []
+                self._write(batches)
+        except Exception as e:
+            error = e
+        with self._cond:
+            if not batches:
+                # The lock was never taken; nothing queued may be written later
+                batches, self._queue = self._queue, []
+            for batch in batches:
+                batch.done = True
+                batch.error = error
+            self._last_round = len(batches)
+            self._committing = False
+            self._cond.notify_all()
+
+    @timed("journal.append")
+    def _write(self, batches):
+        # Under the lock: catch up with the other instances, then append after them
+        self._poll()
+        if self.reload_needed:
+            if self.reload is not None:
+                self.reload()
+            else:
+                self.load()
+        seq = self.seq
+        lines, committed = [], []
+        for batch in batches:
+            for entry, records in zip(batch.entries, batch.records):
+                seq += 1
+                entry = {"seq": seq, **entry}
+                lines.append(json.dumps(entry) + "\n")
+                committed.append((entry, records))
+        if not lines:
+            return
+        started = time.perf_counter()
+        stat = self._append_lines(lines, self._offset)
+        self._last_append = time.perf_counter() - started
+        count("journal.commits", len(batches))
+        self._inode, self._offset, self._tail = stat.st_ino, stat.st_size, lines[-1].encode("utf-8")
+        self._stamp = _file_stamp(stat)
+        for entry, records in committed:
+            self.seq = entry["seq"]
+            self.since_checkpoint += _entry_size(entry)
+            if self.apply is not None:
+                self.apply(entry, records)
+
+    def append_add(self, record):
+        self._commit([{"op": "add", "label": record.label()}], [[record]])
+
+    def append_adds(self, records):
+        # A batch is one line, so a crash mid-write drops all of it or none of it
+        if len(records) == 1:
+            return self.append_add(records[0])
+        self._commit([{"op": "add_many", "labels": [record.label() for record in records]}], [records])
+
+    def append_deletes(self, indexes):
+        # The caller holds the lock from polling until here
+        with self.lock:
+            self._write([_Batch([{"op": "del", "index": index} for index in indexes], [None] * len(indexes))])
+
+    def compact_due(self):
+        return self.since_checkpoint >= self.compact_every
+
+    def compact(self, records, background=False, retain=True):
+        # retain=False makes other instances reload instead of catching up
+        if background and self._compactor is not None and self._compactor.is_alive():
+            return
+        with self.lock:
+            self._write([_Batch([{"op": "mark"}], [None])])
+            seq = self.seq
+            snapshot = list(records)
+            unreadable = list(self.unreadable)
+            self.since_checkpoint = 0
+            if not background:
+                error = self._compact(snapshot, seq, retain, unreadable)
+                if error is not None:
+                    raise error
+                return
+        self._compactor = threading.Thread(target=self._compact_in_background,
+                                           args=(snapshot, seq, retain, unreadable), daemon=True)
+        self._compactor.start()
+
+    def _compact_in_background(self, records, seq, retain, unreadable):
+        self.last_error = self._compact(records, seq, retain, unreadable)
+
+    @timed("journal.compact")
+    def _compact(self, records, seq, retain=True, unreadable=()):
+        # Returns the error, if any
+        tmp_path = self._pending_snapshot(seq)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                if is_ndjson(self.snapshot_path):
+                    f.writelines(line + "\n" for line in unreadable)
+                    write_labels(f, (record.label() for record in records))
+                else:
+                    json.dump([_json_value(line) for line in unreadable] + [record.label() for record in records],
+                              f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self.lock:
+                entries, good_size, _, _ = self._read_file()
+                if seq < max((e["seq"] for e in entries if e["op"] == "checkpoint"), default=0):
+                    os.remove(tmp_path)
+                    return None
+                checkpoint = json.dumps({"op": "checkpoint", "seq": seq}) + "\n"
+                self._append_lines([checkpoint], good_size)
+                os.replace(tmp_path, self.snapshot_path)
+                _fsync_dir(self.snapshot_path)
+
+                entries = [e for e in entries if e["op"] != "checkpoint"]
+                # The last entries before the checkpoint stay for other instances to catch up
+                before = [json.dumps(e) + "\n" for e in entries if e["seq"] <= seq][-self.compact_every:]
+                tail = [json.dumps(e) + "\n" for e in entries if e["seq"] > seq]
+                journal_tmp = f"{self.journal_path}.{os.getpid()}.tmp"
+                _write_durably(journal_tmp, (before if retain else []) + [checkpoint] + tail)
+                os.replace(journal_tmp, self.journal_path)
+                _fsync_dir(self.journal_path)
+                self._inode = self._stamp = None
+                self.checkpoint_seq = max(self.checkpoint_seq, seq)
+        except Exception as e:
+            # A leftover tmp snapshot tells load() that its checkpoint was never applied
+            return e
+        return None
+
+    def join(self):
+        if self._compactor is not None and self._compactor is not threading.current_thread():
+            self._compactor.join()
+        self._compactor = None
+
+    def close(self):
+        self.join()
+        self._close_reader()
+        self.lock.close()
@@ -0,0 +1,149 @@
+import json
+import mmap
+import os
+from array import array
+
+from metrics import timed
+
+# logs.ndjson: one delivery label (a JSON string) per line, oldest first. SnapshotReader
+# maps the file and reads any range of lines, or the newest ones from the end. Snapshots
+# named .json keep the old format (one JSON list).
+
+LEGACY_SUFFIX = ".json"
+NDJSON_SUFFIX = ".ndjson"
+
+# Lines are parsed this many at a time, as one JSON document
+PARSE_CHUNK = 65536
+# Bytes scanned per step while counting or indexing lines
+SCAN_CHUNK = 1 << 24
+
+
+def is_ndjson(path):
+    return not path.endswith(LEGACY_SUFFIX)
+
+
+def legacy_path(path):
+    # logs.ndjson -> logs.json, the file a one-time conversion reads from
+    return path[:-len(NDJSON_SUFFIX)] + LEGACY_SUFFIX if path.endswith(NDJSON_SUFFIX) else None
+
+
+def write_labels(f, labels):
+    batch = []
+    for label in labels:
+        batch.append(json.dumps(label, ensure_ascii=False))
+        if len(batch) >= PARSE_CHUNK:
+            f.write("\n".join(batch) + "\n")
+            batch = []
+    if batch:
+        f.write("\n".join(batch) + "\n")
+
+
+def parse_lines(data, bad=None):
+    # Damaged lines are counted, and kept as text in `bad` if given
+    if not data:
+        return [], 0
+    try:
+        labels = json.loads(b"[" + data.rstrip(b"\n").replace(b"\n", b",") + b"]")
+        if all(isinstance(label, str) for label in labels):
+            return labels, 0
+    except ValueError:
+        pass
+    labels, skipped = [], 0
+    for line in data.splitlines():
+        try:
+            label = json.loads(line)
+        except ValueError:
+            label = None
+        if isinstance(label, str):
+            labels.append(label)
+        elif line.strip():
+            skipped += 1
+            if bad is not None:
+                bad.append(line.decode("utf-8", "replace"))
+    return labels, skipped
+
+
+class SnapshotReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # An empty file cannot be mapped; it simply has no lines
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        # A torn last line (no newline) is ignored, as it is in the journal
+        self.size = self._map.rfind(b"\n") + 1 if size else 0
+        self._count = None
+        self._offsets = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(self._map[i:min(i + SCAN_CHUNK, self.size)].count(b"\n")
+                              for i in range(0, self.size, SCAN_CHUNK))
+        return self._count
+
+    def offsets(self):
+        # Start offset of every line, plus the end of the last one
+        if self._offsets is None:
+            offsets = array("q", [0])
+            for base in range(0, self.size, SCAN_CHUNK):
+                chunk = self._map[base:min(base + SCAN_CHUNK, self.size)]
+                position = chunk.find(b"\n")
+                while position != -1:
+                    offsets.append(base + position + 1)
+                    position = chunk.find(b"\n", position + 1)
+            self._offsets = offsets
+            self._count = len(offsets) - 1
+        return self._offsets
+
+    def tail(self, n, bad=None):
+        # (labels, skipped) of the last n lines, without indexing the file
+        start = self.size
+        for _ in range(n):
+            if start == 0:
+                break
+            start = self._map.rfind(b"\n", 0, start - 1) + 1
+        return parse_lines(self._map[start:self.size], bad)
+
+    def read(self, start=0, stop=None, job=None, bad=None):
+        # (labels, skipped) of lines start..stop; job, if given, sees progress and cancels
+        offsets = self.offsets()
+        stop = len(offsets) - 1 if stop is None else min(stop, len(offsets) - 1)
+        labels, skipped = [], 0
+        for first in range(start, stop, PARSE_CHUNK):
+            last = min(first + PARSE_CHUNK, stop)
+            chunk, damaged = parse_lines(self._map[offsets[first]:offsets[last]], bad)
+            labels.extend(chunk)
+            skipped += damaged
+            if job is not None:
+                job.progress(last - start, stop - start)
+        return labels, skipped
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+@timed("logfile.convert")
+def convert(source, target):
+    # One-time conversion of logs.json (and its journal) into logs.ndjson
+    from journal import LogJournal
+
+    journal = LogJournal(source)
+    records, skipped = journal.load()
+    journal.close()
+    # Not "<target>.<n>.tmp": the journal takes those for unapplied snapshots
+    tmp_path = target + ".converting"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(line + "\n" for line in journal.unreadable)
+        write_labels(f, (record.label() for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target)
+    return len(records), skipped
@@ -3,19 +3,40 @@ from tkinter import ttk, messagebox, filedialog
 from ttkbootstrap import Style
 import datetime
 import os
+import shutil
 import sys
 import json
-import csv
-import matplotlib.pyplot as plt
+import multiprocessing
+import threading
+import time
 from collections import Counter
-from openpyxl import Workbook
-from docx import Document
-from docx2pdf import convert
-import docx.shared
 
-from config import MUSHROOM_TYPES, RESTAURANT_ASSIGNMENTS
-
-LOG_FILE = "logs.json"
+from assets import existing
+from backups import BACKUP_DIR, MANIFEST_SUFFIX, PREVIEW_ROWS, BackupStore
+from browser import LogBrowser
+from config import MUSHROOM_TYPES, RESTAURANT_ASSIGNMENTS, LOG_FILE, SETTINGS_FILE
+from exports import (EXCEL_SPLITS, REPORT_ENGINES, export_path, write_csv, write_excel, write_summary_docx,
+                     write_summary_pdf, write_invoice_docx, write_invoice_pdf, convert_to_pdf,
+                     summary_analytics)
+from ingest import BulkValidationError, box_range_rows, file_rows, validate_rows
+from invoices import INVOICE_DIR, PERIODS, batch_records, period_bounds, write_invoice_batch
+from jobs import JobQueue
+import metrics
+from metrics import timed
+from records import DeliveryRecord, date_to_ordinal, ordinal_to_date, parse_labels
+from storage import open_store
+
+FILTER_DEBOUNCE_MS = 150
+JOB_POLL_MS = 100
+# How often the logs are checked for what other stations sharing them logged
+LOG_REFRESH_MS = 1000
+DIAGNOSTICS_REFRESH_MS = 1000
+# With "preload_modules" on, heavy libraries are imported in the background after startup
+PRELOAD_DELAY_MS = 500
+PRELOAD_MODULES = ("charts", "analytics", "openpyxl", "docx")
+# Scheduled backups only run when the logs changed; the newest BACKUP_KEEP are kept
+BACKUP_INTERVAL_MINUTES = 60
+BACKUP_KEEP = 48
 
 class MushroomApp:
     def __init__(self, root):
@@ -24,27 +45,64 @@ class MushroomApp:
         self.current_theme = "darkly"
         self.style = Style(self.current_theme)
 
-        self.logs = []
         self.filtered_logs = []
+        self.filtered_count = 0
+        self.filter_job = None
         self.is_mock_mode = os.getenv("USE_MOCK_SQUARE", "1") == "1"
         self.settings = {
             "theme": "darkly",
             "default_restaurant_id": 1,
             "invoice_template": ""
         }
-        self.settings_file = "settings.json"
+        self.settings_file = SETTINGS_FILE
         self.load_settings()
+        if metrics.trace_memory_requested(self.settings):
+            metrics.trace_memory(True)
+        self.store = open_store(self.settings, LOG_FILE)
+        self.jobs = JobQueue(self.settings.get("export_workers", 2))
+        self.jobs.on_callback_error = lambda job, e: self.show_toast(f"{job.name} failed: {e}", "error")
+        self.last_log_refresh = time.monotonic()
+        self.log_refresh_failed = False
+        self.log_load_failed = False
+        self.jobs_window = None
+        self.diagnostics_window = None
+        self.backup_timer = None
+        self.backed_up_version = None
 
         self.build_gui()
         self.load_logs()
         self.add_theme_toggle_button()
+        self.poll_jobs()
+        if self.settings.get("preload_modules", True):
+            self.root.after(PRELOAD_DELAY_MS, self.preload_modules)
+        self.schedule_backup()
         
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def on_close(self):
-        self.save_logs()
+        if self.jobs.active() and not messagebox.askyesno(
+                "Exports Running", "Exports are still running. Cancel them and exit?"):
+            return
+        self.jobs.shutdown()
+        # Every change is already persisted by the store; just let it finish pending work
+        self.store.close()
+        if self.settings.get("metrics_file"):
+            try:
+                metrics.dump(self.settings["metrics_file"])
+            except OSError:
+                pass  # Metrics must never block closing
         self.root.destroy()
 
+    def preload_modules(self):
+        def preload():
+            for name in PRELOAD_MODULES:
+                try:
+                    __import__(name)
+                except Exception:
+                    pass  # Reported properly when the feature is used
+
+        threading.Thread(target=preload, name="preload", daemon=True).start()
+
     def add_theme_toggle_button(self):
         toggle_frame = ttk.Frame(self.root)
         toggle_frame.pack(pady=(5, 10))
@@ -67,7 +125,7 @@ class MushroomApp:
 
         ttk.Label(search_frame, text="Search Deliveries:").pack(side="left")
         self.search_var = tk.StringVar()
-        self.search_var.trace_add("write", self.update_filtered_logs)
+        self.search_var.trace_add("write", self.schedule_filter_update)
         ttk.Entry(search_frame, textvariable=self.search_var, width=40).pack(side="left", padx=10)
 
         # --- Date Range Filter ---
@@ -76,12 +134,12 @@ class MushroomApp:
 
         ttk.Label(date_filter_frame, text="Start Date (YYYY-MM-DD):").pack(side="left")
         self.start_date_var = tk.StringVar()
-        self.start_date_var.trace_add("write", self.update_filtered_logs)
+        self.start_date_var.trace_add("write", self.schedule_filter_update)
         ttk.Entry(date_filter_frame, textvariable=self.start_date_var, width=12).pack(side="left", padx=5)
 
         ttk.Label(date_filter_frame, text="End Date (YYYY-MM-DD):").pack(side="left", padx=(20, 0))
         self.end_date_var = tk.StringVar()
-        self.end_date_var.trace_add("write", self.update_filtered_logs)
+        self.end_date_var.trace_add("write", self.schedule_filter_update)
         ttk.Entry(date_filter_frame, textvariable=self.end_date_var, width=12).pack(side="left", padx=5)
 
         # --- Delivery Form ---
@@ -134,18 +192,23 @@ class MushroomApp:
 
         actions = [
             ("Add Entry", self.confirm_add),
+            ("Bulk Add", self.open_bulk_add_window),
             ("Clear Form", self.clear_form),
             ("View Log", self.view_log),
             ("Save Logs", self.save_logs),
             ("Load Logs", self.load_logs),
             ("Generate Invoice (PDF)", self.generate_invoice),
+            ("Batch Invoices", self.open_batch_invoice_window),
             ("Show Charts", self.show_charts),
+            ("Analytics", self.show_analytics),
             ("Toggle Mock/Live Mode", self.toggle_mode),
             ("Settings", self.open_settings_window),
             ("Clear All Logs", self.clear_logs),
             ("Backup Manager", self.open_backup_manager),
             ("Export Summary Report", self.export_summary_report),
             ("Edit Logs", self.edit_logs),
+            ("Jobs", self.open_jobs_window),
+            ("Diagnostics", self.open_diagnostics_window),
         ]
 
         # Place Action Buttons
@@ -176,8 +239,7 @@ class MushroomApp:
         listbox = tk.Listbox(top, width=20, height=10)
         listbox.pack(padx=10, pady=10)
 
-        for date in dates:
-            listbox.insert(tk.END, date)
+        listbox.insert(tk.END, *dates)
 
         def set_selected_date():
             try:
@@ -193,14 +255,133 @@ class MushroomApp:
         if not self.validate_inputs():
             return
         if messagebox.askyesno("Confirm", "Add this entry to the traceability log?"):
-            label = self.generate_label()
-            self.logs.append(label)
-            self.save_logs()
+            record = self.generate_record()
+            label = record.label()
+            try:
+                self.store.add(record)
+            except Exception as e:
+                self.show_toast(f"Failed to save entry: {e}", "error")
+                return
             self.update_filtered_logs()
             self.update_export_button_state()  # 🔥 here
             self.show_toast(f"Added:\n{label}", "success")
             self.clear_form()
 
+    def open_bulk_add_window(self):
+        top = tk.Toplevel(self.root)
+        top.title("Bulk Add Deliveries")
+        top.geometry("560x520")
+
+        notebook = ttk.Notebook(top)
+        notebook.pack(fill="x", padx=10, pady=10)
+
+        # --- Box Range ---
+        range_frame = ttk.Frame(notebook, padding=10)
+        notebook.add(range_frame, text="Box Range")
+        fields = {}
+        rows = [
+            ("Mushroom Type:", "mushroom", [f"{k} - {v}" for k, v in MUSHROOM_TYPES.items()]),
+            ("Restaurant ID:", "restaurant", [f"{k} - {v}" for k, v in RESTAURANT_ASSIGNMENTS.items()]),
+            ("First Box:", "first_box", None),
+            ("Last Box:", "last_box", None),
+            ("Pack Date (YYYY-MM-DD):", "pack_date", None),
+            ("Ship Date (YYYY-MM-DD):", "ship_date", None),
+        ]
+        # Start from whatever is already in the main form
+        defaults = {"mushroom": self.mushroom_type_var.get(), "restaurant": self.restaurant_id_var.get(),
+                    "pack_date": self.pack_date_var.get(), "ship_date": self.ship_date_var.get()}
+        for i, (label, key, values) in enumerate(rows):
+            ttk.Label(range_frame, text=label).grid(row=i, column=0, sticky="w", pady=3)
+            fields[key] = tk.StringVar(value=defaults.get(key, ""))
+            if values:
+                widget = ttk.Combobox(range_frame, textvariable=fields[key], values=values, state="readonly")
+            else:
+                widget = ttk.Entry(range_frame, textvariable=fields[key])
+            widget.grid(row=i, column=1, padx=10, pady=3, sticky="ew")
+        range_frame.columnconfigure(1, weight=1)
+
+        # --- Import File ---
+        file_frame = ttk.Frame(notebook, padding=10)
+        notebook.add(file_frame, text="Import File")
+        ttk.Label(file_frame, text="CSV or Excel file with columns: Mushroom Type, Box Number,\n"
+                                   "Restaurant Name, Packed Date, Shipped Date (names or IDs).").pack(anchor="w")
+        path_var = tk.StringVar()
+        path_row = ttk.Frame(file_frame)
+        path_row.pack(fill="x", pady=10)
+        ttk.Entry(path_row, textvariable=path_var).pack(side="left", fill="x", expand=True, padx=(0, 5))
+
+        def browse():
+            path = filedialog.askopenfilename(title="Select Deliveries File",
+                                              filetypes=[("Deliveries", "*.csv *.xlsx"), ("All Files", "*.*")])
+            if path:
+                path_var.set(path)
+
+        ttk.Button(path_row, text="Browse", command=browse).pack(side="left")
+
+        # --- Problems ---
+        ttk.Label(top, text="Problems:").pack(anchor="w", padx=10)
+        problems = tk.Text(top, height=12, wrap="word", state="disabled")
+        problems.pack(fill="both", expand=True, padx=10)
+
+        def show_problems(lines):
+            problems.config(state="normal")
+            problems.delete("1.0", "end")
+            problems.insert("end", "\n".join(lines))
+            problems.config(state="disabled")
+
+        def failed(error):
+            if not top.winfo_exists():
+                self.show_toast(f"Bulk add failed: {error}", "error")
+                return
+            if isinstance(error, BulkValidationError):
+                show_problems([f"{where}: {message}" for where, message in error.errors])
+                self.show_toast(f"{len(error.errors)} invalid row(s); nothing was added.", "error")
+            else:
+                show_problems([str(error)])
+                self.show_toast(f"Bulk add failed: {error}", "error")
+
+        def commit(records):
+            if not top.winfo_exists():
+                return
+            show_problems([])
+            if not records:
+                self.show_toast("No deliveries found.", "error")
+                return
+            if not messagebox.askyesno("Confirm", f"Add {len(records)} deliveries to the traceability log?",
+                                       parent=top):
+                return
+            try:
+                self.store.add_many(records)
+            except Exception as e:
+                self.show_toast(f"Failed to save entries: {e}", "error")
+                return
+            # One write above, one refresh here
+            self.update_filtered_logs()
+            self.update_export_button_state()
+            self.show_toast(f"Added {len(records)} deliveries.", "success")
+            top.destroy()
+
+        def submit():
+            if notebook.index("current") == 0:
+                try:
+                    records = validate_rows(box_range_rows(
+                        fields["mushroom"].get(), fields["first_box"].get(), fields["last_box"].get(),
+                        fields["restaurant"].get(), fields["pack_date"].get(), fields["ship_date"].get()))
+                except BulkValidationError as e:
+                    failed(e)
+                    return
+                commit(records)
+            else:
+                path = path_var.get().strip()
+                if not path:
+                    self.show_toast("Choose a file to import.", "error")
+                    return
+                # Large spreadsheets are read and validated off the Tk thread
+                self.run_job(f"Import {os.path.basename(path)}", lambda job: validate_rows(file_rows(path)),
+                             on_done=commit, on_error=failed)
+
+        ttk.Button(top, text="Validate & Add", command=submit).pack(pady=10)
+
     def validate_inputs(self):
         try:
             int(self.mushroom_type_var.get().split(" - ")[0])
@@ -213,16 +394,12 @@ class MushroomApp:
             messagebox.showerror("Input Error", f"Invalid input: {e}")
             return False
 
-    def generate_label(self):
+    def generate_record(self):
         mushroom_id = int(self.mushroom_type_var.get().split(" - ")[0])
         box_number = int(self.box_number_var.get())
         restaurant_id = int(self.restaurant_id_var.get().split(" - ")[0])
-        pack_date = self.pack_date_var.get()
-        ship_date = self.ship_date_var.get()
-        mushroom_name = MUSHROOM_TYPES[mushroom_id]
-        restaurant_name = RESTAURANT_ASSIGNMENTS[restaurant_id]
-        tracking_number = f"{pack_date}-BOX{box_number:03d}"
-        return f"{mushroom_name} - {tracking_number} - {restaurant_name} - Packed: {pack_date} - Shipped: {ship_date}"
+        return DeliveryRecord.create(mushroom_id, box_number, restaurant_id,
+                                     self.pack_date_var.get(), self.ship_date_var.get())
 
     def clear_form(self):
         self.mushroom_type_var.set("")
@@ -231,76 +408,102 @@ class MushroomApp:
         self.pack_date_var.set("")
         self.ship_date_var.set("")
 
+    @timed("gui.save_logs")
     def save_logs(self):
+        # Full snapshot/checkpoint; routine adds and deletes are persisted as they happen
         try:
-            with open(LOG_FILE, "w") as f:
-                json.dump(self.logs, f, indent=4)
+            self.store.save()
             self.show_toast("Logs saved successfully!", "success")
         except Exception as e:
             self.show_toast("Save failed", "error")
 
+    @timed("gui.load_logs")
     def load_logs(self):
-        if not os.path.exists("logs.json"):
-            self.logs = []  # No file? Start fresh
-            self.save_logs()
+        if not self.store.exists():
+            self.store.replace_all([])  # No file? Start fresh
             self.update_filtered_logs()
             self.update_export_button_state()
             return
 
         try:
-            with open("logs.json", "r") as f:
-                loaded_data = json.load(f)
-
-            if isinstance(loaded_data, list):
-                self.logs = loaded_data
-                self.show_toast("Logs loaded successfully!", "success")
+            # Only the newest deliveries are read now; poll_jobs merges the rest when ready
+            skipped = self.store.load(background=True)
+            if skipped:
+                self.show_toast(f"Logs loaded. {skipped} unreadable entries are not shown; they stay in the log file.",
+                                "error")
+            elif self.store.loading:
+                self.show_toast("Recent logs loaded; loading older ones...", "info", 1500)
             else:
-                self.logs = []  # fallback to safe empty list
-                self.show_toast("Invalid logs format detected! Logs reset.", "error")
+                self.show_toast("Logs loaded successfully!", "success")
 
             self.update_filtered_logs()
             self.update_export_button_state()
 
         except Exception as e:
-            self.logs = []  # fallback to safe empty list
             self.show_toast(f"Failed to load logs: {e}", "error")
             self.update_filtered_logs()
             self.update_export_button_state()
 
     def clear_logs(self):
-        if not self.logs:
+        if not self.store.has_records():
             self.show_toast("No logs to clear.", "info")
             return
 
         confirm = messagebox.askyesno("Confirm", "Are you sure you want to delete all logs? A backup will be created.")
         if confirm:
-            self.backup_logs()  # 🔥 Backup before clearing
-            self.logs.clear()
-            self.save_logs()
+            # 🔥 Backup before clearing; the logs stay if it could not be written
+            if not self.backup_logs("before clear"):
+                return
+            self.store.replace_all([])
             self.update_filtered_logs()
             self.update_export_button_state()
             self.show_toast("All logs cleared successfully! Backup created.", "success")
 
-    def backup_logs(self):
-        base_folder = self.settings.get("export_folder", "")
-        if not base_folder:
-            base_folder = "."
-
-        backup_folder = os.path.join(base_folder, "backups")
-
-        # Create backups/ folder if it doesn't exist
-        if not os.path.exists(backup_folder):
-            os.makedirs(backup_folder)
-
-        now = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
-        backup_filename = os.path.join(backup_folder, f"logs_backup_{now}.json")
+    def backup_store(self):
+        return BackupStore(os.path.join(self.export_folder(), BACKUP_DIR))
 
+    def backup_logs(self, reason="manual"):
         try:
-            with open(backup_filename, "w") as f:
-                json.dump(self.logs, f, indent=4)
-            self.show_toast(f"Backup created: {os.path.basename(backup_filename)}", "success")
+            backup = self.backup_store().create(self.store.query(), reason)
+            self.show_toast(f"Backup created: {backup['name']}", "success")
+            return True
         except Exception as e:
             self.show_toast(f"Failed to create backup: {e}", "error")
+            return False
+
+    def schedule_backup(self):
+        if self.backup_timer is not None:
+            self.root.after_cancel(self.backup_timer)
+            self.backup_timer = None
+        minutes = self.settings.get("backup_interval_minutes", BACKUP_INTERVAL_MINUTES)
+        if minutes and minutes > 0:
+            self.backup_timer = self.root.after(int(minutes * 60000), self.scheduled_backup)
+
+    def scheduled_backup(self):
+        self.backup_timer = None
+        self.schedule_backup()
+        version = self.store.version
+        if version == self.backed_up_version or not self.store.has_records():
+            return
+        # Only changed segments are compressed and written, so this is cheap when little changed
+        records, total = self.store.snapshot(), self.store.count()
+        backups = self.backup_store()
+        keep = self.settings.get("backup_keep", BACKUP_KEEP)
+
+        def build(job):
+            backup = backups.create(records, "scheduled", total, job)
+            backups.prune("scheduled", keep)
+            return backup
+
+        def done(_backup):
+            self.backed_up_version = version
+
+        def failed(error):
+            self.show_toast(f"Scheduled backup failed: {error}", "error")
+
+        # Submitted directly: a toast every interval would just be noise
+        self.jobs.submit("Scheduled backup", build, on_done=done, on_error=failed)
+        self.refresh_jobs()
 
     def load_settings(self):
         if os.path.exists(self.settings_file):
@@ -333,15 +536,30 @@ class MushroomApp:
         self.settings["invoice_template"] = self.invoice_template_var.get()
         self.settings["export_folder"] = self.export_folder_var.get()
         self.settings["default_export_format"] = self.default_export_format_var.get()
+        self.settings["excel_split"] = self.excel_split_var.get()
+        self.settings["report_engine"] = self.report_engine_var.get()
         self.settings["logo_path"] = self.logo_path_var.get()
+        self.settings["preload_modules"] = self.preload_modules_var.get()
+        self.settings["report_analytics"] = self.report_analytics_var.get()
+        self.settings["report_charts"] = self.report_charts_var.get()
+        try:
+            self.settings["backup_interval_minutes"] = max(0, self.backup_interval_var.get())
+        except tk.TclError:
+            self.show_toast("Backup interval must be a whole number of minutes.", "error")
+            return
+        backend_changed = self.storage_backend_var.get() != self.settings.get("storage_backend", "journal")
+        self.settings["storage_backend"] = self.storage_backend_var.get()
         self.save_settings()
+        self.schedule_backup()
+        if backend_changed:
+            messagebox.showinfo("Restart Required", "Restart the app to switch log storage.")
         self.show_toast("Settings saved!", "success")
         window.destroy()
 
     def open_settings_window(self):
         top = tk.Toplevel(self.root)
         top.title("Settings")
-        top.geometry("450x350")
+        top.geometry("450x690")
         top.resizable(False, False)
 
         # Default Restaurant ID
@@ -355,6 +573,21 @@ class MushroomApp:
         export_options = ["csv", "excel", "pdf"]
         ttk.Combobox(top, textvariable=self.default_export_format_var, values=export_options, state="readonly").pack()
 
+        # Excel Sheet Split
+        ttk.Label(top, text="Split Excel Sheets By:").pack(pady=(10, 0))
+        self.excel_split_var = tk.StringVar(value=self.settings.get("excel_split", "none"))
+        ttk.Combobox(top, textvariable=self.excel_split_var, values=list(EXCEL_SPLITS), state="readonly").pack()
+
+        # Invoice/Report Engine
+        ttk.Label(top, text="Invoices & Reports (native PDF, Word PDF, or DOCX only):").pack(pady=(10, 0))
+        self.report_engine_var = tk.StringVar(value=self.settings.get("report_engine", "native"))
+        ttk.Combobox(top, textvariable=self.report_engine_var, values=list(REPORT_ENGINES), state="readonly").pack()
+
+        # Log Storage Backend
+        ttk.Label(top, text="Log Storage:").pack(pady=(10, 0))
+        self.storage_backend_var = tk.StringVar(value=self.settings.get("storage_backend", "journal"))
+        ttk.Combobox(top, textvariable=self.storage_backend_var, values=["journal", "sqlite"], state="readonly").pack()
+
         # Invoice Template Path
         ttk.Label(top, text="Invoice Template (.docx) Path:").pack(pady=(10, 0))
         self.invoice_template_var = tk.StringVar(value=self.settings.get("invoice_template", ""))
@@ -382,123 +615,200 @@ class MushroomApp:
         ttk.Entry(folder_frame, textvariable=self.export_folder_var, width=30).pack(side="left", padx=(0, 5))
         ttk.Button(folder_frame, text="Browse Folder", command=self.browse_export_folder).pack(side="left")
 
+        # Analytics section in summary reports
+        self.report_analytics_var = tk.BooleanVar(value=self.settings.get("report_analytics", True))
+        ttk.Checkbutton(top, text="Include analytics in summary reports",
+                        variable=self.report_analytics_var).pack(pady=(10, 0))
+
+        # Charts in summary reports
+        self.report_charts_var = tk.BooleanVar(value=self.settings.get("report_charts", True))
+        ttk.Checkbutton(top, text="Include charts in summary reports",
+                        variable=self.report_charts_var).pack(pady=(10, 0))
+
+        # Background preloading of chart/export libraries
+        self.preload_modules_var = tk.BooleanVar(value=self.settings.get("preload_modules", True))
+        ttk.Checkbutton(top, text="Preload chart/export libraries after startup",
+                        variable=self.preload_modules_var).pack(pady=(10, 0))
+
+        # Scheduled backups
+        backup_frame = ttk.Frame(top)
+        backup_frame.pack(pady=(10, 0))
+        ttk.Label(backup_frame, text="Back up logs every").pack(side="left")
+        self.backup_interval_var = tk.IntVar(value=self.settings.get("backup_interval_minutes", BACKUP_INTERVAL_MINUTES))
+        ttk.Entry(backup_frame, textvariable=self.backup_interval_var, width=6).pack(side="left", padx=5)
+        ttk.Label(backup_frame, text="minutes (0 = off)").pack(side="left")
+
         # Save Button
         ttk.Button(top, text="Save Settings", command=lambda: self.save_settings_from_ui(top)).pack(pady=20)
 
-    def update_filtered_logs(self, *_):
-        search = self.search_var.get().lower()
-        start_date = self.start_date_var.get()
-        end_date = self.end_date_var.get()
-
-        self.filtered_logs = []
+    def parse_date_bound(self, value):
+        # Half-typed dates are ignored until they parse
+        try:
+            return date_to_ordinal(value.strip()) if value.strip() else None
+        except ValueError:
+            return None
 
-        for log in self.logs:
-            if search and search not in log.lower():
-                continue
+    def current_date_range(self):
+        return (self.parse_date_bound(self.start_date_var.get()),
+                self.parse_date_bound(self.end_date_var.get()))
 
-            parts = log.split(" - ")
-            try:
-                pack_date_str = parts[3].split(": ")[1]  # Extract Pack Date
-            except (IndexError, ValueError):
-                continue  # Skip bad logs
+    def schedule_filter_update(self, *_):
+        # Debounce keystrokes so only the last edit in a burst runs the search
+        if self.filter_job is not None:
+            self.root.after_cancel(self.filter_job)
+        self.filter_job = self.root.after(FILTER_DEBOUNCE_MS, self.update_filtered_logs)
 
-            if start_date:
-                try:
-                    if pack_date_str < start_date:
-                        continue
-                except:
-                    continue
-
-            if end_date:
-                try:
-                    if pack_date_str > end_date:
-                        continue
-                except:
-                    continue
+    @timed("gui.update_filtered_logs")
+    def update_filtered_logs(self, *_):
+        self.filter_job = None
+        search = self.search_var.get().lower()
+        start_date, end_date = self.current_date_range()
 
-            self.filtered_logs.append(log)
+        if self.store.loading and (search or start_date is not None or end_date is not None):
+            # Filters need the whole history; finish_loading_logs runs this again
+            return
+        # Only the count and a short preview (newest first) are kept; the store does the filtering
+        self.filtered_count = self.store.count(start_date, end_date, search)
+        self.filtered_logs = list(self.store.query(start_date, end_date, search, limit=5, newest_first=True))
 
     def view_log(self):
         if not self.filtered_logs:
             self.show_toast("No matching entries found.", "info")
         else:
-            log_preview = "\n".join(self.filtered_logs[:5])
-            self.show_toast(f"{len(self.filtered_logs)} result(s). Preview:\n{log_preview}", "info", duration=4000)
+            log_preview = "\n".join(record.label() for record in self.filtered_logs[:5])
+            self.show_toast(f"{self.filtered_count} result(s). Preview:\n{log_preview}", "info", duration=4000)
 
     def edit_logs(self):
-        if not self.logs:
+        if not self.store.has_records():
             self.show_toast("No logs to edit.", "info")
             return
 
         top = tk.Toplevel(self.root)
         top.title("Edit Logs")
-        top.geometry("700x400")
-
-        ttk.Label(top, text="Select a log to delete:").pack(pady=(10, 0))
-
-        self.log_listbox = tk.Listbox(top, width=100, height=15)
-        self.log_listbox.pack(pady=10)
-
-        for log in self.logs:
-            self.log_listbox.insert(tk.END, log)
-
-        ttk.Button(top, text="Delete Selected", command=lambda: self.delete_selected_log(top)).pack(pady=10)
-
-    def delete_selected_log(self, window):
-        selection = self.log_listbox.curselection()
-        if not selection:
+        top.geometry("700x460")
+
+        search_frame = ttk.Frame(top)
+        search_frame.pack(fill="x", padx=10, pady=(10, 0))
+        ttk.Label(search_frame, text="Search:").pack(side="left")
+        search_var = tk.StringVar()
+        ttk.Entry(search_frame, textvariable=search_var).pack(side="left", fill="x", expand=True, padx=(5, 0))
+
+        ttk.Label(top, text="Select logs to delete (Ctrl/Shift-click for several, click a column to sort):").pack(
+            pady=(10, 0))
+        browser = LogBrowser(top, self.store)
+        browser.pack(expand=True, fill="both", padx=10, pady=10)
+
+        search_job = None
+
+        def apply_search():
+            nonlocal search_job
+            search_job = None
+            browser.set_filters(search=search_var.get().lower() or None)
+
+        def schedule_search(*_):
+            nonlocal search_job
+            if search_job is not None:
+                top.after_cancel(search_job)
+            search_job = top.after(FILTER_DEBOUNCE_MS, apply_search)
+
+        search_var.trace_add("write", schedule_search)
+        ttk.Button(top, text="Delete Selected", command=lambda: self.delete_selected_logs(browser)).pack(pady=(0, 10))
+
+    def delete_selected_logs(self, browser):
+        rids = browser.selected_rids()
+        if not rids:
             self.show_toast("No log selected.", "info")
             return
 
-        confirm = messagebox.askyesno("Confirm", "Delete the selected log?")
-        if not confirm:
+        noun = "log" if len(rids) == 1 else f"{len(rids)} logs"
+        if not messagebox.askyesno("Confirm", f"Delete the selected {noun}?"):
             return
 
-        index = selection[0]
-        deleted_log = self.logs.pop(index)
-
-        self.save_logs()
+        try:
+            deleted = self.store.delete(rids)
+        except Exception as e:
+            self.show_toast(f"Failed to delete log: {e}", "error")
+            return
+        browser.clear_selection()
+        browser.refresh()
         self.update_filtered_logs()
         self.update_export_button_state()
-        self.show_toast("Log deleted successfully.", "success")
-        window.destroy()
-
-    def show_charts(self):
-        if not self.logs:
-            messagebox.showwarning("No Data", "No entries to display charts.")
-            return
+        self.show_toast(f"Deleted {deleted} log(s).", "success")
 
-        mushroom_counter = Counter()
-        date_counter = Counter()
+    def chart_counts(self, start_date, end_date):
+        # Both come from the store's running statistics, so this is cheap at any size
+        mushroom_counts = {MUSHROOM_TYPES.get(k, str(k)): v
+                           for k, v in self.store.count_by("mushroom_id", start_date, end_date).items()}
+        return mushroom_counts, self.store.count_by("pack_date", start_date, end_date)
 
-        for entry in self.logs:
-            parts = entry.split(" - ")
-            mushroom_type = parts[0]
-            pack_date = parts[3].split(": ")[1]
-            mushroom_counter[mushroom_type] += 1
-            date_counter[pack_date] += 1
+    def chart_cache(self):
+        # Kept inside the export folder; reports reuse the images Show Charts rendered
+        from charts import CACHE_DIR, ChartCache
 
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
-        fig.suptitle('Delivery Statistics', fontsize=16)
+        return ChartCache(os.path.join(self.export_folder(), CACHE_DIR))
 
-        ax1.bar(mushroom_counter.keys(), mushroom_counter.values(), color='skyblue')
-        ax1.set_title('Deliveries per Mushroom Type')
-        ax1.set_xlabel('Mushroom Type')
-        ax1.set_ylabel('Deliveries')
-        ax1.tick_params(axis='x', rotation=45)
+    def show_charts(self):
+        start_date, end_date = self.current_date_range()
+        if not self.store.count(start_date, end_date):
+            messagebox.showwarning("No Data", "No entries to display charts.")
+            return
 
-        sorted_dates = sorted(date_counter.items())
-        dates, counts = zip(*sorted_dates)
-        ax2.bar(dates, counts, color='lightgreen')
-        ax2.set_title('Deliveries per Pack Date')
-        ax2.set_xlabel('Pack Date')
-        ax2.set_ylabel('Deliveries')
-        ax2.tick_params(axis='x', rotation=90)
+        mushroom_counts, date_counts = self.chart_counts(start_date, end_date)
+        cache = self.chart_cache()
+        path = cache.lookup(mushroom_counts, date_counts)
+        if path:
+            self.open_chart_window(path)
+            return
+        self.run_job("Charts", lambda job: cache.render(mushroom_counts, date_counts), on_done=self.open_chart_window)
 
-        plt.tight_layout()
-        plt.show()
+    def open_chart_window(self, path):
+        top = tk.Toplevel(self.root)
+        top.title("Delivery Statistics")
+        image = tk.PhotoImage(file=path)
+        label = ttk.Label(top, image=image)
+        label.image = image  # Tk drops images nothing in Python refers to
+        label.pack(padx=10, pady=10)
+
+        def save_copy():
+            target = filedialog.asksaveasfilename(title="Save Chart", defaultextension=".png",
+                                                  filetypes=[("PNG Images", "*.png")])
+            if target:
+                shutil.copyfile(path, target)
+                self.show_toast(f"Chart saved to {os.path.basename(target)}", "success")
+
+        ttk.Button(top, text="Save as PNG", command=save_copy).pack(pady=(0, 10))
+
+    def show_analytics(self):
+        start_date, end_date = self.current_date_range()
+        if not self.store.count(start_date, end_date):
+            messagebox.showwarning("No Data", "No entries to analyze.")
+            return
+        records = self.store.snapshot(start_date, end_date)
+
+        def build(job):
+            sections = summary_analytics(records)
+            if sections is None:
+                raise RuntimeError("NumPy is not installed")
+            from analytics import render_text
+            return render_text(sections)
+
+        def done(text):
+            top = tk.Toplevel(self.root)
+            top.title("Delivery Analytics")
+            top.geometry("760x520")
+            box = tk.Text(top, wrap="none", font=("Consolas", 10))
+            scroll = ttk.Scrollbar(top, orient="vertical", command=box.yview)
+            box.configure(yscrollcommand=scroll.set)
+            scroll.pack(side="right", fill="y")
+            box.pack(expand=True, fill="both", padx=(10, 0), pady=10)
+            box.insert("1.0", text)
+            box.configure(state="disabled")
+
+        self.run_job("Analytics", build, on_done=done)
 
     def show_toast(self, message, type="info", duration=3000):
+        if type == "error":
+            metrics.record_error("gui", message)
         toast = tk.Toplevel(self.root)
         toast.overrideredirect(True)
         toast.attributes("-topmost", True)
@@ -524,204 +834,376 @@ class MushroomApp:
         # Auto-destroy
         toast.after(duration, toast.destroy)
 
+    def export_folder(self):
+        return self.settings.get("export_folder", "") or "."
+
+    def branding(self):
+        # (logo, invoice template) for documents; unset or missing files are left out
+        return existing(self.settings.get("logo_path", "")), existing(self.settings.get("invoice_template", ""))
+
+    def run_job(self, name, func, *args, on_done=None, on_error=None):
+        # Runs func(job, *args) off the Tk thread; the outcome comes back as a toast
+        def failed(error):
+            self.show_toast(f"{name} failed: {error}", "error")
+
+        self.jobs.submit(name, func, *args, on_done=on_done, on_error=on_error or failed)
+        self.show_toast(f"{name} started.", "info", 1500)
+        self.refresh_jobs()
+
+    def poll_jobs(self):
+        try:
+            if self.jobs.pump():
+                self.refresh_jobs()
+            self.poll_log_load()
+            now = time.monotonic()
+            if now - self.last_log_refresh >= LOG_REFRESH_MS / 1000:
+                self.last_log_refresh = now
+                self.refresh_shared_logs()
+        finally:
+            self.root.after(JOB_POLL_MS, self.poll_jobs)
+
+    def poll_log_load(self):
+        try:
+            merged = self.store.poll_load()
+        except Exception as e:
+            # Retried on the next tick, e.g. while another station holds the logs
+            if not self.log_load_failed:
+                metrics.record_error("gui.load_logs", str(e))
+                self.show_toast(f"Could not load older logs yet: {e}", "error")
+            self.log_load_failed = True
+            return
+        self.log_load_failed = False
+        if merged:
+            self.finish_loading_logs()
+
+    def refresh_shared_logs(self):
+        try:
+            changed = self.store.refresh()
+        except Exception as e:
+            # Once per outage, e.g. while the network share is unreachable
+            if not self.log_refresh_failed:
+                self.show_toast(f"Failed to refresh logs: {e}", "error")
+            self.log_refresh_failed = True
+            return
+        self.log_refresh_failed = False
+        if changed:
+            self.update_filtered_logs()
+            self.update_export_button_state()
+
+    def finish_loading_logs(self):
+        skipped = self.store.load_skipped
+        if skipped:
+            self.show_toast(f"All logs loaded. {skipped} unreadable entries are not shown; they stay in the log file.",
+                            "error")
+        self.update_filtered_logs()
+        self.update_export_button_state()
+        self.refresh_jobs()
+
+    def refresh_jobs(self):
+        active = len(self.jobs.active())
+        text = self.get_mode_text()
+        if active:
+            text += f"  |  ⏳ {active} job{'s' if active != 1 else ''} running"
+        if self.store.loading:
+            text += "  |  ⏳ loading older logs"
+        self.status_label.config(text=text)
+
+        if self.jobs_window is None or not self.jobs_window.winfo_exists():
+            return
+        tree = self.jobs_tree
+        for job in self.jobs.jobs.values():
+            values = (job.name, job.status, job.progress_text())
+            if tree.exists(str(job.id)):
+                tree.item(str(job.id), values=values)
+            else:
+                tree.insert("", 0, iid=str(job.id), values=values)
+        for iid in tree.get_children():
+            if int(iid) not in self.jobs.jobs:
+                tree.delete(iid)
+
+    def open_jobs_window(self):
+        if self.jobs_window is not None and self.jobs_window.winfo_exists():
+            self.jobs_window.lift()
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Jobs")
+        window.geometry("520x300")
+        self.jobs_window = window
+
+        self.jobs_tree = ttk.Treeview(window, columns=("job", "status", "progress"), show="headings", height=8)
+        for column, width in (("job", 220), ("status", 90), ("progress", 160)):
+            self.jobs_tree.heading(column, text=column.capitalize())
+            self.jobs_tree.column(column, width=width)
+        self.jobs_tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def cancel_selected():
+            for iid in self.jobs_tree.selection():
+                if self.jobs.cancel(int(iid)):
+                    self.show_toast("Job cancelled.", "info")
+            self.refresh_jobs()
+
+        ttk.Button(window, text="Cancel Selected", command=cancel_selected).pack(pady=(0, 10))
+        self.refresh_jobs()
+
+    def open_diagnostics_window(self):
+        if self.diagnostics_window is not None and self.diagnostics_window.winfo_exists():
+            self.diagnostics_window.lift()
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Diagnostics")
+        window.geometry("860x560")
+        self.diagnostics_window = window
+
+        columns = (("operation", "Operation", 200), ("calls", "Calls", 60), ("errors", "Errors", 60),
+                   ("total", "Total s", 80), ("mean", "Mean ms", 80), ("p95", "p95 ms", 80), ("max", "Max ms", 80),
+                   ("peak", "Peak MB", 80))
+        tree = ttk.Treeview(window, columns=[c for c, _, _ in columns], show="headings", height=12)
+        for column, heading, width in columns:
+            tree.heading(column, text=heading)
+            tree.column(column, width=width, anchor="w" if column == "operation" else "e")
+        tree.pack(fill="both", expand=True, padx=10, pady=(10, 0))
+        details = tk.Text(window, height=10, wrap="none", font=("Consolas", 10))
+        details.pack(fill="x", padx=10, pady=(10, 0))
+
+        memory_var = tk.BooleanVar(value=metrics.REGISTRY.snapshot()["memory_tracking"])
+
+        def refresh():
+            if not window.winfo_exists():
+                return
+            snapshot = metrics.REGISTRY.snapshot()
+            # Slowest in total first: that is where the time goes
+            tree.delete(*tree.get_children())
+            for name, op in sorted(snapshot["operations"].items(), key=lambda item: -item[1]["seconds"]):
+                peak = f"{op['peak_bytes'] / 1e6:.1f}" if op["peak_bytes"] is not None else ""
+                tree.insert("", "end", values=(name, op["calls"], op["errors"], f"{op['seconds']:.3f}",
+                                               f"{op['mean'] * 1e3:.1f}", f"{op['p95'] * 1e3:.1f}",
+                                               f"{op['max'] * 1e3:.1f}", peak))
+            lines = [f"Since {snapshot['started'].replace('T', ' ')}"]
+            lines += [f"{name}: {n}" for name, n in sorted(snapshot["counters"].items())]
+            if snapshot["errors"]:
+                lines += ["", "Recent errors:"]
+                lines += [f"{e['time'][11:]}  {e['source']}: {e['message']}" for e in reversed(snapshot["errors"])]
+            details.configure(state="normal")
+            details.delete("1.0", tk.END)
+            details.insert("1.0", "\n".join(lines))
+            details.configure(state="disabled")
+            window.after(DIAGNOSTICS_REFRESH_MS, refresh)
+
+        def save():
+            path = filedialog.asksaveasfilename(
+                parent=window, title="Save Metrics", initialdir=self.export_folder(), defaultextension=".json",
+                initialfile=f"metrics_{datetime.date.today()}.json",
+                filetypes=[("JSON", "*.json"), ("Prometheus text", "*.prom")])
+            if not path:
+                return
+            try:
+                metrics.dump(path)
+                self.show_toast(f"Metrics saved to {os.path.basename(path)}", "success")
+            except OSError as e:
+                self.show_toast(f"Failed to save metrics: {e}", "error")
+
+        def reset():
+            metrics.REGISTRY.reset()
+
+        def toggle_memory():
+            # Tracing makes everything slower, so it is kept as a setting rather than always on
+            metrics.trace_memory(memory_var.get())
+            self.settings["metrics_trace_memory"] = memory_var.get()
+            self.save_settings()
+
+        button_frame = ttk.Frame(window)
+        button_frame.pack(pady=10)
+        ttk.Checkbutton(button_frame, text="Track peak memory (slower)", variable=memory_var,
+                        command=toggle_memory).pack(side="left", padx=10)
+        ttk.Button(button_frame, text="Save Metrics...", command=save).pack(side="left", padx=10)
+        ttk.Button(button_frame, text="Reset", command=reset).pack(side="left", padx=10)
+        refresh()
+
     def export_to_csv(self):
-        if not self.logs:
+        if not self.store.has_records():
             self.show_toast("No data to export.", "error")
             return
 
-        folder = self.settings.get("export_folder", "")
-        if not folder:
-            folder = "."
-
         today = datetime.date.today().strftime("%Y-%m-%d")
-        filepath = os.path.join(folder, f"traceability_log_{today}.csv")
-
-        with open(filepath, "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Mushroom Type", "Box Number", "Restaurant Name", "Packed Date", "Shipped Date"])
-            for entry in self.logs:
-                parts = entry.split(" - ")
-                writer.writerow([
-                    parts[0],
-                    parts[1].split("BOX")[1],
-                    parts[2],
-                    parts[3].split(": ")[1],
-                    parts[4].split(": ")[1]
-                ])
-        self.show_toast(f"Saved to {filepath}!", "success")
+        filepath = export_path(self.export_folder(), "traceability_log", today, "csv")
+        start_date, end_date = self.current_date_range()
+        total = self.store.count(start_date, end_date)
+        records = self.store.snapshot(start_date, end_date)
+
+        self.run_job("CSV export", lambda job: write_csv(filepath, records, total, job),
+                     on_done=lambda path: self.show_toast(f"Saved to {path}!", "success"))
 
     def export_to_excel(self):
-        if not self.logs:
+        if not self.store.has_records():
             self.show_toast("No data to export.", "error")
             return
 
-        folder = self.settings.get("export_folder", "")
-        if not folder:
-            folder = "."
-
         today = datetime.date.today().strftime("%Y-%m-%d")
-        filepath = os.path.join(folder, f"traceability_log_{today}.xlsx")
-
-        workbook = Workbook()
-        sheet = workbook.active
-        sheet.title = "Traceability Log"
-        sheet.append(["Mushroom Type", "Box Number", "Restaurant Name", "Packed Date", "Shipped Date"])
-
-        for entry in self.logs:
-            parts = entry.split(" - ")
-            sheet.append([
-                parts[0],
-                parts[1].split("BOX")[1],
-                parts[2],
-                parts[3].split(": ")[1],
-                parts[4].split(": ")[1]
-            ])
-
-        workbook.save(filepath)
-        self.show_toast(f"Saved to {filepath}!", "success")
+        filepath = export_path(self.export_folder(), "traceability_log", today, "xlsx")
+        start_date, end_date = self.current_date_range()
+        total = self.store.count(start_date, end_date)
+        records = self.store.snapshot(start_date, end_date)
+
+        split_by = self.settings.get("excel_split", "none")
+
+        self.run_job("Excel export", lambda job: write_excel(filepath, records, total, job, split_by),
+                     on_done=lambda path: self.show_toast(f"Saved to {path}!", "success"))
 
     def export_summary_report(self):
-        if not self.logs:
+        if not self.store.has_records():
             self.show_toast("No data to export summary.", "error")
             return
 
-        folder = self.settings.get("export_folder", "")
-        if not folder:
-            folder = "."
-
+        folder = self.export_folder()
         today = datetime.date.today().strftime("%Y-%m-%d")
-        doc_name = os.path.join(folder, f"summary_report_{today}.docx")
-        pdf_name = os.path.join(folder, f"summary_report_{today}.pdf")
-
-        from collections import Counter
-        import docx.shared
+        doc_name = export_path(folder, "summary_report", today, "docx")
+        pdf_name = export_path(folder, "summary_report", today, "pdf")
 
         # Count mushrooms
-        mushroom_counter = Counter()
-        for entry in self.logs:
-            parts = entry.split(" - ")
-            mushroom_type = parts[0]
-            mushroom_counter[mushroom_type] += 1
-
-        doc = Document()
-
-        # Insert logo first if available
-        try:
-            logo_path = self.settings.get("logo_path", "")
-            if logo_path and os.path.exists(logo_path):
-                absolute_logo_path = os.path.abspath(logo_path)
-                from PIL import Image
-
-                # Open image with PIL to check size
-                img = Image.open(absolute_logo_path)
-                img_width, img_height = img.size  # in pixels
-
-                # Define a maximum width (in inches)
-                max_width_inch = 2.0
-                dpi = img.info.get('dpi', (96, 96))[0]  # default 96 dpi if missing
-
-                # Convert pixels to inches
-                img_width_inch = img_width / dpi
-
-                # If image is wider than allowed, resize it
-                if img_width_inch > max_width_inch:
-                    doc.add_picture(absolute_logo_path, width=docx.shared.Inches(max_width_inch))
-                else:
-                    doc.add_picture(absolute_logo_path)  # Insert without resizing
-        except Exception as e:
-            self.show_toast(f"Failed to insert logo: {e}", "error")
-
-        # Add Title and Metadata
-        doc.add_heading('Mushroom Deliveries Summary', 0)
-        doc.add_paragraph(f"Export Date: {today}")
-        doc.add_paragraph(f"Total Deliveries: {len(self.logs)}")
-
-        # Deliveries per Mushroom Type
-        doc.add_heading('Deliveries per Mushroom Type', level=1)
-        for mushroom, count in mushroom_counter.items():
-            doc.add_paragraph(f"{mushroom}: {count} deliveries", style="List Bullet")
-
-        # Detailed Deliveries Table
-        doc.add_heading('Detailed Deliveries', level=1)
-
-        table = doc.add_table(rows=1, cols=5)
-        table.style = 'Table Grid'
-        hdr = table.rows[0].cells
-        headers = ["Mushroom Type", "Box Number", "Restaurant", "Pack Date", "Ship Date"]
-        for i, header in enumerate(headers):
-            hdr[i].text = header
-
-        for entry in self.logs:
-            parts = entry.split(" - ")
-            row = table.add_row().cells
-            row[0].text = parts[0]
-            row[1].text = parts[1].split("BOX")[1]
-            row[2].text = parts[2]
-            row[3].text = parts[3].split(": ")[1]
-            row[4].text = parts[4].split(": ")[1]
-
-        doc.save(doc_name)
-
-        # Convert to PDF
-        try:
-            from docx2pdf import convert
-            convert(doc_name, pdf_name)
-            self.show_toast(f"Summary exported: {os.path.basename(pdf_name)}", "success")
-            os.startfile(pdf_name)
-        except Exception as e:
-            self.show_toast(f"PDF conversion failed: {e}", "error")
+        start_date, end_date = self.current_date_range()
+        mushroom_counter = Counter({MUSHROOM_TYPES.get(k, str(k)): v
+                                    for k, v in self.store.count_by("mushroom_id", start_date, end_date).items()})
+        total = sum(mushroom_counter.values())
+        records = self.store.snapshot(start_date, end_date)
+        logo_path = self.settings.get("logo_path", "")
+
+        engine = self.settings.get("report_engine", "native")
+        with_analytics = self.settings.get("report_analytics", True)
+        chart_cache = self.chart_cache() if self.settings.get("report_charts", True) else None
+        if chart_cache is not None:
+            chart_counts = self.chart_counts(start_date, end_date)
+
+        def build(job):
+            analytics = None
+            notes = []
+            chart_path = None
+            if chart_cache is not None:
+                job.progress(0, total, "charts")
+                # Same cached image as Show Charts when nothing changed since
+                chart_path = chart_cache.render(*chart_counts)
+            if with_analytics:
+                job.progress(0, total, "analytics")
+                analytics = summary_analytics(records)
+                if analytics is None:
+                    notes.append("Analytics skipped: NumPy is not installed.")
+            if engine == "native":
+                warnings = write_summary_pdf(pdf_name, records, mushroom_counter, today, logo_path, total, job, analytics,
+                                             chart_path)
+                return pdf_name, notes + warnings
+            warnings = notes + write_summary_docx(doc_name, records, mushroom_counter, today, logo_path, total, job,
+                                                  analytics, chart_path)
+            if engine == "docx":
+                return doc_name, warnings
+            return convert_to_pdf(doc_name, pdf_name, job), warnings
+
+        def done(result):
+            path, warnings = result
+            for warning in warnings:
+                self.show_toast(warning, "error")
+            self.show_toast(f"Summary exported: {os.path.basename(path)}", "success")
+            self.open_document(path)
+
+        self.run_job("Summary report", build, on_done=done)
+
+    def open_document(self, path):
+        # os.startfile only exists on Windows; elsewhere the toast is enough
+        if hasattr(os, "startfile"):
+            os.startfile(path)
 
     def update_export_button_state(self):
         if hasattr(self, 'export_button'):
-            if self.logs:
+            if self.store.has_records():
                 self.export_button.config(state="normal")
             else:
                 self.export_button.config(state="disabled")
 
     def generate_invoice(self):
-        if not self.logs:
+        if not self.store.has_records():
             self.show_toast("No data to generate invoice.", "error")
             return
 
-        folder = self.settings.get("export_folder", "")
-        if not folder:
-            folder = "."
-
+        folder = self.export_folder()
         today = datetime.date.today().strftime("%Y-%m-%d")
-        doc_name = os.path.join(folder, f"invoice_{today}.docx")
-        pdf_name = os.path.join(folder, f"invoice_{today}.pdf")
-
-        doc = Document()
-        doc.add_heading('Mushroom Traceability Invoice', 0)
-
-        # Table header
-        table = doc.add_table(rows=1, cols=5)
-        table.style = 'Table Grid'
-        hdr = table.rows[0].cells
-        headers = ["Mushroom Type", "Box Number", "Restaurant", "Pack Date", "Ship Date"]
-        for i, header in enumerate(headers):
-            hdr[i].text = header
-
-        # Only include most recent entry
-        latest_entry = self.logs[-1] if self.logs else None
-        if latest_entry:
-            parts = latest_entry.split(" - ")
-            row = table.add_row().cells
-            row[0].text = parts[0]
-            row[1].text = parts[1].split("BOX")[1]
-            row[2].text = parts[2]
-            row[3].text = parts[3].split(": ")[1]
-            row[4].text = parts[4].split(": ")[1]
-
-        doc.save(doc_name)
+        doc_name = export_path(folder, "invoice", today, "docx")
+        pdf_name = export_path(folder, "invoice", today, "pdf")
+        latest_entry = self.store.latest()
+        engine = self.settings.get("report_engine", "native")
+        logo_path, template_path = self.branding()
+
+        def build(job):
+            if engine == "native":
+                return write_invoice_pdf(pdf_name, latest_entry, logo_path)
+            write_invoice_docx(doc_name, latest_entry, logo_path, template_path)
+            if engine == "docx":
+                return doc_name
+            return convert_to_pdf(doc_name, pdf_name, job)
+
+        def done(path):
+            self.show_toast(f"Invoice saved as {os.path.basename(path)}", "success")
+            self.open_document(path)
+
+        self.run_job("Invoice", build, on_done=done)
+
+    def open_batch_invoice_window(self):
+        if not self.store.has_records():
+            self.show_toast("No data to generate invoices.", "error")
+            return
 
-        try:
-            from docx2pdf import convert
-            convert(doc_name, pdf_name)
-            self.show_toast(f"Invoice saved as {os.path.basename(pdf_name)}", "success")
-            os.startfile(pdf_name)
-        except Exception as e:
-            self.show_toast(f"PDF conversion failed: {e}", "error")
+        top = tk.Toplevel(self.root)
+        top.title("Batch Invoices")
+        top.geometry("420x300")
+        top.resizable(False, False)
+
+        # Defaults to the date filter, or else this month
+        start, end = self.current_date_range()
+        today = datetime.date.today().toordinal()
+        first, last = period_bounds(today, "month")
+        period_var = tk.StringVar(value="month")
+        start_var = tk.StringVar(value=ordinal_to_date(first if start is None else start))
+        end_var = tk.StringVar(value=ordinal_to_date(last if end is None else end))
+
+        ttk.Label(top, text="One invoice per restaurant and billing period of the ship dates.").pack(pady=(10, 0))
+        ttk.Label(top, text="Billing Period:").pack(pady=(10, 0))
+        ttk.Combobox(top, textvariable=period_var, values=list(PERIODS), state="readonly").pack()
+        ttk.Label(top, text="First Ship Date (YYYY-MM-DD):").pack(pady=(10, 0))
+        ttk.Entry(top, textvariable=start_var).pack()
+        ttk.Label(top, text="Last Ship Date (YYYY-MM-DD):").pack(pady=(10, 0))
+        ttk.Entry(top, textvariable=end_var).pack()
+
+        def generate():
+            try:
+                start = date_to_ordinal(start_var.get().strip())
+                end = date_to_ordinal(end_var.get().strip())
+            except ValueError as e:
+                self.show_toast(str(e), "error")
+                return
+            if start > end:
+                self.show_toast("The first ship date is after the last one.", "error")
+                return
+            top.destroy()
+            self.generate_invoice_batch(period_var.get(), start, end)
+
+        ttk.Button(top, text="Generate", command=generate).pack(pady=15)
+
+    def generate_invoice_batch(self, period, start, end):
+        folder = os.path.join(self.export_folder(), INVOICE_DIR)
+        engine = self.settings.get("report_engine", "native")
+        records = batch_records(self.store, period, start, end)
+        logo_path, template_path = self.branding()
+
+        def build(job):
+            return write_invoice_batch(folder, records, period, start, end, engine, job=job, logo_path=logo_path,
+                                       template_path=template_path)
+
+        def done(entries):
+            if not entries:
+                self.show_toast("No deliveries shipped in that range.", "info")
+                return
+            rendered = sum(not entry["reused"] for entry in entries)
+            self.show_toast(f"{len(entries)} invoices in {folder} ({rendered} new or changed)", "success")
+            self.open_document(folder)
+
+        self.run_job("Batch Invoices", build, on_done=done)
 
     def toggle_mode(self):
         new_value = "0" if self.is_mock_mode else "1"
@@ -749,7 +1231,7 @@ class MushroomApp:
             self.export_folder_var.set(folder_path)
 
     def export_data(self):
-        if not self.logs:
+        if not self.store.has_records():
             self.show_toast("No data to export.", "error")
             return
 
@@ -764,96 +1246,252 @@ class MushroomApp:
             self.show_toast(f"Unknown export format: {preferred_format}", "error")
 
     def restore_backup(self):
-        base_folder = self.settings.get("export_folder", "")
-        if not base_folder:
-            base_folder = "."
-
-        backup_folder = os.path.join(base_folder, "backups")
-        if not os.path.exists(backup_folder):
-            os.makedirs(backup_folder)
+        backups = self.backup_store()
+        os.makedirs(backups.folder, exist_ok=True)
 
         file_path = filedialog.askopenfilename(
-            initialdir=backup_folder,
+            initialdir=backups.folder,
             title="Select Backup File",
-            filetypes=[("JSON Backup Files", "*.json")]
+            filetypes=[("Backups", f"*{MANIFEST_SUFFIX}"), ("JSON Backup Files", "*.json")]
         )
         if not file_path:
             return  # User canceled
 
-        try:
-            with open(file_path, "r") as f:
-                restored_data = json.load(f)
-
-            if isinstance(restored_data, list):
-                self.logs = restored_data
-                self.save_logs()
-                self.update_filtered_logs()
-                self.update_export_button_state()
-                self.show_toast(f"Backup restored successfully from {os.path.basename(file_path)}!", "success")
-            else:
-                self.logs = []  # Clear to safe empty list
-                self.show_toast("Invalid backup file format! Logs reset.", "error")
+        # A manifest's segments live next to it, so the store is wherever it was picked
+        self.restore_from(BackupStore(os.path.dirname(file_path)), os.path.basename(file_path))
 
-        except Exception as e:
-            self.show_toast(f"Failed to restore backup: {e}", "error")
+    def restore_from(self, backups, name):
+        # Segments are read and checked on a worker; the logs are replaced on the Tk thread
+        def done(result):
+            records, skipped = result
+            self.store.replace_all(records)
+            self.update_filtered_logs()
+            self.update_export_button_state()
+            note = f" ({skipped} unreadable entries skipped)" if skipped else ""
+            self.show_toast(f"Backup restored from {name}!{note}", "success")
+
+        def failed(error):
+            self.show_toast(f"Restore failed: {error}", "error")
+
+        self.run_job(f"Restore {name}", lambda job: backups.records(name), on_done=done, on_error=failed)
 
     def open_backup_manager(self):
         backup_window = tk.Toplevel(self.root)
         backup_window.title("Backup Manager")
-        backup_window.geometry("500x400")
-        backup_window.resizable(False, False)
+        backup_window.geometry("760x600")
 
         ttk.Label(backup_window, text="Available Backups:").pack(pady=(10, 0))
 
-        self.backup_listbox = tk.Listbox(backup_window, width=60, height=15)
-        self.backup_listbox.pack(pady=10)
+        # Everything shown here comes from the backup catalog; no backup is opened to list it
+        columns = (("created", "Created", 150), ("records", "Deliveries", 90), ("packed", "Pack Dates", 200),
+                   ("size", "Size", 90), ("reason", "Reason", 110))
+        self.backup_tree = ttk.Treeview(backup_window, columns=[c for c, _, _ in columns], show="headings",
+                                        height=10, selectmode="browse")
+        for column, heading, width in columns:
+            self.backup_tree.heading(column, text=heading)
+            self.backup_tree.column(column, width=width, anchor="w")
+        self.backup_tree.pack(fill="x", padx=10, pady=(5, 0))
+        self.backup_tree.bind("<<TreeviewSelect>>", lambda e: self.show_backup_details())
+        self.backup_usage_label = ttk.Label(backup_window)
+        self.backup_usage_label.pack(anchor="w", padx=10)
+
+        self.backup_details = tk.Text(backup_window, height=14, wrap="none", font=("Consolas", 10))
+        self.backup_details.pack(fill="both", expand=True, padx=10, pady=(10, 0))
+        self.backup_details.configure(state="disabled")
 
         button_frame = ttk.Frame(backup_window)
         button_frame.pack(pady=10)
 
-        ttk.Button(button_frame, text="Restore Selected", command=self.restore_selected_backup).pack(side="left", padx=10)
-        ttk.Button(button_frame, text="Delete Selected", command=self.delete_selected_backup).pack(side="left", padx=10)
+        ttk.Button(button_frame, text="Restore Selected", command=self.restore_selected_backup).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Compare with Logs", command=self.compare_selected_backup).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Merge Missing", command=self.merge_selected_backup).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Delete Selected", command=self.delete_selected_backup).pack(side="left", padx=5)
 
-        # Load available backups into listbox
+        # Load available backups into the list
         self.load_backup_list()
 
     def load_backup_list(self):
-        self.backup_listbox.delete(0, tk.END)
-        folder = os.path.join(self.settings.get("export_folder", "."), "backups")
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-
-        files = [f for f in os.listdir(folder) if f.endswith(".json")]
-        for f in sorted(files, reverse=True):
-            self.backup_listbox.insert(tk.END, f)
+        backups = self.backup_store()
+        entries = backups.list()
+        self.backup_entries = {entry["file"]: entry for entry in entries}
+        self.backup_tree.delete(*self.backup_tree.get_children())
+        for entry in entries:
+            self.backup_tree.insert("", "end", iid=entry["file"], values=self.backup_row(entry))
+        segments, other = backups.usage()
+        self.backup_usage_label.config(text=f"{len(entries)} backups using {(segments + other) / 1e6:.1f} MB")
+        self.set_backup_details("Select a backup to see its contents.")
+
+    @staticmethod
+    def backup_row(entry):
+        records = f"{entry['records']:,}" if entry["records"] is not None else "?"
+        if entry["first_pack"] is not None:
+            packed = f"{ordinal_to_date(entry['first_pack'])} – {ordinal_to_date(entry['last_pack'])}"
+        else:
+            packed = "" if entry["records"] == 0 else "?"
+        size = f"{entry['size'] / 1e3:,.0f} KB" if entry["size"] is not None else "?"
+        return entry["created"].replace("T", " "), records, packed, size, entry["reason"]
+
+    def set_backup_details(self, text):
+        self.backup_details.configure(state="normal")
+        self.backup_details.delete("1.0", tk.END)
+        self.backup_details.insert("1.0", text)
+        self.backup_details.configure(state="disabled")
+
+    def backup_details_text(self, entry):
+        lines = [f"Backup:    {entry['name']}", f"Created:   {entry['created'].replace('T', ' ')} ({entry['reason']})"]
+        if entry["records"] is not None:
+            lines.append(f"Entries:   {entry['records']:,}")
+        if entry["size"] is not None:
+            new = f" ({entry['new_bytes'] / 1e3:,.1f} KB new when made)" if entry.get("new_bytes") is not None else ""
+            lines.append(f"Size:      {entry['size'] / 1e3:,.1f} KB{new}")
+        if entry["checksum"]:
+            lines.append(f"Checksum:  {entry['checksum'][:16]}")
+        if entry["restaurants"]:
+            lines.append("Deliveries per restaurant:")
+            for restaurant_id, deliveries in sorted(entry["restaurants"].items()):
+                lines.append(f"  {RESTAURANT_ASSIGNMENTS.get(restaurant_id, restaurant_id)}: {deliveries:,}")
+        return "\n".join(lines)
+
+    def show_backup_details(self):
+        entry = self.selected_backup(quiet=True)
+        if entry is None:
+            return
+        backups = self.backup_store()
+        self.set_backup_details(self.backup_details_text(entry) + "\n\nLoading preview...")
+
+        def still_selected():
+            return self.backup_tree.winfo_exists() and self.backup_tree.selection() == (entry["file"],)
+
+        def described(described_entry):
+            self.backup_entries[entry["file"]] = described_entry
+            if self.backup_tree.winfo_exists() and self.backup_tree.exists(entry["file"]):
+                self.backup_tree.item(entry["file"], values=self.backup_row(described_entry))
+            if still_selected():
+                self.show_backup_details()
+
+        def previewed(records):
+            if not still_selected():
+                return
+            shown = self.backup_entries[entry["file"]]
+            total = f" of {shown['records']:,}" if shown["records"] is not None else ""
+            preview = "\n".join(f"  {record.label()}" for record in records)
+            self.set_backup_details(f"{self.backup_details_text(shown)}\n\nFirst {len(records)}{total} entries:\n"
+                                    f"{preview}")
+
+        def failed(error):
+            if still_selected():
+                self.set_backup_details(f"{self.backup_details_text(entry)}\n\nCould not read this backup: {error}")
+
+        # Old full copies and pre-catalog backups are described once, then come from the catalog
+        if entry["records"] is None or entry["restaurants"] is None:
+            self.jobs.submit(f"Describe {entry['name']}", lambda job: backups.describe(entry["name"]),
+                             on_done=described, on_error=failed)
+        # Only the start of the backup is read
+        self.jobs.submit(f"Preview {entry['name']}", lambda job: backups.preview(entry["file"]),
+                         on_done=previewed, on_error=failed)
+        self.refresh_jobs()
+
+    def selected_backup(self, quiet=False):
+        selection = self.backup_tree.selection()
+        if not selection:
+            if not quiet:
+                self.show_toast("No backup selected.", "info")
+            return None
+        return self.backup_entries[selection[0]]
 
     def restore_selected_backup(self):
-        selection = self.backup_listbox.curselection()
-        if not selection:
-            self.show_toast("No backup selected.", "info")
+        backup = self.selected_backup()
+        if backup is None:
+            return
+        if not messagebox.askyesno("Confirm", f"Replace all logs with the backup from {backup['created']}?"):
+            return
+        self.restore_from(self.backup_store(), backup["file"])
+
+    def diff_backup(self, backup, on_diff):
+        # Compares on a worker against a snapshot of the logs; on_diff(missing, added) runs on the Tk thread
+        backups = self.backup_store()
+        records = self.store.snapshot()
+        self.run_job(f"Compare {backup['name']}", lambda job: backups.diff(backup["file"], records),
+                     on_done=lambda result: on_diff(*result))
+
+    def compare_selected_backup(self):
+        backup = self.selected_backup()
+        if backup is None:
             return
 
-        selected_file = self.backup_listbox.get(selection[0])
-        folder = os.path.join(self.settings.get("export_folder", "."), "backups")
-        filepath = os.path.join(folder, selected_file)
+        def show(missing, added):
+            top = tk.Toplevel(self.root)
+            top.title(f"Compare {backup['name']}")
+            top.geometry("760x520")
+            lines = [f"{len(missing):,} deliveries in the backup are not in the current logs.",
+                     f"{len(added):,} deliveries in the current logs are not in the backup.", ""]
+            for title, labels in (("Only in the backup:", missing), ("Only in the current logs:", added)):
+                if labels:
+                    lines.append(title)
+                    lines += [f"  {label}" for label in labels[:PREVIEW_ROWS * 4]]
+                    if len(labels) > PREVIEW_ROWS * 4:
+                        lines.append(f"  ... and {len(labels) - PREVIEW_ROWS * 4:,} more")
+                    lines.append("")
+            box = tk.Text(top, wrap="none", font=("Consolas", 10))
+            scroll = ttk.Scrollbar(top, orient="vertical", command=box.yview)
+            box.configure(yscrollcommand=scroll.set)
+            scroll.pack(side="right", fill="y")
+            box.pack(expand=True, fill="both", padx=(10, 0), pady=10)
+            box.insert("1.0", "\n".join(lines))
+            box.configure(state="disabled")
+            if missing:
+                ttk.Button(top, text=f"Add {len(missing):,} Missing Deliveries",
+                           command=lambda: self.merge_labels(backup, missing, top)).pack(pady=(0, 10))
+
+        self.diff_backup(backup, show)
+
+    def merge_selected_backup(self):
+        backup = self.selected_backup()
+        if backup is None:
+            return
 
-        try:
-            with open(filepath, "r") as f:
-                restored_logs = json.load(f)
-
-            if isinstance(restored_logs, list):
-                self.logs = restored_logs
-                self.save_logs()
-                self.update_filtered_logs()
-                self.update_export_button_state()
-                self.show_toast(f"Backup restored from {selected_file}!", "success")
-            else:
-                self.show_toast("Invalid backup file format!", "error")
+        def merge(missing, _added):
+            if not missing:
+                self.show_toast("The current logs already contain every delivery in this backup.", "info")
+                return
+            self.merge_labels(backup, missing)
+
+        self.diff_backup(backup, merge)
 
+    def merge_labels(self, backup, labels, window=None):
+        # Adds the backup's missing deliveries; nothing in the current logs is removed
+        if not messagebox.askyesno("Confirm", f"Add {len(labels):,} deliveries from the backup of"
+                                              f" {backup['created']} to the current logs?", parent=window):
+            return
+        records, skipped = parse_labels(labels)
+        try:
+            self.store.add_many(records)
+        except Exception as e:
+            self.show_toast(f"Merge failed: {e}", "error")
+            return
+        self.update_filtered_logs()
+        self.update_export_button_state()
+        note = f" ({skipped} unreadable entries skipped)" if skipped else ""
+        self.show_toast(f"Added {len(records):,} deliveries from the backup.{note}", "success")
+        if window is not None:
+            window.destroy()
+
+    def delete_selected_backup(self):
+        backup = self.selected_backup()
+        if backup is None:
+            return
+        if not messagebox.askyesno("Confirm", f"Delete the backup from {backup['created']}?"):
+            return
+        try:
+            self.backup_store().delete(backup["file"])
+            self.load_backup_list()
+            self.show_toast("Backup deleted.", "success")
         except Exception as e:
-            self.show_toast(f"Restore failed: {e}", "error")
+            self.show_toast(f"Failed to delete backup: {e}", "error")
 
 if __name__ == "__main__":
+    # PDF conversion runs in child processes, which a frozen .exe has to bootstrap
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = MushroomApp(root)
     root.mainloop()
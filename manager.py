@@ -1,101 +1,178 @@
-from docx import Document
 import datetime
+import random
+import threading
+import time
 from config import (
-    MUSHROOM_TYPES,
-    RESTAURANT_ASSIGNMENTS,
     SQUARE_ACCESS_TOKEN,
     SQUARE_LOCATION_ID,
     SQUARE_ORDER_ID,
     SQUARE_CUSTOMER_ID,
     USE_MOCK_SQUARE,
+    SQUARE_MAX_CONCURRENCY,
+    SQUARE_RATE_LIMIT,
+    SQUARE_MAX_RETRIES,
+    MOCK_SQUARE_LATENCY,
+    MOCK_SQUARE_FAILURE_RATE,
+    MOCK_SQUARE_ERROR_RATE,
 )
-
-# Attempt to import real Square client
-try:
-    from square.client import Client as RealClient
-except ImportError:
-    RealClient = None
+from assets import ASSETS
+from exports import add_logo
+from ingest import box_range_rows, file_rows, tuple_rows, validate_rows
+from invoices import INVOICE_DIR, batch_records, write_invoice_batch
+from pdf import PdfWriter
+from records import DeliveryRecord
+from storage import MemoryLogStore
 
 # --- Mock Square Client ---
 class MockSquareClient:
-    def __init__(self, access_token=None):
-        self.invoices = self.MockInvoices()
+    def __init__(self, access_token=None, latency=MOCK_SQUARE_LATENCY, failure_rate=MOCK_SQUARE_FAILURE_RATE,
+                 error_rate=MOCK_SQUARE_ERROR_RATE, seed=None, verbose=True):
+        self.invoices = self.MockInvoices(latency, failure_rate, error_rate, seed, verbose)
 
     class MockInvoices:
+        def __init__(self, latency=0.0, failure_rate=0.0, error_rate=0.0, seed=None, verbose=True):
+            self.latency = latency
+            self.failure_rate = failure_rate
+            self.error_rate = error_rate
+            self.verbose = verbose
+            self.calls = 0
+            self.random = random.Random(seed)
+            self.lock = threading.Lock()
+
         def create_invoice(self, body):
-            print(f"[MOCK] Square invoice created for: {body['invoice']['description']}")
+            with self.lock:
+                self.calls += 1
+                roll = self.random.random()
+            if self.latency:
+                time.sleep(self.latency)
+            if roll < self.failure_rate:
+                return self.MockResponse(429, [{"category": "RATE_LIMIT_ERROR", "code": "RATE_LIMITED"}])
+            if roll < self.failure_rate + self.error_rate:
+                return self.MockResponse(400, [{"category": "INVALID_REQUEST_ERROR", "code": "BAD_REQUEST"}])
+            if self.verbose:
+                print(f"[MOCK] Square invoice created for: {body['invoice']['description']}")
             return self.MockResponse()
 
         class MockResponse:
+            def __init__(self, status_code=200, errors=None):
+                self.status_code = status_code
+                self._errors = errors
+
             def is_success(self):
-                return True
+                return self._errors is None
 
             @property
             def errors(self):
-                return None
+                return self._errors
 
-# Choose client based on toggle
-Client = MockSquareClient if USE_MOCK_SQUARE else RealClient
+# Choose client based on toggle; the real SDK is only imported once it is needed
+def square_client(access_token=SQUARE_ACCESS_TOKEN):
+    if USE_MOCK_SQUARE:
+        return MockSquareClient(access_token=access_token)
+    from square.client import Client as RealClient
+    return RealClient(access_token=access_token)
 
 
 class TraceabilityManager:
-    def __init__(self):
-        self.logs = []
-        self.client = Client(access_token=SQUARE_ACCESS_TOKEN)
+    def __init__(self, store=None):
+        # Any log store from storage.py; defaults to an unpersisted in-memory one
+        self.store = store if store is not None else MemoryLogStore()
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = square_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
 
     def generate_tracking_label(self, mushroom_type, box_number, restaurant_id, pack_date, ship_date):
-        mushroom_name = MUSHROOM_TYPES.get(mushroom_type)
-        if not mushroom_name:
-            raise ValueError("Invalid mushroom type selected.")
-        restaurant_name = RESTAURANT_ASSIGNMENTS.get(restaurant_id)
-        if not restaurant_name:
-            raise ValueError("Invalid restaurant ID.")
-        
-        tracking_number = f"{pack_date}-BOX{box_number:03d}"
-        label = f"{mushroom_name} - {tracking_number} - {restaurant_name} - Packed: {pack_date} - Shipped: {ship_date}"
-        self.logs.append(label)
-        return label
-
-    def generate_invoice_doc(self, filename="invoice.docx"):
+        record = DeliveryRecord.create(mushroom_type, box_number, restaurant_id, pack_date, ship_date)
+        self.store.add(record)
+        return record.label()
+
+    # Bulk adds validate the whole batch first, then store it with a single write
+
+    def add_deliveries(self, rows):
+        # rows: (mushroom_type, box_number, restaurant_id, pack_date, ship_date) tuples or dicts
+        return self.store.add_many(validate_rows(tuple_rows(rows)))
+
+    def add_box_range(self, mushroom_type, first_box, last_box, restaurant_id, pack_date, ship_date):
+        rows = box_range_rows(mushroom_type, first_box, last_box, restaurant_id, pack_date, ship_date)
+        return self.store.add_many(validate_rows(rows))
+
+    def import_deliveries(self, path):
+        # CSV or XLSX with a header row; exported files import back as-is
+        return self.store.add_many(validate_rows(file_rows(path)))
+
+    def generate_invoice_doc(self, filename="invoice.docx", start=None, end=None, logo_path=None, template_path=None):
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        doc = Document()
+        records = list(self.store.query(start, end))
+        doc = ASSETS.document(template_path)
+        if logo_path:
+            add_logo(doc, logo_path)
         doc.add_heading('Mushroom Traceability Label and Invoice', 0)
         doc.add_heading('Traceability Labels', level=1)
 
-        for label in self.logs:
-            doc.add_paragraph(label)
+        for record in records:
+            doc.add_paragraph(record.label())
 
         doc.add_heading('Invoice Details', level=1)
-        table = doc.add_table(rows=len(self.logs)+1, cols=5)
+        table = doc.add_table(rows=len(records)+1, cols=5)
         table.style = 'Table Grid'
 
         headers = ['Mushroom Type', 'Box Number', 'Restaurant Name', 'Pack Date', 'Ship Date']
         for i, header in enumerate(headers):
             table.rows[0].cells[i].text = header
 
-        for i, label in enumerate(self.logs, start=1):
-            parts = label.split(' - ')
-            mushroom_type = parts[0]
-            box_number = parts[1].split('BOX')[1]
-            restaurant_name = parts[2]
-            pack_date = parts[3].split(': ')[1]
-            ship_date = parts[4].split(': ')[1]
-
+        for i, record in enumerate(records, start=1):
             row = table.rows[i].cells
-            row[0].text = mushroom_type
-            row[1].text = box_number
-            row[2].text = restaurant_name
-            row[3].text = pack_date
-            row[4].text = ship_date
+            for j, value in enumerate(record.row()):
+                row[j].text = value
 
         doc.save(filename)
 
-    def create_square_invoices(self):
+    def generate_invoice_pdf(self, filename="invoice.pdf", start=None, end=None, logo_path=None):
+        # Same layout as generate_invoice_doc, written straight to PDF (no Word needed)
+        with PdfWriter(filename) as pdf:
+            if logo_path:
+                pdf.new_page()
+                pdf.image(ASSETS.logo(logo_path).pdf, max_width=144)
+            pdf.heading('Mushroom Traceability Label and Invoice', 0)
+            pdf.heading('Traceability Labels', level=1)
+
+            for record in self.store.query(start, end):
+                pdf.paragraph(record.label())
+
+            pdf.heading('Invoice Details', level=1)
+            headers = ['Mushroom Type', 'Box Number', 'Restaurant Name', 'Pack Date', 'Ship Date']
+            pdf.table(headers, (record.row() for record in self.store.query(start, end)), [3, 2, 3, 2.5, 2.5])
+
+    def generate_invoice_batch(self, folder=INVOICE_DIR, period="month", start=None, end=None, engine="native",
+                               workers=None, job=None, logo_path=None, template_path=None):
+        # One invoice per restaurant and billing period of the ship dates in start..end
+        return write_invoice_batch(folder, batch_records(self.store, period, start, end), period, start, end,
+                                   engine, workers, job, logo_path, template_path)
+
+    def create_square_invoices(self, start=None, end=None, max_workers=SQUARE_MAX_CONCURRENCY,
+                               rate=SQUARE_RATE_LIMIT, max_retries=SQUARE_MAX_RETRIES, progress=None):
+        # Returns one InvoiceResult per delivery; failures are reported, not raised
+        from square_submit import submit_invoices
+
+        return submit_invoices(self.client, self.square_requests(start, end), max_workers=max_workers, rate=rate,
+                               max_retries=max_retries, progress=progress)
+
+    def square_requests(self, start=None, end=None):
+        # (label, invoice body) per delivery; only this part reads the store
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        for label in self.logs:
-            parts = label.split(' - ')
-            box_number = parts[1].split('BOX')[1]
-            restaurant_name = parts[2]
+        requests = []
+        for record in self.store.query(start, end):
+            box_number = record.box_label
+            restaurant_name = record.restaurant_name
+            label = record.label()
 
             invoice_data = {
                 "idempotency_key": f"{current_date}-{box_number}",
@@ -117,7 +194,5 @@ class TraceabilityManager:
                 }
             }
 
-            result = self.client.invoices.create_invoice(body=invoice_data)
-
-            if not result.is_success():
-                raise Exception(f"[Invoice Error] {result.errors}")
+            requests.append((label, invoice_data))
+        return requests
@@ -0,0 +1,222 @@
+import bisect
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# In-process instrumentation: timed("area.operation") records latencies (and peak memory
+# while tracing is on), count() bumps counters and record_error() keeps recent failures,
+# all in one registry the Diagnostics window reads and dump() writes.
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RECENT_SAMPLES = 512
+RECENT_ERRORS = 50
+PROMETHEUS_PREFIX = "mushroom"
+TRACE_MEMORY_ENV = "MUSHROOM_TRACE_MEMORY"
+
+
+class Operation:
+    __slots__ = ("calls", "errors", "seconds", "max", "buckets", "recent", "peak_bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        # Percentiles come from the latest samples, so they follow the current workload
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+        self.peak_bytes = None
+
+    def observe(self, seconds, failed=False, peak_bytes=None):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.recent.append(seconds)
+        if peak_bytes is not None:
+            self.peak_bytes = max(self.peak_bytes or 0, peak_bytes)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def as_dict(self):
+        return {"calls": self.calls, "errors": self.errors, "seconds": self.seconds,
+                "mean": self.seconds / self.calls if self.calls else 0.0, "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95), "max": self.max, "peak_bytes": self.peak_bytes,
+                "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], self.buckets))}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.counters = {}
+            self.errors = deque(maxlen=RECENT_ERRORS)
+            self.started = time.time()
+
+    def observe(self, name, seconds, failed=False, peak_bytes=None):
+        with self.lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = Operation()
+            operation.observe(seconds, failed, peak_bytes)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_error(self, source, message):
+        with self.lock:
+            self.errors.append((datetime.datetime.now().isoformat(timespec="seconds"), source, str(message)))
+            self.counters["errors." + source] = self.counters.get("errors." + source, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {"started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                    "uptime": time.time() - self.started,
+                    "memory_tracking": tracemalloc.is_tracing(),
+                    "operations": {name: op.as_dict() for name, op in self.operations.items()},
+                    "counters": dict(self.counters),
+                    "errors": [{"time": t, "source": source, "message": message}
+                               for t, source, message in self.errors]}
+
+
+REGISTRY = Metrics()
+_depth = threading.local()
+
+
+class timed:
+    # with timed("store.load"): ...   or   @timed("export.csv")
+    def __init__(self, name, registry=None):
+        self.name = name
+        self.registry = registry or REGISTRY
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name, self.registry):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def __enter__(self):
+        self.memory = tracemalloc.is_tracing()
+        if self.memory:
+            # Only the outermost operation on a thread resets the peak
+            depth = getattr(_depth, "value", 0)
+            if not depth:
+                tracemalloc.reset_peak()
+            _depth.value = depth + 1
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        peak = None
+        if self.memory:
+            _depth.value -= 1
+            if tracemalloc.is_tracing():
+                peak = max(0, tracemalloc.get_traced_memory()[1] - self.base)
+        self.registry.observe(self.name, seconds, exc_type is not None, peak)
+        return False
+
+
+def count(name, n=1):
+    REGISTRY.count(name, n)
+
+
+def record_error(source, message):
+    REGISTRY.record_error(source, message)
+
+
+def trace_memory(enabled=True):
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def trace_memory_requested(settings=None):
+    return bool(os.getenv(TRACE_MEMORY_ENV)) or bool((settings or {}).get("metrics_trace_memory"))
+
+
+# --- Output ---
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(snapshot):
+    p = PROMETHEUS_PREFIX
+    lines = [f"# HELP {p}_operation_seconds Time spent in instrumented operations",
+             f"# TYPE {p}_operation_seconds histogram"]
+    for name, op in sorted(snapshot["operations"].items()):
+        label = f'operation="{_label(name)}"'
+        cumulative = 0
+        for bound, n in op["buckets"].items():
+            cumulative += n
+            lines.append(f'{p}_operation_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f"{p}_operation_seconds_sum{{{label}}} {op['seconds']:.6f}")
+        lines.append(f"{p}_operation_seconds_count{{{label}}} {op['calls']}")
+    lines += [f"# HELP {p}_operation_errors_total Instrumented operations that raised",
+              f"# TYPE {p}_operation_errors_total counter"]
+    for name, op in sorted(snapshot["operations"].items()):
+        lines.append(f'{p}_operation_errors_total{{operation="{_label(name)}"}} {op["errors"]}')
+    peaks = [(name, op["peak_bytes"]) for name, op in sorted(snapshot["operations"].items())
+             if op["peak_bytes"] is not None]
+    if peaks:
+        lines += [f"# HELP {p}_operation_peak_bytes Largest traced memory peak of an operation",
+                  f"# TYPE {p}_operation_peak_bytes gauge"]
+        lines += [f'{p}_operation_peak_bytes{{operation="{_label(name)}"}} {peak}' for name, peak in peaks]
+    lines += [f"# HELP {p}_events_total Event counters", f"# TYPE {p}_events_total counter"]
+    for name, n in sorted(snapshot["counters"].items()):
+        lines.append(f'{p}_events_total{{event="{_label(name)}"}} {n}')
+    lines += [f"# HELP {p}_uptime_seconds Seconds since metrics were started or reset",
+              f"# TYPE {p}_uptime_seconds gauge", f"{p}_uptime_seconds {snapshot['uptime']:.3f}"]
+    return "\n".join(lines) + "\n"
+
+
+def render_text(snapshot):
+    # Operations by total time, so the step that dominates comes first
+    rows = [["Operation", "Calls", "Errors", "Total s", "Mean ms", "p95 ms", "Max ms", "Peak MB"]]
+    for name, op in sorted(snapshot["operations"].items(), key=lambda item: -item[1]["seconds"]):
+        peak = f"{op['peak_bytes'] / 1e6:.1f}" if op["peak_bytes"] is not None else ""
+        rows.append([name, str(op["calls"]), str(op["errors"]), f"{op['seconds']:.3f}", f"{op['mean'] * 1e3:.1f}",
+                     f"{op['p95'] * 1e3:.1f}", f"{op['max'] * 1e3:.1f}", peak])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(cell.ljust(width) if i == 0 else cell.rjust(width)
+                       for i, (cell, width) in enumerate(zip(row, widths))) for row in rows]
+    if snapshot["counters"]:
+        lines += ["", "Counters:"] + [f"  {name}: {n}" for name, n in sorted(snapshot["counters"].items())]
+    if snapshot["errors"]:
+        lines += ["", "Recent errors:"] + [f"  {e['time']}  {e['source']}: {e['message']}"
+                                           for e in snapshot["errors"]]
+    return "\n".join(lines) + "\n"
+
+
+def dump(path, registry=None):
+    # .prom/.txt files get Prometheus text, anything else JSON
+    snapshot = (registry or REGISTRY).snapshot()
+    if path.endswith((".prom", ".txt")):
+        data = prometheus_text(snapshot)
+    else:
+        data = json.dumps(snapshot, indent=2)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,397 @@
+import bisect
+import datetime
+import gzip
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from journal import _fsync_dir
+from logfile import parse_lines, write_labels
+from metrics import count, timed
+from records import parse_labels
+from stats import DeliveryStats
+
+# Month partitions of the log history. The last HOT_MONTHS pack months stay in the hot
+# logs.ndjson; older months are sealed into read-only gzip NDJSON files by the store's
+# next compaction or save, never while loading:
+#
+#   logs.ndjson.archive/catalog.json          a summary of every sealed month
+#   logs.ndjson.archive/2024-01.7.ndjson.gz   that month's labels, oldest first
+#
+# The catalog is the commit point of a seal; its "pending" note and hot.pending.ndjson
+# stand in for the hot log until the hot compaction that follows has landed.
+
+HOT_MONTHS = 3
+ARCHIVE_SUFFIX = ".archive"
+CATALOG_FILE = "catalog.json"
+PENDING_FILE = "hot.pending.ndjson"
+# Sealed months kept decompressed in memory, most recently used first
+OPEN_PARTITIONS = 12
+# (month file, search) -> matching deliveries, for repeated searches of unopened months
+TEXT_COUNTS = 256
+GZIP_LEVEL = 6
+
+_PARTITION_NAME = re.compile(r"^(\d{4}-\d{2})\.(\d+)\.ndjson\.gz$")
+
+
+def month_key(ordinal):
+    day = datetime.date.fromordinal(ordinal)
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def last_sealed_month(hot_months, today=None):
+    # The newest month that is no longer hot
+    today = today or datetime.date.today()
+    index = today.year * 12 + today.month - 1 - hot_months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def split_by_month(records, through):
+    # ({month: [records]} for pack months up to `through`, [the rest]), order kept
+    sealed, hot = {}, []
+    months = {}  # pack date -> month; a history only has a few thousand days
+    for record in records:
+        month = months.get(record.pack_date)
+        if month is None:
+            month = months[record.pack_date] = month_key(record.pack_date)
+        if through is not None and month <= through:
+            sealed.setdefault(month, []).append(record)
+        else:
+            hot.append(record)
+    return sealed, hot
+
+
+def _rid_key(record):
+    return record.rid
+
+
+def _write_durably(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _labels_text(records):
+    buffer = io.StringIO()
+    write_labels(buffer, (record.label() for record in records))
+    return buffer.getvalue().encode("utf-8")
+
+
+def _summary(month, name, records):
+    stats = DeliveryStats()
+    stats.add_many(records)
+    return {"month": month, "file": name, "count": stats.total, "first_pack": stats.pack_days[0],
+            "last_pack": stats.pack_days[-1], "restaurants": stats.count_by("restaurant_id"),
+            "counts": stats.rows()}
+
+
+class PartitionArchive:
+    def __init__(self, folder):
+        self.folder = folder
+        self.catalog_path = os.path.join(folder, CATALOG_FILE)
+        self.lock = threading.Lock()
+        # Summaries, oldest month first; "first_rid" is only kept in memory
+        self.partitions = []
+        self.sealed_through = None
+        self.pending = None
+        self.next_file = 1
+        self._cache = OrderedDict()  # file name -> [records, lowercased labels or None]
+        self._pinned = set()  # months rewritten this session; their rids only live here
+        self._text_counts = OrderedDict()
+        self._stamp = None  # the catalog file as this instance last read or wrote it
+
+    def exists(self):
+        return os.path.exists(self.catalog_path)
+
+    def total(self):
+        return sum(entry["count"] for entry in self.partitions)
+
+    # --- Catalog ---
+
+    def _catalog_stamp(self):
+        try:
+            stat = os.stat(self.catalog_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def changed(self):
+        return self._catalog_stamp() != self._stamp
+
+    def load(self):
+        self.partitions, self.sealed_through, self.pending, self.next_file = [], None, None, 1
+        self._stamp = self._catalog_stamp()
+        if self.exists():
+            try:
+                with open(self.catalog_path, "r", encoding="utf-8") as f:
+                    catalog = json.load(f)
+                for entry in catalog["partitions"]:
+                    entry["restaurants"] = {int(r): n for r, n in entry["restaurants"].items()}
+                self.partitions = catalog["partitions"]
+                self.sealed_through = catalog.get("sealed_through")
+                self.pending = catalog.get("pending")
+                self.next_file = catalog.get("next_file", 1)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                self._rebuild()
+        self._renumber()
+
+    def _renumber(self):
+        # Sealed deliveries get rids -total..-1 in month order, below the hot ones
+        with self.lock:
+            self._cache.clear()
+            self._pinned.clear()
+            self._text_counts.clear()
+        rid = -self.total()
+        for entry in self.partitions:
+            entry["first_rid"] = rid
+            rid += entry["count"]
+
+    def _rebuild(self):
+        # A damaged catalog is rebuilt from the newest file of each month
+        newest = {}
+        for name in os.listdir(self.folder):
+            match = _PARTITION_NAME.match(name)
+            if match:
+                month, number = match.group(1), int(match.group(2))
+                self.next_file = max(self.next_file, number + 1)
+                if number > newest.get(month, (0, None))[0]:
+                    newest[month] = (number, name)
+        for month in sorted(newest):
+            name = newest[month][1]
+            records, _ = self._read_file(name)
+            if records:
+                self.partitions.append(_summary(month, name, records))
+        self.sealed_through = self.partitions[-1]["month"] if self.partitions else None
+        self._save()
+
+    def _save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        catalog = {"version": 1, "sealed_through": self.sealed_through, "next_file": self.next_file,
+                   "pending": self.pending,
+                   "partitions": [{key: value for key, value in entry.items() if key != "first_rid"}
+                                  for entry in self.partitions]}
+        _write_durably(self.catalog_path, json.dumps(catalog).encode("utf-8"))
+        _fsync_dir(self.catalog_path)
+        self._stamp = self._catalog_stamp()
+
+    # --- Reading ---
+
+    @timed("archive.read")
+    def _read_file(self, name):
+        with open(os.path.join(self.folder, name), "rb") as f:
+            labels, skipped = parse_lines(gzip.decompress(f.read()))
+        records, unparsed = parse_labels(labels)
+        return records, skipped + unparsed
+
+    def records(self, entry):
+        # The month's deliveries with their rids; safe on any thread
+        name = entry["file"]
+        with self.lock:
+            cached = self._cache.get(name)
+            if cached is not None:
+                self._cache.move_to_end(name)
+                count("archive.hits")
+                return cached[0]
+        records, _ = self._read_file(name)
+        for rid, record in enumerate(records, entry["first_rid"]):
+            record.rid = rid
+        count("archive.misses")
+        with self.lock:
+            self._cache[name] = [records, None]
+            evictable = [key for key in self._cache if key not in self._pinned]
+            for key in evictable[:max(len(evictable) - OPEN_PARTITIONS, 0)]:
+                del self._cache[key]
+        return records
+
+    def _count_text(self, entry, search):
+        key = (entry["file"], search)
+        with self.lock:
+            found = self._text_counts.get(key)
+            if found is not None:
+                self._text_counts.move_to_end(key)
+                return found
+        found = self._scan_text(entry, search)
+        with self.lock:
+            self._text_counts[key] = found
+            if len(self._text_counts) > TEXT_COUNTS:
+                self._text_counts.popitem(last=False)
+        return found
+
+    @timed("archive.scan")
+    def _scan_text(self, entry, search):
+        # Only the lines that contain the text are parsed, the same way select() reads them,
+        # so damaged lines are not counted
+        with open(os.path.join(self.folder, entry["file"]), "rb") as f:
+            text = gzip.decompress(f.read()).decode("utf-8")
+        if search not in text.lower():
+            return 0
+        lines = [line for line in text.splitlines() if search in line.lower()]
+        labels, _ = parse_lines("\n".join(lines).encode("utf-8"))
+        records, _ = parse_labels(labels)
+        return sum(1 for record in records if search in record.label().lower())
+
+    def _cached_labels(self, entry):
+        with self.lock:
+            cached = self._cache.get(entry["file"])
+            return cached[1] if cached is not None else None
+
+    def _labels(self, entry):
+        records = self.records(entry)
+        with self.lock:
+            cached = self._cache.get(entry["file"])
+            if cached is not None and cached[1] is not None:
+                return cached[1]
+        labels = [record.label().lower() for record in records]
+        with self.lock:
+            if cached is not None:
+                cached[1] = labels
+        return labels
+
+    def overlapping(self, start=None, end=None, restaurant_id=None):
+        return [entry for entry in self.partitions
+                if (start is None or entry["last_pack"] >= start) and (end is None or entry["first_pack"] <= end)
+                and (restaurant_id is None or restaurant_id in entry["restaurants"])]
+
+    def select(self, entry, start=None, end=None, search=None, restaurant_id=None, mushroom_id=None,
+               reverse=False):
+        # The month's matching deliveries in rid order (or newest first)
+        search = (search or "").lower()
+        if search and self._cached_labels(entry) is None and not self._count_text(entry, search):
+            return iter(())  # Nothing to parse
+        records = self.records(entry)
+        if search:
+            records = [record for record, label in zip(records, self._labels(entry)) if search in label]
+        records = reversed(records) if reverse else iter(records)
+        if start is not None and start > entry["first_pack"]:
+            records = (r for r in records if r.pack_date >= start)
+        if end is not None and end < entry["last_pack"]:
+            records = (r for r in records if r.pack_date <= end)
+        if restaurant_id is not None:
+            records = (r for r in records if r.restaurant_id == restaurant_id)
+        if mushroom_id is not None:
+            records = (r for r in records if r.mushroom_id == mushroom_id)
+        return records
+
+    def count(self, start=None, end=None, search=None):
+        search = (search or "").lower()
+        total = 0
+        for entry in self.overlapping(start, end):
+            if (start is not None and start > entry["first_pack"]) or (end is not None and end < entry["last_pack"]):
+                total += sum(1 for _ in self.select(entry, start, end, search))
+            elif not search:
+                total += entry["count"]  # The whole month matches; its summary has the count
+            else:
+                labels = self._cached_labels(entry)
+                # A month nobody listed is only scanned as text; listing it parses it once
+                total += self._count_text(entry, search) if labels is None else \
+                    sum(1 for label in labels if search in label)
+        return total
+
+    def add_counts(self, stats):
+        for entry in self.partitions:
+            stats.add_rows(entry["counts"])
+
+    def get(self, rid):
+        i = bisect.bisect_right([entry["first_rid"] for entry in self.partitions], rid) - 1
+        if i < 0:
+            return None
+        records = self.records(self.partitions[i])
+        j = bisect.bisect_left(records, rid, key=_rid_key)
+        return records[j] if j < len(records) and records[j].rid == rid else None
+
+    def latest(self):
+        return self.records(self.partitions[-1])[-1] if self.partitions else None
+
+    def pending_records(self):
+        with open(os.path.join(self.folder, self.pending["file"]), "rb") as f:
+            labels, _ = parse_lines(f.read())
+        return parse_labels(labels)[0]
+
+    # --- Writing ---
+
+    @timed("archive.write")
+    def _write(self, month, records):
+        # Writes a month under the next file number and returns its summary
+        name = f"{month}.{self.next_file}.ndjson.gz"
+        self.next_file += 1
+        # mtime=0: the same deliveries always compress to the same bytes
+        _write_durably(os.path.join(self.folder, name),
+                       gzip.compress(_labels_text(records), compresslevel=GZIP_LEVEL, mtime=0))
+        return _summary(month, name, records)
+
+    @timed("archive.seal")
+    def seal(self, sealed, hot, through, seq, replace=False):
+        # The caller then compacts the hot log to `seq` and calls settle()
+        os.makedirs(self.folder, exist_ok=True)
+        entries = {} if replace else {entry["month"]: entry for entry in self.partitions}
+        for month, records in sorted(sealed.items()):
+            old = entries.get(month)
+            if old is not None:
+                records = self.records(old) + records
+            entries[month] = self._write(month, records)
+        _write_durably(os.path.join(self.folder, PENDING_FILE), _labels_text(hot))
+        self.partitions = [entries[month] for month in sorted(entries)]
+        self.sealed_through = through
+        self.pending = {"seq": seq, "file": PENDING_FILE}
+        self._save()
+        count("archive.sealed", sum(len(records) for records in sealed.values()))
+
+    def settle(self, through=None):
+        # Drops the pending note and every file the catalog no longer lists
+        if through is not None:
+            self.sealed_through = through
+        self.pending = None
+        self._save()
+        keep = {entry["file"] for entry in self.partitions}
+        keep.add(CATALOG_FILE)
+        for name in os.listdir(self.folder):
+            if name not in keep:
+                os.remove(os.path.join(self.folder, name))
+        self._renumber()
+
+    @timed("archive.delete")
+    def delete(self, rids):
+        # Writes each affected month again without the given deliveries; returns those
+        rids = set(rids)
+        bounds = [entry["first_rid"] for entry in self.partitions] + [0]
+        deleted, entries = [], []
+        for entry, first, following in zip(self.partitions, bounds, bounds[1:]):
+            if not any(first <= rid < following for rid in rids):
+                entries.append(entry)
+                continue
+            keep = []
+            for record in self.records(entry):
+                (deleted if record.rid in rids else keep).append(record)
+            if not keep:
+                continue
+            new = self._write(entry["month"], keep)
+            new["first_rid"] = first
+            entries.append(new)
+            with self.lock:
+                self._cache[new["file"]] = [keep, None]
+                self._pinned.add(new["file"])
+        if deleted:
+            self.partitions = entries
+            self._save()
+        return deleted
+
+
+class PartitionView:
+    # A re-iterable store snapshot that reaches into sealed months
+    def __init__(self, archive, partitions, start, end, hot):
+        self.archive = archive
+        self.partitions = partitions
+        self.start = start
+        self.end = end
+        self.hot = hot
+
+    def __iter__(self):
+        for entry in self.partitions:
+            yield from self.archive.select(entry, self.start, self.end)
+        yield from self.hot
@@ -0,0 +1,301 @@
+import zlib
+
+# Direct-to-PDF writer for the invoice and summary layouts. Pages are written out as soon
+# as they are full; text uses the base fonts Helvetica/Helvetica-Bold, so nothing is embedded.
+
+LETTER = (612, 792)
+MARGIN = 72
+
+# Glyph widths (1/1000 em) for character codes 32-126, from the Adobe font metrics
+_WIDTHS = {
+    "F1": [278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556,
+           556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667,
+           611, 778, 722, 278, 500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667,
+           667, 611, 278, 278, 278, 469, 556, 333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500,
+           222, 833, 556, 556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584],
+    "F2": [278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556,
+           556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611, 975, 722, 722, 722, 722, 667,
+           611, 778, 722, 278, 556, 722, 611, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667,
+           667, 611, 333, 278, 333, 584, 556, 333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556,
+           278, 889, 611, 611, 611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584],
+}
+_FONT_NAMES = {"F1": "Helvetica", "F2": "Helvetica-Bold"}
+_DEFAULT_WIDTH = 556
+
+HEADING_SIZES = {0: 24, 1: 16, 2: 13}
+TEXT_SIZE = 11
+TABLE_SIZE = 9
+
+
+def _encode(text):
+    # WinAnsi is cp1252; anything outside it prints as "?"
+    return str(text).encode("cp1252", "replace")
+
+
+def text_width(text, size, font="F1"):
+    widths = _WIDTHS[font]
+    units = 0
+    for code in _encode(text):
+        units += widths[code - 32] if 32 <= code <= 126 else _DEFAULT_WIDTH
+    return units * size / 1000
+
+
+def _literal(text):
+    data = _encode(text).replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+    return "(" + data.decode("latin-1") + ")"
+
+
+def _fit(text, width, size, font="F1"):
+    # Trims text that would overflow a table cell
+    if text_width(text, size, font) <= width:
+        return text
+    while text and text_width(text + "...", size, font) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def _wrap(text, width, size, font="F1"):
+    lines = []
+    line = ""
+    for word in str(text).split(" "):
+        candidate = f"{line} {word}" if line else word
+        if line and text_width(candidate, size, font) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    lines.append(line)
+    return lines
+
+
+class PdfImage:
+    # Image data already compressed for embedding, reusable across documents
+    __slots__ = ("width", "height", "dpi", "colorspace", "filters", "data", "alpha")
+
+    def __init__(self, width, height, dpi, colorspace, filters, data, alpha=None):
+        self.width = width
+        self.height = height
+        self.dpi = dpi
+        self.colorspace = colorspace
+        self.filters = filters
+        self.data = data
+        self.alpha = alpha
+
+
+def encode_image(source, dpi=None):
+    # source: an image path or a PIL image; dpi overrides the one stored in the image
+    from PIL import Image
+
+    img = Image.open(source) if isinstance(source, str) else source
+    dpi = dpi or img.info.get("dpi", (96, 96))[0] or 96
+    if isinstance(source, str) and img.format == "JPEG" and img.mode in ("RGB", "L"):
+        # JPEG data goes in as-is
+        with open(source, "rb") as f:
+            data = f.read()
+        return PdfImage(img.width, img.height, dpi, "/DeviceRGB" if img.mode == "RGB" else "/DeviceGray",
+                        "/DCTDecode", data)
+    alpha = None
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        img = img.convert("RGBA")
+        alpha = zlib.compress(img.getchannel("A").tobytes())
+    img = img.convert("L" if img.mode in ("L", "LA") else "RGB")
+    return PdfImage(img.width, img.height, dpi, "/DeviceGray" if img.mode == "L" else "/DeviceRGB", "/FlateDecode",
+                    zlib.compress(img.tobytes()), alpha)
+
+
+class PdfWriter:
+    def __init__(self, path, page_size=LETTER, margin=MARGIN):
+        self.file = open(path, "wb")
+        self.width, self.height = page_size
+        self.margin = margin
+        self.content_width = self.width - 2 * margin
+        # 1: catalog, 2: page tree, 3: shared resources (all written by close())
+        self._offsets = {}
+        self._next_id = 4
+        self._page_ids = []
+        self._images = {}
+        self._image_ids = {}
+        self._ops = []
+        self.y = None
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _reserve(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, body):
+        self._offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+
+    def _write_stream(self, obj_id, entries, data):
+        self._offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n<< {entries} /Length {len(data)} >>\nstream\n".encode("latin-1"))
+        self.file.write(data)
+        self.file.write(b"\nendstream\nendobj\n")
+
+    # --- Pages ---
+
+    def _start_page(self):
+        self._ops = []
+        self.y = self.height - self.margin
+
+    def _finish_page(self):
+        if self.y is None:
+            return
+        number = len(self._page_ids) + 1
+        footer = f"Page {number}"
+        self.text((self.width - text_width(footer, 8)) / 2, self.margin / 2, footer, 8)
+        content = zlib.compress("\n".join(self._ops).encode("latin-1"))
+        content_id = self._reserve()
+        self._write_stream(content_id, "/Filter /FlateDecode", content)
+        page_id = self._reserve()
+        self._write_object(page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.width} {self.height}]"
+                                    f" /Resources 3 0 R /Contents {content_id} 0 R >>")
+        self._page_ids.append(page_id)
+        self._ops = []
+        self.y = None
+
+    def new_page(self):
+        self._finish_page()
+        self._start_page()
+
+    def ensure(self, height):
+        # Starts a new page unless `height` points still fit above the bottom margin
+        if self.y is None or self.y - height < self.margin:
+            self.new_page()
+
+    # --- Drawing primitives ---
+
+    def text(self, x, y, text, size=TEXT_SIZE, font="F1"):
+        self._ops.append(f"BT /{font} {size} Tf {x:.2f} {y:.2f} Td {_literal(text)} Tj ET")
+
+    def rect(self, x, y, w, h):
+        self._ops.append(f"{x:.2f} {y:.2f} {w:.2f} {h:.2f} re S")
+
+    # --- Flow layout ---
+
+    def heading(self, text, level=1):
+        size = HEADING_SIZES.get(level, TEXT_SIZE)
+        lines = _wrap(text, self.content_width, size, "F2")
+        self.ensure(size * 1.3 * len(lines) + size)
+        self.y -= size * 0.5
+        for line in lines:
+            self.y -= size * 1.2
+            self.text(self.margin, self.y, line, size, "F2")
+        self.y -= size * 0.4
+
+    def paragraph(self, text, size=TEXT_SIZE, bullet=False):
+        indent = 18 if bullet else 0
+        lines = _wrap(text, self.content_width - indent, size)
+        self.ensure(size * 1.3 * len(lines))
+        for i, line in enumerate(lines):
+            self.y -= size * 1.3
+            if bullet and i == 0:
+                self.text(self.margin + 6, self.y, "\u2022", size)
+            self.text(self.margin + indent, self.y, line, size)
+        self.y -= size * 0.4
+
+    def image(self, source, max_width=None):
+        # Places an image at its natural size (per its DPI), scaled down to max_width points
+        name, px_width, px_height, dpi = self._image(source)
+        width = px_width / dpi * 72
+        height = px_height / dpi * 72
+        limit = min(max_width or self.content_width, self.content_width)
+        if width > limit:
+            height = height * limit / width
+            width = limit
+        self.ensure(height + 6)
+        self.y -= height
+        self._ops.append(f"q {width:.2f} 0 0 {height:.2f} {self.margin:.2f} {self.y:.2f} cm /{name} Do Q")
+        self.y -= 6
+
+    def _image(self, source):
+        # source: a path, or a PdfImage encoded beforehand and shared between documents
+        if source in self._images:
+            return self._images[source]
+        image = source if isinstance(source, PdfImage) else encode_image(source)
+        extra = ""
+        if image.alpha is not None:
+            mask_id = self._reserve()
+            self._write_stream(mask_id, f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height}"
+                                        f" /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode",
+                               image.alpha)
+            extra = f" /SMask {mask_id} 0 R"
+        image_id = self._reserve()
+        self._write_stream(image_id, f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height}"
+                                     f" /ColorSpace {image.colorspace} /BitsPerComponent 8"
+                                     f" /Filter {image.filters}{extra}", image.data)
+        entry = self._images[source] = (f"Im{len(self._images) + 1}", image.width, image.height, image.dpi)
+        self._image_ids[entry[0]] = image_id
+        return entry
+
+    def table(self, headers, rows, weights=None, size=TABLE_SIZE):
+        # `rows` is consumed lazily; the header row repeats on every page
+        weights = weights or [1] * len(headers)
+        scale = self.content_width / sum(weights)
+        widths = [weight * scale for weight in weights]
+        xs = [self.margin]
+        for width in widths[:-1]:
+            xs.append(xs[-1] + width)
+        row_height = size * 1.9
+        pad = 4
+        baseline = (row_height - size) / 2 + size * 0.22
+        fitted = {}
+
+        # Per-row operators only differ in y, so the rest is formatted once
+        boxes = [(f"{x:.2f} ", f" {width:.2f} {row_height:.2f} re") for x, width in zip(xs, widths)]
+        starts = [f"1 0 0 1 {x + pad:.2f} " for x in xs]
+
+        def draw(cells, font):
+            self.y -= row_height
+            y = f"{self.y:.2f}"
+            text_y = f"{self.y + baseline:.2f} Tm "
+            parts = [f"{left}{y}{right}" for left, right in boxes]
+            parts.append(f"S BT /{font} {size} Tf")
+            for i, cell in enumerate(cells):
+                key = (i, font, cell)
+                text = fitted.get(key)
+                if text is None:
+                    text = fitted[key] = _literal(_fit(cell, widths[i] - 2 * pad, size, font)) + " Tj"
+                parts.append(starts[i] + text_y + text)
+            parts.append("ET")
+            self._ops.append("\n".join(parts))
+
+        self.ensure(row_height * 2)
+        draw(headers, "F2")
+        for row in rows:
+            if self.y - row_height < self.margin:
+                self.new_page()
+                draw(headers, "F2")
+            draw(row, "F1")
+        self.y -= size
+
+    def close(self):
+        if self.y is None and not self._page_ids:
+            self._start_page()
+        self._finish_page()
+        fonts = " ".join(f"/{key} << /Type /Font /Subtype /Type1 /BaseFont /{name} /Encoding /WinAnsiEncoding >>"
+                         for key, name in _FONT_NAMES.items())
+        images = " ".join(f"/{name} {obj_id} 0 R" for name, obj_id in self._image_ids.items())
+        self._write_object(3, f"<< /Font << {fonts} >> /XObject << {images} >> >>")
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>")
+        self._write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref = self.file.tell()
+        count = self._next_id
+        self.file.write(f"xref\n0 {count}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, count):
+            self.file.write(f"{self._offsets[obj_id]:010d} 00000 n \n".encode())
+        self.file.write(f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
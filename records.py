@@ -0,0 +1,122 @@
+import datetime
+
+from config import MUSHROOM_TYPES, RESTAURANT_ASSIGNMENTS
+
+# Reverse lookups used when parsing stored labels back into ids
+MUSHROOM_IDS = {name: mushroom_id for mushroom_id, name in MUSHROOM_TYPES.items()}
+RESTAURANT_IDS = {name: restaurant_id for restaurant_id, name in RESTAURANT_ASSIGNMENTS.items()}
+
+EXPORT_HEADERS = ["Mushroom Type", "Box Number", "Restaurant Name", "Packed Date", "Shipped Date"]
+
+# Dates repeat heavily across a history, so both directions are memoised.
+# The ordinal cache also makes records packed on the same day share one int object.
+_ordinals = {}
+_date_strings = {}
+
+
+def date_to_ordinal(date_str):
+    ordinal = _ordinals.get(date_str)
+    if ordinal is None:
+        try:
+            day = datetime.date.fromisoformat(date_str)
+        except ValueError:
+            day = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+        ordinal = day.toordinal()
+        ordinal = _ordinals.setdefault(ordinal, ordinal)
+        _ordinals[date_str] = ordinal
+    return ordinal
+
+
+def ordinal_to_date(ordinal):
+    date_str = _date_strings.get(ordinal)
+    if date_str is None:
+        date_str = datetime.date.fromordinal(ordinal).isoformat()
+        _date_strings[ordinal] = date_str
+    return date_str
+
+
+class DeliveryRecord:
+    __slots__ = ("rid", "mushroom_id", "box_number", "restaurant_id", "pack_date", "ship_date")
+
+    # rid is assigned by the log store and stays stable for the record's lifetime there
+    def __init__(self, mushroom_id, box_number, restaurant_id, pack_date, ship_date, rid=None):
+        self.rid = rid
+        self.mushroom_id = mushroom_id
+        self.box_number = box_number
+        self.restaurant_id = restaurant_id
+        self.pack_date = pack_date
+        self.ship_date = ship_date
+
+    @classmethod
+    def create(cls, mushroom_id, box_number, restaurant_id, pack_date, ship_date):
+        if mushroom_id not in MUSHROOM_TYPES:
+            raise ValueError("Invalid mushroom type selected.")
+        if restaurant_id not in RESTAURANT_ASSIGNMENTS:
+            raise ValueError("Invalid restaurant ID.")
+        return cls(mushroom_id, int(box_number), restaurant_id,
+                   date_to_ordinal(pack_date), date_to_ordinal(ship_date))
+
+    @classmethod
+    def from_label(cls, label):
+        parts = label.split(" - ")
+        if len(parts) != 5:
+            raise ValueError(f"Malformed log entry: {label}")
+        mushroom_id = MUSHROOM_IDS.get(parts[0])
+        if mushroom_id is None:
+            raise ValueError(f"Unknown mushroom type: {parts[0]}")
+        restaurant_id = RESTAURANT_IDS.get(parts[2])
+        if restaurant_id is None:
+            raise ValueError(f"Unknown restaurant: {parts[2]}")
+        box_number = int(parts[1].rpartition("BOX")[2])
+        pack_date = date_to_ordinal(parts[3].partition(": ")[2])
+        ship_date = date_to_ordinal(parts[4].partition(": ")[2])
+        return cls(mushroom_id, box_number, restaurant_id, pack_date, ship_date)
+
+    @property
+    def mushroom_name(self):
+        return MUSHROOM_TYPES.get(self.mushroom_id, f"Mushroom {self.mushroom_id}")
+
+    @property
+    def restaurant_name(self):
+        return RESTAURANT_ASSIGNMENTS.get(self.restaurant_id, f"Restaurant {self.restaurant_id}")
+
+    @property
+    def pack_date_str(self):
+        return ordinal_to_date(self.pack_date)
+
+    @property
+    def ship_date_str(self):
+        return ordinal_to_date(self.ship_date)
+
+    @property
+    def box_label(self):
+        return f"{self.box_number:03d}"
+
+    @property
+    def tracking_number(self):
+        return f"{self.pack_date_str}-BOX{self.box_label}"
+
+    def label(self):
+        return (f"{self.mushroom_name} - {self.tracking_number} - {self.restaurant_name}"
+                f" - Packed: {self.pack_date_str} - Shipped: {self.ship_date_str}")
+
+    def row(self):
+        return [self.mushroom_name, self.box_label, self.restaurant_name, self.pack_date_str, self.ship_date_str]
+
+    def __repr__(self):
+        return f"DeliveryRecord({self.label()!r})"
+
+
+def parse_labels(labels, unparsed=None):
+    # Returns (records, skipped) so callers can report entries that no longer parse;
+    # the labels themselves go to `unparsed`, if given
+    records = []
+    skipped = 0
+    for label in labels:
+        try:
+            records.append(DeliveryRecord.from_label(label))
+        except (ValueError, TypeError, AttributeError):
+            skipped += 1
+            if unparsed is not None:
+                unparsed.append(label)
+    return records, skipped
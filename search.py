@@ -0,0 +1,341 @@
+import bisect
+import datetime
+import re
+
+from config import MUSHROOM_TYPES, RESTAURANT_ASSIGNMENTS
+from records import ordinal_to_date
+
+# Lowercased layout of DeliveryRecord.label(): substring searches are matched against
+# the distinct values of each field slot, never the full history.
+TEMPLATE = [
+    ("mushroom_id",), " - ", ("pack_date",), "-box", ("box_number",), " - ",
+    ("restaurant_id",), " - packed: ", ("pack_date",), " - shipped: ", ("ship_date",),
+]
+
+FIELDS = ("mushroom_id", "box_number", "restaurant_id", "pack_date", "ship_date")
+# Few distinct values: keep one rid bitmap per value
+MASK_FIELDS = ("mushroom_id", "restaurant_id")
+# Dates also keep one bitmap per month so wide ranges are a handful of ORs
+DATE_FIELDS = ("pack_date", "ship_date")
+
+# Previous results with at most this many rows are refined by checking each row
+REFINE_LIMIT = 2000
+
+_NONZERO = re.compile(b"[^\x00]")
+_month_of = {}
+
+
+def _month(ordinal):
+    month = _month_of.get(ordinal)
+    if month is None:
+        day = datetime.date.fromordinal(ordinal)
+        month = _month_of[ordinal] = day.year * 12 + day.month - 1
+    return month
+
+
+def _render(field, value):
+    if field == "mushroom_id":
+        return MUSHROOM_TYPES.get(value, f"Mushroom {value}").lower()
+    if field == "restaurant_id":
+        return RESTAURANT_ASSIGNMENTS.get(value, f"Restaurant {value}").lower()
+    if field == "box_number":
+        return f"{value:03d}"
+    return ordinal_to_date(value)
+
+
+def _check(text, test, arg):
+    if test == "in":
+        return arg in text
+    if test == "suffix":
+        return text.endswith(arg)
+    if test == "prefix":
+        return text.startswith(arg)
+    return text == arg
+
+
+def to_mask(rids):
+    # Setting bits in a bytearray is linear; OR-ing 1 << rid into an int is quadratic
+    rids = list(rids)
+    if not rids:
+        return 0
+    buf = bytearray((max(rids) >> 3) + 1)
+    for rid in rids:
+        buf[rid >> 3] |= 1 << (rid & 7)
+    return int.from_bytes(buf, "little")
+
+
+def iter_rids(mask, reverse=False):
+    # Yields set bit positions in ascending (or descending) order
+    if not mask:
+        return
+    data = mask.to_bytes((mask.bit_length() + 7) >> 3, "little")
+    offsets = (m.start() for m in _NONZERO.finditer(data))
+    if reverse:
+        offsets = reversed(list(offsets))
+    bits = range(7, -1, -1) if reverse else range(8)
+    for offset in offsets:
+        byte = data[offset]
+        for bit in bits:
+            if byte >> bit & 1:
+                yield (offset << 3) | bit
+
+
+class SearchIndex:
+    def __init__(self):
+        self.texts = {field: {} for field in FIELDS}
+        self.counts = {field: {} for field in FIELDS}
+        self.masks = {field: {} for field in MASK_FIELDS}
+        self.postings = {field: {} for field in FIELDS if field not in MASK_FIELDS}
+        self.month_masks = {field: {} for field in DATE_FIELDS}
+        self.month_days = {field: {} for field in DATE_FIELDS}
+        self.all_mask = 0
+        self.total = 0
+        # Sorted distinct pack dates, searched with bisect for date ranges
+        self.pack_days = []
+        self.version = 0
+        self._last = None
+
+    def clear(self):
+        self.__init__()
+
+    def _add_value(self, field, value):
+        self.texts[field][value] = _render(field, value)
+        self.counts[field][value] = 0
+        if field in MASK_FIELDS:
+            self.masks[field][value] = 0
+        else:
+            self.postings[field][value] = set()
+        if field in DATE_FIELDS:
+            self.month_days[field].setdefault(_month(value), set()).add(value)
+            self.month_masks[field].setdefault(_month(value), 0)
+            if field == "pack_date":
+                bisect.insort(self.pack_days, value)
+
+    def _drop_value(self, field, value):
+        del self.texts[field][value]
+        del self.counts[field][value]
+        (self.masks if field in MASK_FIELDS else self.postings)[field].pop(value)
+        if field in DATE_FIELDS:
+            month = _month(value)
+            self.month_days[field][month].discard(value)
+            if not self.month_days[field][month]:
+                del self.month_days[field][month]
+                del self.month_masks[field][month]
+            if field == "pack_date":
+                del self.pack_days[bisect.bisect_left(self.pack_days, value)]
+
+    def add(self, record):
+        bit = 1 << record.rid
+        for field in FIELDS:
+            value = getattr(record, field)
+            if value not in self.texts[field]:
+                self._add_value(field, value)
+            self.counts[field][value] += 1
+            if field in MASK_FIELDS:
+                self.masks[field][value] |= bit
+            else:
+                self.postings[field][value].add(record.rid)
+            if field in DATE_FIELDS:
+                self.month_masks[field][_month(value)] |= bit
+        self.all_mask |= bit
+        self.total += 1
+        self.version += 1
+
+    def add_many(self, records):
+        if len(records) < 64:
+            for record in records:
+                self.add(record)
+            return
+        # Bulk path: collect rids per key, then build each bitmap in one pass
+        pending = {}
+        for record in records:
+            rid = record.rid
+            for field in FIELDS:
+                value = getattr(record, field)
+                if value not in self.texts[field]:
+                    self._add_value(field, value)
+                self.counts[field][value] += 1
+                if field in MASK_FIELDS:
+                    pending.setdefault((field, value), []).append(rid)
+                else:
+                    self.postings[field][value].add(rid)
+                if field in DATE_FIELDS:
+                    pending.setdefault((field, _month(value), None), []).append(rid)
+        for key, rids in pending.items():
+            if len(key) == 2:
+                self.masks[key[0]][key[1]] |= to_mask(rids)
+            else:
+                self.month_masks[key[0]][key[1]] |= to_mask(rids)
+        self.all_mask |= to_mask(record.rid for record in records)
+        self.total += len(records)
+        self.version += 1
+
+    def remove(self, record):
+        bit = 1 << record.rid
+        for field in FIELDS:
+            value = getattr(record, field)
+            if value not in self.texts[field]:
+                continue
+            if field in MASK_FIELDS:
+                self.masks[field][value] &= ~bit
+            else:
+                self.postings[field][value].discard(record.rid)
+            if field in DATE_FIELDS:
+                self.month_masks[field][_month(value)] &= ~bit
+            self.counts[field][value] -= 1
+            if not self.counts[field][value]:
+                self._drop_value(field, value)
+        self.all_mask &= ~bit
+        self.total -= 1
+        self.version += 1
+
+    def _alignments(self, query):
+        # Yields {field: [(test, text), ...]} for every way the query fits the template
+        for i, segment in enumerate(TEMPLATE):
+            if isinstance(segment, str):
+                if query in segment:
+                    yield {}
+            else:
+                yield {segment[0]: [("in", query)]}
+            # The query may also start inside this segment and run into the next ones
+            for k in range(1, len(query)):
+                head, rest = query[:k], query[k:]
+                if isinstance(segment, str):
+                    if segment.endswith(head):
+                        yield from self._continue(rest, i + 1, {})
+                else:
+                    yield from self._continue(rest, i + 1, {segment[0]: [("suffix", head)]})
+
+    def _continue(self, rest, i, constraints):
+        # `rest` must match starting exactly at segment i
+        if not rest:
+            yield constraints
+            return
+        if i >= len(TEMPLATE):
+            return
+        segment = TEMPLATE[i]
+        if isinstance(segment, str):
+            if len(rest) <= len(segment):
+                if segment.startswith(rest):
+                    yield constraints
+            elif rest.startswith(segment):
+                yield from self._continue(rest[len(segment):], i + 1, constraints)
+            return
+        field = segment[0]
+        extended = {f: list(tests) for f, tests in constraints.items()}
+        extended.setdefault(field, []).append(("prefix", rest))
+        yield extended
+        for length in {len(text) for text in self.texts[field].values()}:
+            if length < len(rest):
+                extended = {f: list(tests) for f, tests in constraints.items()}
+                extended.setdefault(field, []).append(("eq", rest[:length]))
+                yield from self._continue(rest[length:], i + 1, extended)
+
+    def _values_mask(self, field, values):
+        if field in MASK_FIELDS:
+            mask = 0
+            for value in values:
+                mask |= self.masks[field][value]
+            return mask
+        mask = 0
+        if field in DATE_FIELDS:
+            # Whole months come straight from the month bitmaps
+            by_month = {}
+            for value in values:
+                by_month.setdefault(_month(value), []).append(value)
+            values = []
+            for month, days in by_month.items():
+                if len(days) == len(self.month_days[field][month]):
+                    mask |= self.month_masks[field][month]
+                else:
+                    values.extend(days)
+        rids = []
+        for value in values:
+            rids.extend(self.postings[field][value])
+        return mask | to_mask(rids)
+
+    def _field_mask(self, field, tests):
+        # None means the constraint does not narrow anything
+        texts = self.texts[field]
+        values = [value for value, text in texts.items() if all(_check(text, test, arg) for test, arg in tests)]
+        if len(values) == len(texts):
+            return None
+        counts = self.counts[field]
+        matched = sum(counts[value] for value in values)
+        if matched * 2 > self.total and field not in MASK_FIELDS:
+            # Cheaper to build the bitmap of what does not match
+            chosen = set(values)
+            rest = [value for value in texts if value not in chosen]
+            return self.all_mask & ~self._values_mask(field, rest)
+        return self._values_mask(field, values)
+
+    def match_text(self, query):
+        # Returns a rid bitmap, or None when every record matches
+        result = 0
+        resolved = {}
+        for constraints in self._alignments(query):
+            mask = None
+            for field, tests in constraints.items():
+                # The same date text shows up in two template slots; resolve it once
+                key = (field, tuple(tests))
+                if key not in resolved:
+                    resolved[key] = self._field_mask(field, tests)
+                field_mask = resolved[key]
+                if field_mask is not None:
+                    mask = field_mask if mask is None else mask & field_mask
+            if mask is None:
+                return None
+            result |= mask
+        return result
+
+    def date_mask(self, start=None, end=None):
+        days = self.pack_days
+        lo = 0 if start is None else bisect.bisect_left(days, start)
+        hi = len(days) if end is None else bisect.bisect_right(days, end)
+        if lo == 0 and hi == len(days):
+            return None
+        return self._values_mask("pack_date", days[lo:hi])
+
+    def _can_refine(self, search, start, end):
+        # A longer query over a narrower date range can only shrink the last result
+        if self._last is None:
+            return False
+        version, last_search, last_start, last_end, result = self._last
+        if version != self.version or result is None or result.bit_count() > REFINE_LIMIT:
+            return False
+        if last_search not in search:
+            return False
+        if last_start is not None and (start is None or start < last_start):
+            return False
+        if last_end is not None and (end is None or end > last_end):
+            return False
+        return True
+
+    def match(self, search=None, start=None, end=None, lookup=None):
+        # A rid bitmap, or None for everything; `lookup` enables incremental refinement
+        search = (search or "").lower()
+        if self._last is not None and self._last[:4] == (self.version, search, start, end):
+            return self._last[4]
+        if lookup is not None and self._can_refine(search, start, end):
+            result = to_mask(rid for rid in iter_rids(self._last[4])
+                             if self._keep(lookup(rid), search, start, end))
+        else:
+            result = self._match(search, start, end)
+        self._last = (self.version, search, start, end, result)
+        return result
+
+    def _keep(self, record, search, start, end):
+        if start is not None and record.pack_date < start:
+            return False
+        if end is not None and record.pack_date > end:
+            return False
+        return not search or search in record.label().lower()
+
+    def _match(self, search, start, end):
+        text_mask = self.match_text(search) if search else None
+        range_mask = self.date_mask(start, end) if start is not None or end is not None else None
+        if text_mask is None:
+            return range_mask
+        if range_mask is None:
+            return text_mask
+        return text_mask & range_mask
@@ -0,0 +1,565 @@
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import http
+import json
+import os
+import sys
+import urllib.parse
+
+import metrics
+from assets import existing
+from config import (
+    MUSHROOM_TYPES,
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SQUARE_MAX_CONCURRENCY,
+    SQUARE_MAX_RETRIES,
+    SQUARE_RATE_LIMIT,
+)
+from ingest import PARSERS, BulkValidationError, tuple_rows, validate_rows
+from metrics import count, timed
+from records import date_to_ordinal
+
+# Local HTTP/JSON service around TraceabilityManager, for the packing floor scanners and
+# the order system:  python -m cli serve [--host 127.0.0.1] [--port 8765]
+#
+#   POST /deliveries                   one delivery {"mushroom_id", "box_number", "restaurant_id",
+#                                      "pack_date", "ship_date"}, or a batch: a list of them or
+#                                      {"deliveries": [...]}; names and ids both work, as in imports
+#   GET  /deliveries                   one page: ?start=&end= (pack dates) &restaurant= &mushroom=
+#                                      &search= &limit= &offset= &newest=1
+#   GET  /deliveries/count             ?start= &end= &search=
+#   GET  /deliveries/stream            every match as NDJSON, sent in chunks as it is read
+#   GET  /deliveries/<tracking number> e.g. /deliveries/2025-05-01-BOX012
+#   POST /exports/csv|excel|summary    {"start", "end", "split", "engine", "analytics", "charts"}
+#   POST /invoices                     month-end batch: {"period", "start", "end" (ship dates), "format"}
+#   POST /square                       {"start", "end", "workers", "rate"}
+#   GET  /metrics                      request and store timings (metrics.REGISTRY)
+#
+# Every store call runs on one store thread; adds that arrive while a write is in flight
+# are stored together by the next add_many().
+
+# Rows per page unless ?limit= says otherwise, and the most one page may hold
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+# NDJSON lines encoded per chunk of a stream
+STREAM_CHUNK = 1000
+MAX_BODY_BYTES = 32 << 20
+MAX_HEADERS = 100
+# Idle keep-alive connections are closed after this long
+IDLE_SECONDS = 30
+# How often deliveries logged by other stations are picked up
+REFRESH_SECONDS = 1.0
+JOB_WORKERS = 4
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def delivery_json(record):
+    return {
+        "rid": record.rid,
+        "tracking_number": record.tracking_number,
+        "mushroom_id": record.mushroom_id,
+        "mushroom": record.mushroom_name,
+        "box_number": record.box_number,
+        "restaurant_id": record.restaurant_id,
+        "restaurant": record.restaurant_name,
+        "pack_date": record.pack_date_str,
+        "ship_date": record.ship_date_str,
+        "label": record.label(),
+    }
+
+
+def _date(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return date_to_ordinal(value)
+    except ValueError:
+        raise ValueError(f"invalid {name} date '{value}' (expected YYYY-MM-DD)")
+
+
+def _int(params, name, default, low=0, high=None):
+    value = params.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid {name} '{value}'")
+    if number < low or (high is not None and number > high):
+        raise ValueError(f"{name} must be between {low} and {high}" if high is not None else f"{name} must be >= {low}")
+    return number
+
+
+def _flag(params, name, default=False):
+    value = params.get(name)
+    if value is None:
+        return default
+    return str(value).lower() not in ("0", "false", "no", "")
+
+
+def _filters(params):
+    # (start, end, search, restaurant_id, mushroom_id) of a query
+    restaurant = params.get("restaurant")
+    mushroom = params.get("mushroom")
+    return (_date(params, "start"), _date(params, "end"), params.get("search") or None,
+            PARSERS["restaurant_id"](restaurant) if restaurant else None,
+            PARSERS["mushroom_id"](mushroom) if mushroom else None)
+
+
+def _tracking(value):
+    # "2025-05-01-BOX012" -> (pack date ordinal, box number)
+    date, sep, box = value.upper().rpartition("-BOX")
+    try:
+        if not sep or not box.isdigit():
+            raise ValueError
+        return date_to_ordinal(date), int(box)
+    except ValueError:
+        raise ValueError(f"invalid tracking number '{value}' (expected YYYY-MM-DD-BOXnnn)")
+
+
+def _matches(records, search, restaurant_id, mushroom_id):
+    # The filters query() applies, for a snapshot that has no search index
+    search = (search or "").lower()
+    for record in records:
+        if restaurant_id is not None and record.restaurant_id != restaurant_id:
+            continue
+        if mushroom_id is not None and record.mushroom_id != mushroom_id:
+            continue
+        if search and search not in record.label().lower():
+            continue
+        yield record
+
+
+def _encode_chunk(records, size):
+    lines = [json.dumps(delivery_json(record)) for record in _take(records, size)]
+    return "".join(line + "\n" for line in lines).encode()
+
+
+def _close(*generators):
+    for generator in generators:
+        generator.close()
+
+
+def _take(iterator, size):
+    for _ in range(size):
+        record = next(iterator, None)
+        if record is None:
+            return
+        yield record
+
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class TraceabilityService:
+    def __init__(self, manager, settings=None, workers=JOB_WORKERS):
+        self.manager = manager
+        self.store = manager.store
+        self.settings = settings or {}
+        self.store_thread = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="service-store")
+        self.workers = concurrent.futures.ThreadPoolExecutor(max(1, workers), thread_name_prefix="service-job")
+        self._pending = []
+        self._writer = None
+        self._refresh_failed = False
+        self.routes = {
+            ("POST", "deliveries"): self.add_deliveries,
+            ("GET", "deliveries"): self.list_deliveries,
+            ("GET", "deliveries/count"): self.count_deliveries,
+            ("GET", "deliveries/stream"): self.stream_deliveries,
+            ("POST", "exports/csv"): functools.partial(self.export, "csv"),
+            ("POST", "exports/excel"): functools.partial(self.export, "excel"),
+            ("POST", "exports/summary"): functools.partial(self.export, "summary"),
+            ("POST", "invoices"): self.invoice_batch,
+            ("POST", "square"): self.square,
+            ("GET", "metrics"): self.metrics,
+        }
+
+    # --- Threads ---
+
+    def in_store(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.store_thread, functools.partial(func, *args))
+
+    def in_worker(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.workers, functools.partial(func, *args))
+
+    async def refresh_forever(self):
+        while True:
+            await asyncio.sleep(REFRESH_SECONDS)
+            try:
+                await self.in_store(self.store.refresh)
+                self._refresh_failed = False
+            except Exception as e:
+                if not self._refresh_failed:
+                    print(f"warning: could not refresh the logs: {e}", file=sys.stderr)
+                    metrics.record_error("service.refresh", str(e))
+                self._refresh_failed = True
+
+    # --- Deliveries ---
+
+    def store_records(self, records):
+        # Resolves with the same records once they are logged
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((records, future))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write_pending())
+        return future
+
+    async def _write_pending(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            count("service.add_writes")
+            try:
+                await self.in_store(self.store.add_many, [record for records, _ in batch for record in records])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for records, future in batch:
+                if not future.done():
+                    future.set_result(records)
+
+    async def add_deliveries(self, params, body):
+        data = body()
+        single = isinstance(data, dict) and "deliveries" not in data
+        rows = [data] if single else data.get("deliveries") if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not rows or not all(isinstance(row, (dict, list)) for row in rows):
+            raise ValueError("expected a delivery object, a list of them or {\"deliveries\": [...]}")
+        records = await self.store_records(validate_rows(tuple_rows(rows)))
+        count("service.deliveries_added", len(records))
+        if single:
+            return 201, {"delivery": delivery_json(records[0])}
+        return 201, {"added": len(records), "tracking_numbers": [record.tracking_number for record in records]}
+
+    async def list_deliveries(self, params, body):
+        start, end, search, restaurant_id, mushroom_id = _filters(params)
+        limit = _int(params, "limit", PAGE_LIMIT, 1, MAX_PAGE_LIMIT)
+        offset = _int(params, "offset", 0)
+        newest_first = _flag(params, "newest")
+
+        def page():
+            return list(self.store.query(start, end, search, restaurant_id, mushroom_id, limit=limit, offset=offset,
+                                         newest_first=newest_first))
+
+        records = await self.in_store(page)
+        result = {"deliveries": [delivery_json(record) for record in records], "offset": offset}
+        if len(records) == limit:
+            result["next_offset"] = offset + limit
+        return 200, result
+
+    async def count_deliveries(self, params, body):
+        start, end, search, restaurant_id, mushroom_id = _filters(params)
+        if restaurant_id is not None or mushroom_id is not None:
+            raise ValueError("count takes start, end and search only")
+        return 200, {"count": await self.in_store(self.store.count, start, end, search)}
+
+    async def find_delivery(self, tracking_number):
+        pack_date, box_number = _tracking(tracking_number)
+
+        def find():
+            return [record for record in self.store.query(pack_date, pack_date) if record.box_number == box_number]
+
+        records = await self.in_store(find)
+        if not records:
+            raise HttpError(404, f"no delivery with tracking number {tracking_number}")
+        return 200, {"deliveries": [delivery_json(record) for record in records]}
+
+    async def stream_deliveries(self, params, body, send):
+        start, end, search, restaurant_id, mushroom_id = _filters(params)
+        limit = _int(params, "limit", None, 1)
+        # A lazy SQLite cursor can only be read by one thread, so each stream gets its own
+        snapshot = await self.in_store(self.store.snapshot, start, end)
+        matches = _matches(snapshot, search, restaurant_id, mushroom_id)
+        records = matches if limit is None else _take(matches, limit)
+        reader = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="service-stream")
+        loop = asyncio.get_running_loop()
+        try:
+            await send.start(200, "application/x-ndjson")
+            sent = 0
+            while True:
+                chunk = await loop.run_in_executor(reader, _encode_chunk, records, STREAM_CHUNK)
+                if not chunk:
+                    break
+                sent += chunk.count(b"\n")
+                await send.chunk(chunk)
+            count("service.deliveries_streamed", sent)
+            await send.end()
+        finally:
+            reader.submit(_close, records, matches)
+            reader.shutdown(wait=False)
+
+    # --- Documents and Square ---
+
+    def _folder(self):
+        return self.settings.get("export_folder", "") or "."
+
+    async def export(self, fmt, params, body):
+        import exports
+
+        options = body() or {}
+        start, end = _date(options, "start"), _date(options, "end")
+        today = datetime.date.today().strftime("%Y-%m-%d")
+        if fmt == "excel":
+            split_by = options.get("split") or self.settings.get("excel_split", "none")
+            if split_by not in exports.EXCEL_SPLITS:
+                raise ValueError(f"Unknown Excel split: {split_by}")
+        if fmt == "summary":
+            engine = options.get("engine") or self.settings.get("report_engine", "native")
+            if engine not in exports.REPORT_ENGINES:
+                raise ValueError(f"Unknown report engine: {engine}")
+
+        def read():
+            records = self.store.snapshot(start, end)
+            if fmt != "summary":
+                return records, None, None
+            return records, self.store.count_by("mushroom_id", start, end), self.store.count_by("pack_date", start, end)
+
+        records, mushroom_counts, date_counts = await self.in_store(read)
+        folder = self._folder()
+        warnings = []
+        if fmt == "csv":
+            path = await self.in_worker(exports.write_csv, exports.export_path(folder, "traceability_log", today, "csv"),
+                                        records)
+        elif fmt == "excel":
+            path = exports.export_path(folder, "traceability_log", today, "xlsx")
+            path = await self.in_worker(functools.partial(exports.write_excel, path, records, split_by=split_by))
+        else:
+            counts = {MUSHROOM_TYPES.get(k, str(k)): v for k, v in mushroom_counts.items()}
+            warnings, path = await self.in_worker(self._write_summary, records, counts, date_counts, engine, today,
+                                                  _flag(options, "analytics", True), _flag(options, "charts", True))
+        return 200, {"path": os.path.abspath(path), "warnings": warnings}
+
+    def _write_summary(self, records, counts, date_counts, engine, today, analytics, charts):
+        # Same report as `cli export summary`, on a worker thread
+        import exports
+
+        folder = self._folder()
+        logo_path = self.settings.get("logo_path", "")
+        analytics = exports.summary_analytics(records) if analytics else None
+        chart_path = None
+        if charts:
+            from charts import CACHE_DIR, ChartCache
+
+            chart_path = ChartCache(os.path.join(folder, CACHE_DIR)).render(counts, date_counts)
+        if engine == "native":
+            path = exports.export_path(folder, "summary_report", today, "pdf")
+            warnings = exports.write_summary_pdf(path, records, counts, today, logo_path, analytics=analytics,
+                                                 chart_path=chart_path)
+            return warnings, path
+        path = exports.export_path(folder, "summary_report", today, "docx")
+        warnings = exports.write_summary_docx(path, records, counts, today, logo_path, analytics=analytics,
+                                              chart_path=chart_path)
+        if engine == "word":
+            path = exports.convert_to_pdf(path, os.path.splitext(path)[0] + ".pdf")
+        return warnings, path
+
+    async def invoice_batch(self, params, body):
+        from invoices import INVOICE_DIR, PERIODS, batch_records, write_invoice_batch
+
+        options = body() or {}
+        period = options.get("period") or "month"
+        if period not in PERIODS:
+            raise ValueError(f"Unknown billing period: {period}")
+        start, end = _date(options, "start"), _date(options, "end")
+        engine = {"pdf": "native", "docx": "docx"}.get(options.get("format")) or \
+            self.settings.get("report_engine", "native")
+        folder = os.path.join(self._folder(), INVOICE_DIR)
+        logo_path = existing(self.settings.get("logo_path", ""))
+        template_path = existing(self.settings.get("invoice_template", ""))
+        records = await self.in_store(batch_records, self.store, period, start, end)
+        entries = await self.in_worker(write_invoice_batch, folder, records, period, start, end, engine, None, None,
+                                       logo_path, template_path)
+        return 200, {"folder": os.path.abspath(folder), "invoices": entries}
+
+    async def square(self, params, body):
+        from square_submit import submit_invoices
+
+        options = body() or {}
+        start, end = _date(options, "start"), _date(options, "end")
+        workers = _int(options, "workers", SQUARE_MAX_CONCURRENCY, 1)
+        rate = float(options.get("rate") or SQUARE_RATE_LIMIT)
+        requests = await self.in_store(self.manager.square_requests, start, end)
+        results = await self.in_worker(functools.partial(submit_invoices, self.manager.client, requests,
+                                                         max_workers=workers, rate=rate,
+                                                         max_retries=SQUARE_MAX_RETRIES))
+        failed = [{"invoice_number": result.invoice_number, "errors": result.errors}
+                  for result in results if not result.success]
+        return 200, {"submitted": len(results) - len(failed), "total": len(results), "failed": failed}
+
+    async def metrics(self, params, body):
+        return 200, metrics.REGISTRY.snapshot()
+
+    # --- HTTP ---
+
+    def route(self, method, path):
+        # (name, handler, extra args); the tracking number lookup is the one path with a parameter
+        path = path.strip("/")
+        handler = self.routes.get((method, path))
+        if handler is not None:
+            return path, handler, ()
+        if path.startswith("deliveries/") and path.count("/") == 1:
+            if method != "GET":
+                raise HttpError(405, f"{method} is not allowed on /{path}")
+            tracking_number = urllib.parse.unquote(path.partition("/")[2])
+            return "deliveries/tracking", lambda params, body: self.find_delivery(tracking_number), ()
+        if any(key == path for _, key in self.routes):
+            raise HttpError(405, f"{method} is not allowed on /{path}")
+        raise HttpError(404, f"no such endpoint /{path}")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                if not line.strip():
+                    break
+                keep_alive = await self._request(line, reader, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def _request(self, line, reader, writer):
+        send = _Sender(writer)
+        try:
+            method, target, version = line.decode("latin-1").split()
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                if len(headers) >= MAX_HEADERS:
+                    raise HttpError(431, "too many headers")
+                name, _, value = header.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+        except (ValueError, HttpError) as e:
+            await send.error(e if isinstance(e, HttpError) else HttpError(400, "malformed request"), False)
+            return False
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        send.keep_alive = keep_alive
+        length = headers.get("content-length", "0")
+        if not length.isdigit() or "transfer-encoding" in headers:
+            # Without a length the body cannot be skipped, so the connection ends here
+            await send.error(HttpError(411, "send the body with a Content-Length"), False)
+            return False
+        if int(length) > MAX_BODY_BYTES:
+            await send.error(HttpError(413, f"bodies are limited to {MAX_BODY_BYTES >> 20} MB"), False)
+            return False
+        data = await reader.readexactly(int(length))
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        def body():
+            if not data.strip():
+                return None
+            try:
+                return json.loads(data)
+            except ValueError:
+                raise ValueError("the request body is not valid JSON")
+
+        name = "unknown"
+        try:
+            name, handler, args = self.route(method, url.path)
+            with timed(f"service.{name.replace('/', '.')}"):
+                if name == "deliveries/stream":
+                    await handler(params, body, send)
+                    return send.keep_alive
+                status, payload = await handler(params, body, *args)
+            await send.json(status, payload)
+        except HttpError as e:
+            await send.error(e)
+        except BulkValidationError as e:
+            # Every bad row is listed; nothing was stored
+            await send.json(400, {"error": str(e), "errors": [[where, message] for where, message in e.errors]})
+        except ValueError as e:
+            await send.error(HttpError(400, str(e)))
+        except TimeoutError as e:
+            # The shared log stayed locked by another station
+            await send.error(HttpError(503, str(e)))
+        except ConnectionError:
+            raise
+        except Exception as e:
+            metrics.record_error(f"service.{name}", str(e))
+            await send.error(HttpError(500, str(e)))
+        return send.keep_alive
+
+
+class _Sender:
+    # Writes one response; a stream that fails halfway can only be cut off
+    def __init__(self, writer):
+        self.writer = writer
+        self.keep_alive = False
+        self.streaming = False
+
+    def _connection(self):
+        return [("Connection", "keep-alive" if self.keep_alive else "close")]
+
+    async def json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.writer.write(_head(status, [("Content-Type", "application/json"), ("Content-Length", len(data))]
+                                + self._connection()) + data)
+        await self.writer.drain()
+
+    async def error(self, error, keep_alive=None):
+        if keep_alive is not None:
+            self.keep_alive = keep_alive
+        if self.streaming:
+            self.keep_alive = False
+            return
+        await self.json(error.status, {"error": str(error)})
+
+    async def start(self, status, content_type):
+        self.streaming = True
+        self.writer.write(_head(status, [("Content-Type", content_type), ("Transfer-Encoding", "chunked")]
+                                + self._connection()))
+
+    async def chunk(self, data):
+        self.writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        await self.writer.drain()
+
+    async def end(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+async def run(service, host=SERVICE_HOST, port=SERVICE_PORT, ready=None):
+    server = await asyncio.start_server(service.handle, host, port)
+    refresher = asyncio.ensure_future(service.refresh_forever())
+    if ready is not None:
+        ready(server.sockets[0].getsockname())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        refresher.cancel()
+        if service._writer is not None:
+            await asyncio.gather(service._writer, return_exceptions=True)
+
+
+def serve(manager, settings=None, host=SERVICE_HOST, port=SERVICE_PORT, workers=JOB_WORKERS, ready=None):
+    # Blocks until interrupted; the caller closes the store afterwards
+    service = TraceabilityService(manager, settings, workers)
+    try:
+        asyncio.run(run(service, host, port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.workers.shutdown(wait=True)
+        service.store_thread.shutdown(wait=True)
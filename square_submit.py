@@ -0,0 +1,117 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import count, record_error, timed
+
+# Square error categories/codes and HTTP statuses worth retrying
+TRANSIENT_CATEGORIES = {"RATE_LIMIT_ERROR", "API_ERROR"}
+TRANSIENT_CODES = {"RATE_LIMITED", "SERVICE_UNAVAILABLE", "GATEWAY_TIMEOUT", "INTERNAL_SERVER_ERROR"}
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class InvoiceResult:
+    def __init__(self, label, invoice_number):
+        self.label = label
+        self.invoice_number = invoice_number
+        self.success = False
+        self.attempts = 0
+        self.errors = None
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        status = "ok" if self.success else f"failed: {self.errors}"
+        return f"InvoiceResult({self.invoice_number}, {status}, attempts={self.attempts})"
+
+
+def is_transient(result=None, error=None):
+    if error is not None:
+        # Connection resets and timeouts (including requests' errors) are all OSErrors
+        return isinstance(error, OSError)
+    if getattr(result, "status_code", None) in TRANSIENT_STATUSES:
+        return True
+    for err in result.errors or []:
+        if not isinstance(err, dict):
+            continue
+        if err.get("category") in TRANSIENT_CATEGORIES or err.get("code") in TRANSIENT_CODES:
+            return True
+    return False
+
+
+def _backoff(attempt, base_delay, max_delay):
+    # Exponential backoff with jitter so retries from parallel workers spread out
+    return min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def _submit_one(client, label, body, bucket, max_retries, base_delay, max_delay):
+    result = InvoiceResult(label, body["invoice"].get("invoice_number"))
+    started = time.perf_counter()
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        result.attempts += 1
+        try:
+            with timed("square.create_invoice"):
+                response = client.invoices.create_invoice(body=body)
+        except Exception as e:
+            result.errors = str(e)
+            if not is_transient(error=e):
+                break
+        else:
+            if response.is_success():
+                result.success = True
+                result.errors = None
+                break
+            result.errors = response.errors
+            if not is_transient(result=response):
+                break
+        if attempt < max_retries:
+            count("square.retries")
+            time.sleep(_backoff(attempt, base_delay, max_delay))
+    result.elapsed = time.perf_counter() - started
+    if not result.success:
+        record_error("square", f"{label}: {result.errors}")
+    return result
+
+
+def submit_invoices(client, requests, max_workers=8, rate=10.0, max_retries=4,
+                    base_delay=0.5, max_delay=8.0, progress=None):
+    # requests: [(label, body)]; one InvoiceResult each, in order
+    bucket = TokenBucket(rate)
+    results = [None] * len(requests)
+    done = 0
+    done_lock = threading.Lock()
+
+    def run(i, label, body):
+        nonlocal done
+        results[i] = _submit_one(client, label, body, bucket, max_retries, base_delay, max_delay)
+        if progress is not None:
+            with done_lock:
+                done += 1
+                progress(done, len(requests), results[i])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for future in [pool.submit(run, i, label, body) for i, (label, body) in enumerate(requests)]:
+            future.result()
+    return results
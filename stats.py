@@ -0,0 +1,115 @@
+import bisect
+import json
+import os
+from collections import Counter
+
+# Delivery counts kept up to date on every add/delete, per pack day as
+# {(ship_date, mushroom_id, restaurant_id): deliveries}.
+
+KEY_FIELDS = {"ship_date": 0, "mushroom_id": 1, "restaurant_id": 2}
+
+
+def _key(record):
+    return record.ship_date, record.mushroom_id, record.restaurant_id
+
+
+class DeliveryStats:
+    def __init__(self):
+        self.days = {}
+        self.pack_days = []
+        self.total = 0
+
+    def clear(self):
+        self.__init__()
+
+    def _day(self, pack_date):
+        counts = self.days.get(pack_date)
+        if counts is None:
+            counts = self.days[pack_date] = Counter()
+            bisect.insort(self.pack_days, pack_date)
+        return counts
+
+    def add(self, record):
+        self._day(record.pack_date)[_key(record)] += 1
+        self.total += 1
+
+    def add_many(self, records):
+        day = counts = None
+        for record in records:
+            # Batches are usually runs of one pack date
+            if record.pack_date != day:
+                day = record.pack_date
+                counts = self._day(day)
+            counts[_key(record)] += 1
+            self.total += 1
+
+    def remove(self, record):
+        counts = self.days.get(record.pack_date)
+        key = _key(record)
+        if not counts or not counts[key]:
+            return
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
+            if not counts:
+                del self.days[record.pack_date]
+                del self.pack_days[bisect.bisect_left(self.pack_days, record.pack_date)]
+        self.total -= 1
+
+    def rebuild(self, records):
+        self.clear()
+        self.add_many(records)
+
+    def _range(self, start, end):
+        lo = 0 if start is None else bisect.bisect_left(self.pack_days, start)
+        hi = len(self.pack_days) if end is None else bisect.bisect_right(self.pack_days, end)
+        return self.pack_days[lo:hi]
+
+    def count(self, start=None, end=None):
+        if start is None and end is None:
+            return self.total
+        return sum(sum(self.days[day].values()) for day in self._range(start, end))
+
+    def count_by(self, field, start=None, end=None):
+        if field == "pack_date":
+            return {day: sum(self.days[day].values()) for day in self._range(start, end)}
+        position = KEY_FIELDS.get(field)
+        if position is None:
+            raise ValueError(f"Cannot group deliveries by {field}")
+        totals = Counter()
+        for day in self._range(start, end):
+            for key, deliveries in self.days[day].items():
+                totals[key[position]] += deliveries
+        return dict(totals)
+
+    # --- Persistence ---
+
+    def rows(self):
+        # [pack_date, ship_date, mushroom_id, restaurant_id, deliveries] per key
+        return [[day, *key, deliveries] for day in self.pack_days for key, deliveries in self.days[day].items()]
+
+    def add_rows(self, rows):
+        for pack_date, ship_date, mushroom_id, restaurant_id, deliveries in rows:
+            self._day(pack_date)[(ship_date, mushroom_id, restaurant_id)] += deliveries
+            self.total += deliveries
+
+    def save(self, path, seq):
+        # `seq` tags the log state these counts belong to
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": seq, "total": self.total, "counts": self.rows()}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, seq):
+        # Returns None when the file is missing, unreadable or from another log state
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("seq") != seq:
+                return None
+            stats = cls()
+            stats.add_rows(data["counts"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        return stats if stats.total == data.get("total") else None
@@ -0,0 +1,800 @@
+import bisect
+import contextlib
+import itertools
+import operator
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+from journal import LogJournal
+from logfile import convert, legacy_path
+from metrics import timed
+from partitions import ARCHIVE_SUFFIX, HOT_MONTHS, PartitionArchive, PartitionView, last_sealed_month, split_by_month
+from records import DeliveryRecord
+from search import SearchIndex, iter_rids
+from stats import DeliveryStats
+
+DATABASE_FILE = "logs.db"
+
+# Newest deliveries read before the window opens when loading in the background
+RECENT_ON_LOAD = 1000
+
+GROUP_FIELDS = ("mushroom_id", "restaurant_id", "pack_date", "ship_date")
+SORT_FIELDS = ("mushroom_id", "box_number", "restaurant_id", "pack_date", "ship_date")
+
+
+def _rid_key(record):
+    return record.rid
+
+
+class _LoadCancelled(Exception):
+    pass
+
+
+class _OlderLoader(threading.Thread):
+    # Parses the older part of the history off the Tk thread; the store merges the result
+    def __init__(self, journal, older, recent, archive_counts):
+        super().__init__(name="log-loader", daemon=True)
+        self.journal = journal
+        self.older = older
+        self.recent = recent
+        # None when the saved counts were current; else the sealed months' counts
+        self.archive_counts = archive_counts
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+    def progress(self, done, total, message=None):
+        # Called between parsed chunks, like Job.progress
+        if self.cancelled:
+            raise _LoadCancelled()
+
+    def run(self):
+        try:
+            records, skipped = self.journal.load_older(self.older, self)
+            self.progress(0, None)
+            for rid, record in enumerate(records, 1):
+                record.rid = rid
+            index = SearchIndex()
+            index.add_many(records)
+            index.add_many(self.recent)
+            self.progress(0, None)
+            stats = None
+            if self.archive_counts is not None:
+                stats = DeliveryStats()
+                stats.add_rows(self.archive_counts)
+                stats.add_many(records)
+                stats.add_many(self.recent)
+            self.result = records, skipped, index, stats
+        except _LoadCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+
+
+# The hot months of the history in memory, persisted through the logs.ndjson journal;
+# older months are sealed into archives (see partitions.py). Without a log file it is a
+# plain in-memory store. load(background=True) leaves the older deliveries to a thread
+# until poll_load() merges them.
+class MemoryLogStore:
+    def __init__(self, log_file=None, hot_months=HOT_MONTHS):
+        self.records = []
+        self.index = SearchIndex()
+        self.stats = DeliveryStats()
+        self.journal = LogJournal(log_file, apply=self._apply, reload=self.load) if log_file else None
+        self.stats_path = log_file + ".stats" if log_file else None
+        self.legacy_file = legacy_path(log_file) if log_file else None
+        self.archive = PartitionArchive(log_file + ARCHIVE_SUFFIX) if log_file else None
+        # None keeps every month hot (existing archives are still read)
+        self.hot_months = hot_months
+        self._next_rid = itertools.count(1)
+        # Bumped on every change
+        self.version = 0
+        self._sorted = (None, None)
+        self.loading = False
+        # Unreadable entries found by the background part of the last load
+        self.load_skipped = 0
+        self._loader = None
+        self._older = 0
+        self._stats_complete = True
+
+    def _assign_rids(self, records, restart=False):
+        if restart:
+            self._next_rid = itertools.count(1)
+        for record in records:
+            record.rid = next(self._next_rid)
+        return records
+
+    def _legacy_exists(self):
+        return self.legacy_file is not None and (os.path.exists(self.legacy_file) or
+                                                 os.path.exists(self.legacy_file + ".journal"))
+
+    @timed("store.load")
+    def load(self, background=False):
+        if self.journal is None:
+            return 0
+        # A background load is only dropped once the lock is held, so a timeout keeps it
+        with self.journal.lock:
+            self._stop_loading()
+            return self._load(background)
+
+    def _load(self, background):
+        if not self._own_files_exist() and self._legacy_exists():
+            # First start on NDJSON: logs.json (and its journal) are converted once
+            convert(self.legacy_file, self.journal.snapshot_path)
+        # Loading never writes; an interrupted seal is read from its copy of the hot deliveries
+        self.archive.load()
+        interrupted = self.archive.pending is not None
+        if background and not interrupted:
+            recent = self.journal.load_recent(RECENT_ON_LOAD)
+            if recent is not None and recent[1]:
+                return self._load_recent(*recent)
+        records, skipped = self.journal.load()
+        if interrupted and self.journal.checkpoint_seq < self.archive.pending["seq"]:
+            records = self.archive.pending_records()
+        self.records = self._assign_rids(records, restart=True)
+        self.version += 1
+        self.index.clear()
+        self.index.add_many(self.records)
+        # Counts saved at the last close are reused if nothing was logged since
+        stats = DeliveryStats.load(self.stats_path, self.journal.seq)
+        if stats is not None and stats.total == self.archive.total() + len(self.records):
+            self.stats = stats
+        else:
+            self._rebuild_stats()
+        return skipped
+
+    def _rebuild_stats(self):
+        self.stats.clear()
+        if self.archive is not None:
+            self.archive.add_counts(self.stats)
+        self.stats.add_many(self.records)
+
+    def _seal_due(self):
+        if self.archive.pending is not None:
+            return True
+        if self.hot_months is None or not self._own_files_exist():
+            return False
+        through = last_sealed_month(self.hot_months)
+        return self.archive.sealed_through is None or self.archive.sealed_through < through
+
+    @timed("store.seal")
+    def _seal(self):
+        # Under the lock; also finishes an interrupted seal, then reads everything again
+        records, _ = self.journal.load()
+        archive = self.archive
+        if archive.pending is not None and self.journal.checkpoint_seq < archive.pending["seq"]:
+            records = archive.pending_records()
+            self.journal.compact(records)
+        through = archive.sealed_through
+        if self.hot_months is not None:
+            through = max(through or "", last_sealed_month(self.hot_months))
+        sealed, hot = split_by_month(records, through)
+        if sealed:
+            archive.seal(sealed, hot, through, self.journal.seq + 1)
+            self.journal.compact(hot)
+        archive.settle(through)
+        self.load()
+
+    def _finish_seal(self):
+        # Nothing may be appended after a half-done seal
+        if self.archive.pending is None:
+            return
+        with self.journal.lock:
+            self.journal.poll()
+            if self._stale():
+                self.load()
+            if self.archive.pending is not None:
+                self._seal()
+
+    def _load_recent(self, records, older, skipped):
+        self._next_rid = itertools.count(older + 1)
+        self.records = self._assign_rids(records)
+        self.version += 1
+        self.index.clear()
+        self.index.add_many(self.records)
+        stats = DeliveryStats.load(self.stats_path, self.journal.seq)
+        self._stats_complete = stats is not None and \
+            stats.total == self.archive.total() + older + len(self.records)
+        archive_counts = None
+        if self._stats_complete:
+            self.stats = stats
+        else:
+            self.stats.rebuild(self.records)
+            archive_counts = [row for entry in self.archive.partitions for row in entry["counts"]]
+        self.loading = True
+        self._older = older
+        self._loader = _OlderLoader(self.journal, older, list(self.records), archive_counts)
+        self._loader.start()
+        return skipped
+
+    def poll_load(self):
+        # True when the older records were just merged
+        if not self.loading or self._loader.is_alive():
+            return False
+        self._finish_loading()
+        return True
+
+    @timed("store.wait_for_load")
+    def _finish_loading(self):
+        loader = self._loader
+        loader.join()
+        if loader.error is not None or loader.result is None:
+            # Nothing half-loaded may ever be saved; if this fails the next poll tries again
+            self.load()
+            return
+        self.loading = False
+        self._loader = None
+        self._older = 0
+        records, skipped, index, stats = loader.result
+        added = self.records[len(loader.recent):]
+        index.add_many(added)
+        if stats is not None:
+            stats.add_many(added)
+            self.stats = stats
+        self._stats_complete = True
+        self.index = index
+        records.extend(self.records)
+        self.records = records
+        self.load_skipped = skipped
+        self.version += 1
+
+    def _stop_loading(self):
+        if self.loading:
+            self._loader.cancelled = True
+            self._loader.join()
+            self.loading = False
+            self._loader = None
+            self._older = 0
+
+    def _require_all(self):
+        if self.loading:
+            self._finish_loading()
+
+    def _stale(self):
+        return self.journal.reload_needed or self.archive.changed()
+
+    def refresh(self):
+        # Picks up what other instances logged
+        if self.journal is None:
+            return False
+        changed = self.journal.poll() > 0
+        if self._stale():
+            self.load()
+            return True
+        return changed
+
+    def _write_lock(self):
+        return self.journal.lock if self.journal is not None else contextlib.nullcontext()
+
+    def _own_files_exist(self):
+        return os.path.exists(self.journal.snapshot_path) or os.path.exists(self.journal.journal_path) or \
+            self.archive.exists()
+
+    def exists(self):
+        if self.journal is None:
+            return True
+        return self._own_files_exist() or self._legacy_exists()
+
+    def has_records(self):
+        return bool(self.records) or self._older > 0 or (self.archive is not None and bool(self.archive.partitions))
+
+    def _archived(self, start=None, end=None, restaurant_id=None):
+        return self.archive.overlapping(start, end, restaurant_id) if self.archive is not None else []
+
+    def _match(self, start, end, search):
+        if start is None and end is None and not search:
+            return None
+        self._require_all()
+        return self.index.match(search, start, end, lookup=self._get_hot)
+
+    def count(self, start=None, end=None, search=None):
+        rids = self._match(start, end, search)
+        hot = self._older + len(self.records) if rids is None else rids.bit_count()
+        return hot + self.archive.count(start, end, search) if self.archive is not None else hot
+
+    def add(self, record):
+        return self.add_many([record])[0]
+
+    @timed("store.add_many")
+    def add_many(self, records):
+        if self.journal is None:
+            self._add_records(records)
+            return records
+        if records:
+            self._finish_seal()
+            self.journal.append_adds(records)
+        self._maybe_compact()
+        return records
+
+    def _add_records(self, records):
+        self._assign_rids(records)
+        self.records.extend(records)
+        self.index.add_many(records)
+        self.stats.add_many(records)
+        self.version += 1
+
+    def _remove_at(self, index):
+        if self.loading:
+            self._require_all()
+        if not 0 <= index < len(self.records):
+            return
+        record = self.records.pop(index)
+        self.index.remove(record)
+        self.stats.remove(record)
+        self.version += 1
+
+    def _apply(self, entry, records):
+        # Called by the journal for every entry; `records` are this instance's own adds
+        if entry["op"] == "add":
+            records = records or self.journal.parse([entry["label"]])[0]
+        elif entry["op"] == "add_many":
+            records = records or self.journal.parse(entry["labels"])[0]
+        elif entry["op"] == "del":
+            self._remove_at(entry["index"])
+            return
+        else:
+            return
+        self._add_records(records)
+
+    def _index_of(self, rid):
+        i = bisect.bisect_left(self.records, rid, key=_rid_key)
+        if i < len(self.records) and self.records[i].rid == rid:
+            return i
+        return None
+
+    @timed("store.delete")
+    def delete(self, rids):
+        with self._write_lock():
+            if self.journal is not None:
+                self.journal.poll()
+                if self._stale():
+                    self.load()
+                    raise ValueError("The logs were changed by another station. Nothing was deleted; please try again.")
+                if self.archive.pending is not None:
+                    self._seal()
+                    raise ValueError("An interrupted archive update was just finished. Nothing was deleted; "
+                                     "please try again.")
+            # Sealed deliveries have negative rids
+            archived = [rid for rid in rids if rid < 0]
+            deleted = 0
+            if archived:
+                for record in self.archive.delete(archived):
+                    self.stats.remove(record)
+                    deleted += 1
+                self.version += 1
+            self._require_all()
+            indexes = [self._index_of(rid) for rid in sorted((rid for rid in rids if rid > 0), reverse=True)]
+            indexes = [index for index in indexes if index is not None]
+            if self.journal is None:
+                for index in indexes:
+                    self._remove_at(index)
+            elif indexes:
+                self.journal.append_deletes(indexes)
+            deleted += len(indexes)
+        if self.journal is not None:
+            self._maybe_compact()
+        return deleted
+
+    def _maybe_compact(self):
+        if self.journal.compact_due() and not self.loading:
+            self._compact(background=True)
+
+    def _compact(self, background=False):
+        with self.journal.lock:
+            self.journal.poll()
+            if self._stale():
+                self.load()
+            if self._seal_due():
+                self._seal()
+            else:
+                self.journal.compact(self.records, background)
+
+    @timed("store.replace_all")
+    def replace_all(self, records):
+        self._stop_loading()
+        records = list(records)
+        with self._write_lock():
+            sealed, hot = {}, records
+            if self.journal is not None:
+                self.journal.poll()
+                if self.archive.changed():
+                    self.archive.load()
+                if self.hot_months is not None:
+                    sealed, hot = split_by_month(records, last_sealed_month(self.hot_months))
+            sealing = self.journal is not None and (sealed or self.archive.partitions)
+            through = last_sealed_month(self.hot_months) if self.hot_months is not None else None
+            if sealing:
+                self.archive.seal(sealed, hot, through, self.journal.seq + 1, replace=True)
+            self.records = self._assign_rids(hot, restart=True)
+            self.version += 1
+            self.index.clear()
+            self.index.add_many(self.records)
+            self._rebuild_stats()
+            if self.journal is not None:
+                self.journal.compact(self.records, retain=False)
+                if sealing:
+                    self.archive.settle(through)
+                self._save_stats()
+
+    @timed("store.save")
+    def save(self):
+        self._require_all()
+        if self.journal is not None:
+            self._compact()
+            self._save_stats()
+
+    def _save_stats(self):
+        if not self.exists() or not self._stats_complete:
+            return
+        try:
+            self.stats.save(self.stats_path, self.journal.seq)
+        except OSError:
+            pass  # Only a cache; rebuilt from the logs on the next load
+
+    def latest(self):
+        if not self.records:
+            self._require_all()
+        if self.records:
+            return self.records[-1]
+        return self.archive.latest() if self.archive is not None else None
+
+    def get(self, rid):
+        if rid < 0:
+            return self.archive.get(rid) if self.archive is not None else None
+        return self._get_hot(rid)
+
+    def _get_hot(self, rid):
+        if self.loading and rid <= self._older:
+            self._require_all()
+        index = self._index_of(rid)
+        return self.records[index] if index is not None else None
+
+    def query(self, start=None, end=None, search=None, restaurant_id=None, mushroom_id=None,
+              limit=None, offset=0, newest_first=False, sort_by=None):
+        # Rid order unless sort_by names a field
+        stop = None if limit is None else offset + limit
+        if self.loading and not (newest_first and stop is not None and stop <= len(self.records) and sort_by is None
+                                 and restaurant_id is None and mushroom_id is None):
+            self._require_all()
+        if sort_by is not None:
+            records = self._sorted_by(sort_by, start, end, search)
+            return self._page(records, restaurant_id, mushroom_id, offset, stop, newest_first)
+        archived = self._archived(start, end, restaurant_id)
+        if not archived:
+            return self._query_hot(start, end, search, restaurant_id, mushroom_id, offset, stop, newest_first)
+        if newest_first:
+            archived.reverse()
+        # Months are opened only when the iteration reaches them
+        months = itertools.chain.from_iterable(
+            self.archive.select(entry, start, end, search, restaurant_id, mushroom_id, newest_first)
+            for entry in archived)
+        hot = self._query_hot(start, end, search, restaurant_id, mushroom_id, 0, None, newest_first)
+        records = itertools.chain(hot, months) if newest_first else itertools.chain(months, hot)
+        return itertools.islice(records, offset, stop)
+
+    def _query_hot(self, start, end, search, restaurant_id, mushroom_id, offset, stop, newest_first):
+        rids = self._match(start, end, search)
+        if rids is None:
+            records = self.records
+        else:
+            rids = iter_rids(rids, reverse=newest_first)
+            if restaurant_id is None and mushroom_id is None:
+                return map(self._get_hot, itertools.islice(rids, offset, stop))
+            records = map(self._get_hot, rids)
+            newest_first = False
+        return self._page(records, restaurant_id, mushroom_id, offset, stop, newest_first)
+
+    @staticmethod
+    def _page(records, restaurant_id, mushroom_id, offset, stop, newest_first):
+        if isinstance(records, list) and restaurant_id is None and mushroom_id is None:
+            if newest_first:
+                first = len(records) - offset
+                last = 0 if stop is None else max(len(records) - stop, 0)
+                return reversed(records[last:max(first, 0)])
+            return iter(records[offset:stop])
+        if newest_first:
+            records = reversed(records)
+        if restaurant_id is not None:
+            records = (r for r in records if r.restaurant_id == restaurant_id)
+        if mushroom_id is not None:
+            records = (r for r in records if r.mushroom_id == mushroom_id)
+        return itertools.islice(records, offset, stop)
+
+    def _sorted_by(self, field, start, end, search):
+        if field not in SORT_FIELDS:
+            raise ValueError(f"Cannot sort deliveries by {field}")
+        # Kept until the records change, so paging through a sorted view sorts once
+        key = (field, start, end, search, self.version)
+        cached_key, records = self._sorted
+        if cached_key != key:
+            records = sorted(self.query(start, end, search), key=operator.attrgetter(field))
+            self._sorted = (key, records)
+        return records
+
+    def snapshot(self, start=None, end=None):
+        # Background jobs read this copy, never the live list
+        archived = self._archived(start, end)
+        if archived:
+            hot = list(self._query_hot(start, end, None, None, None, 0, None, False))
+            return PartitionView(self.archive, archived, start, end, hot)
+        return list(self.query(start, end))
+
+    def count_by(self, field, start=None, end=None):
+        if field not in GROUP_FIELDS:
+            raise ValueError(f"Cannot group deliveries by {field}")
+        if not self._stats_complete:
+            self._require_all()
+        return self.stats.count_by(field, start, end)
+
+    def close(self):
+        self._stop_loading()
+        if self.journal is not None:
+            self.journal.close()
+            self._save_stats()
+
+
+class QueryView:
+    # Re-iterable like the memory store's list snapshot; every pass runs the query again,
+    # bounded by the last id when the snapshot was taken
+    def __init__(self, store, start=None, end=None, last_id=0):
+        self.store = store
+        self.start = start
+        self.end = end
+        self.last_id = last_id
+
+    def __iter__(self):
+        return self.store._query_until(self.start, self.end, self.last_id)
+
+
+def _sql_label(mushroom_id, box_number, restaurant_id, pack_date, ship_date):
+    return DeliveryRecord(mushroom_id, box_number, restaurant_id, pack_date, ship_date).label().lower()
+
+
+# Deliveries in an indexed SQLite table (WAL mode); filters run in SQL and counts come
+# from delivery_stats, which every write keeps current.
+class SQLiteLogStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS deliveries (
+            id INTEGER PRIMARY KEY,
+            mushroom_id INTEGER NOT NULL,
+            box_number INTEGER NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            pack_date INTEGER NOT NULL,
+            ship_date INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_deliveries_pack_date ON deliveries(pack_date);
+        CREATE INDEX IF NOT EXISTS idx_deliveries_ship_date ON deliveries(ship_date);
+        CREATE INDEX IF NOT EXISTS idx_deliveries_restaurant ON deliveries(restaurant_id, pack_date);
+        CREATE INDEX IF NOT EXISTS idx_deliveries_mushroom ON deliveries(mushroom_id, pack_date);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS delivery_stats (
+            pack_date INTEGER NOT NULL,
+            ship_date INTEGER NOT NULL,
+            mushroom_id INTEGER NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            deliveries INTEGER NOT NULL,
+            PRIMARY KEY (pack_date, ship_date, mushroom_id, restaurant_id)
+        ) WITHOUT ROWID;
+    """
+    COLUMNS = "id, mushroom_id, box_number, restaurant_id, pack_date, ship_date"
+
+    def __init__(self, path=DATABASE_FILE, import_from=None):
+        self.path = path
+        self.import_from = import_from
+        self._local = threading.local()
+        self.version = 0
+        self.loading = False
+        self.load_skipped = 0
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+        self._init_stats()
+
+    def _init_stats(self):
+        # Databases from before delivery_stats existed are counted once
+        conn = self._conn()
+        with conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'stats'").fetchone():
+                return
+            conn.execute("DELETE FROM delivery_stats")
+            conn.execute("INSERT INTO delivery_stats SELECT pack_date, ship_date, mushroom_id, restaurant_id, COUNT(*)"
+                         " FROM deliveries GROUP BY pack_date, ship_date, mushroom_id, restaurant_id")
+            conn.execute("INSERT INTO meta (key, value) VALUES ('stats', '1')")
+
+    def _conn(self):
+        # sqlite3 connections are per thread so exports can run off the Tk thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.create_function("delivery_label", 5, _sql_label, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _record(row):
+        return DeliveryRecord(row[1], row[2], row[3], row[4], row[5], rid=row[0])
+
+    @timed("store.load")
+    def load(self, background=False):
+        # One-time import of an existing log history into a fresh database
+        conn = self._conn()
+        if not self.import_from or conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+            return 0
+        skipped = 0
+        source = MemoryLogStore(self.import_from, hot_months=None)
+        if source.exists() and not self.has_records():
+            skipped = source.load()
+            self.replace_all(source.snapshot())
+            source.close()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (self.import_from,))
+        return skipped
+
+    def poll_load(self):
+        return False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def has_records(self):
+        return self._conn().execute("SELECT 1 FROM deliveries LIMIT 1").fetchone() is not None
+
+    @staticmethod
+    def _where(start=None, end=None, search=None, restaurant_id=None, mushroom_id=None, last_id=None):
+        clauses, params = [], []
+        if last_id is not None:
+            clauses.append("id <= ?")
+            params.append(last_id)
+        if start is not None:
+            clauses.append("pack_date >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("pack_date <= ?")
+            params.append(end)
+        if restaurant_id is not None:
+            clauses.append("restaurant_id = ?")
+            params.append(restaurant_id)
+        if mushroom_id is not None:
+            clauses.append("mushroom_id = ?")
+            params.append(mushroom_id)
+        if search:
+            clauses.append("instr(delivery_label(mushroom_id, box_number, restaurant_id, pack_date, ship_date), ?) > 0")
+            params.append(search.lower())
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, start=None, end=None, search=None):
+        if not search:
+            where, params = self._where(start, end)
+            sql = f"SELECT COALESCE(SUM(deliveries), 0) FROM delivery_stats{where}"
+            return self._conn().execute(sql, params).fetchone()[0]
+        where, params = self._where(start, end, search)
+        return self._conn().execute(f"SELECT COUNT(*) FROM deliveries{where}", params).fetchone()[0]
+
+    def add(self, record):
+        return self.add_many([record])[0]
+
+    @staticmethod
+    def _update_stats(conn, keys, sign=1):
+        counts = Counter(keys)
+        conn.executemany("INSERT INTO delivery_stats VALUES (?, ?, ?, ?, ?)"
+                         " ON CONFLICT DO UPDATE SET deliveries = deliveries + excluded.deliveries",
+                         [(*key, sign * n) for key, n in counts.items()])
+        if sign < 0:
+            conn.execute("DELETE FROM delivery_stats WHERE deliveries <= 0")
+
+    @timed("store.add_many")
+    def add_many(self, records):
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO deliveries (mushroom_id, box_number, restaurant_id, pack_date, ship_date)"
+                " VALUES (?, ?, ?, ?, ?)",
+                ((r.mushroom_id, r.box_number, r.restaurant_id, r.pack_date, r.ship_date) for r in records))
+            self._update_stats(conn, ((r.pack_date, r.ship_date, r.mushroom_id, r.restaurant_id) for r in records))
+            # The transaction holds the write lock, so the batch got consecutive ids ending at max(id)
+            last = conn.execute("SELECT MAX(id) FROM deliveries").fetchone()[0]
+        self.version += 1
+        for offset, record in enumerate(reversed(records)):
+            record.rid = last - offset
+        return records
+
+    @timed("store.delete")
+    def delete(self, rids):
+        conn = self._conn()
+        params = [(rid,) for rid in rids]
+        with conn:
+            keys = []
+            for (rid,) in params:
+                keys.extend(conn.execute("SELECT pack_date, ship_date, mushroom_id, restaurant_id FROM deliveries"
+                                         " WHERE id = ?", (rid,)))
+            cursor = conn.executemany("DELETE FROM deliveries WHERE id = ?", params)
+            self._update_stats(conn, keys, sign=-1)
+        self.version += 1
+        return cursor.rowcount
+
+    @timed("store.replace_all")
+    def replace_all(self, records):
+        conn = self._conn()
+        with conn:
+            # Ids keep growing, so snapshots taken before the swap never pick up its rows
+            first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM deliveries").fetchone()[0]
+            conn.execute("DELETE FROM deliveries")
+            conn.execute("DELETE FROM delivery_stats")
+            conn.executemany(
+                "INSERT INTO deliveries (id, mushroom_id, box_number, restaurant_id, pack_date, ship_date)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                ((first + i, r.mushroom_id, r.box_number, r.restaurant_id, r.pack_date, r.ship_date)
+                 for i, r in enumerate(records)))
+            conn.execute("INSERT INTO delivery_stats SELECT pack_date, ship_date, mushroom_id, restaurant_id, COUNT(*)"
+                         " FROM deliveries GROUP BY pack_date, ship_date, mushroom_id, restaurant_id")
+        self.version += 1
+
+    @timed("store.save")
+    def save(self):
+        self._conn().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def latest(self):
+        row = self._conn().execute(f"SELECT {self.COLUMNS} FROM deliveries ORDER BY id DESC LIMIT 1").fetchone()
+        return self._record(row) if row else None
+
+    def get(self, rid):
+        row = self._conn().execute(f"SELECT {self.COLUMNS} FROM deliveries WHERE id = ?", (rid,)).fetchone()
+        return self._record(row) if row else None
+
+    def query(self, start=None, end=None, search=None, restaurant_id=None, mushroom_id=None,
+              limit=None, offset=0, newest_first=False, sort_by=None):
+        where, params = self._where(start, end, search, restaurant_id, mushroom_id)
+        direction = "DESC" if newest_first else "ASC"
+        order = f"id {direction}"
+        if sort_by is not None:
+            if sort_by not in SORT_FIELDS:
+                raise ValueError(f"Cannot sort deliveries by {sort_by}")
+            order = f"{sort_by} {direction}, {order}"
+        sql = f"SELECT {self.COLUMNS} FROM deliveries{where} ORDER BY {order}"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset]
+        return map(self._record, self._conn().execute(sql, params))
+
+    def snapshot(self, start=None, end=None):
+        # Lazy: the rows are read on whichever thread iterates it, with its own connection.
+        # Deliveries added later are left out; ones deleted later drop out of it too
+        last_id = self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM deliveries").fetchone()[0]
+        return QueryView(self, start, end, last_id)
+
+    def _query_until(self, start, end, last_id):
+        where, params = self._where(start, end, last_id=last_id)
+        return map(self._record, self._conn().execute(f"SELECT {self.COLUMNS} FROM deliveries{where} ORDER BY id",
+                                                      params))
+
+    def count_by(self, field, start=None, end=None):
+        if field not in GROUP_FIELDS:
+            raise ValueError(f"Cannot group deliveries by {field}")
+        where, params = self._where(start, end)
+        rows = self._conn().execute(f"SELECT {field}, SUM(deliveries) FROM delivery_stats{where} GROUP BY {field}",
+                                    params)
+        return dict(rows.fetchall())
+
+    def refresh(self):
+        # data_version changes whenever another connection (or process) commits
+        version = self._conn().execute("PRAGMA data_version").fetchone()[0]
+        changed = getattr(self._local, "data_version", version) != version
+        self._local.data_version = version
+        if changed:
+            self.version += 1
+        return changed
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_store(settings, log_file):
+    if settings.get("storage_backend", "journal") == "sqlite":
+        return SQLiteLogStore(settings.get("database_path") or DATABASE_FILE, import_from=log_file)
+    return MemoryLogStore(log_file, settings.get("hot_months", HOT_MONTHS) or None)
@@ -0,0 +1,24 @@
+from analytics import DeliveryFrame, lead_times, report_sections, summarize
+from records import DeliveryRecord, date_to_ordinal
+
+PACK = date_to_ordinal("2025-05-01")
+
+
+def test_shipped_before_packed_is_not_a_zero_day_delivery():
+    frame = DeliveryFrame.from_records([DeliveryRecord(1, box, 1, PACK, PACK + lead)
+                                        for box, lead in enumerate([0, 1, 1, 3, -2, -5], start=1)])
+    lead = lead_times(frame)
+    assert lead["histogram"] == {0: 1, 1: 2, 3: 1}
+    assert lead["deliveries"] == 4 and lead["shipped_before_packed"] == 2
+    assert lead["min"] == 0 and lead["mean"] == 1.25
+
+    bullets = [line for section in report_sections(summarize(frame)) if section[0] == "bullets"
+               for line in section[1]]
+    assert "0 days: 1 deliveries (25%)" in bullets
+    assert "Shipped before packed (check dates): 2 deliveries" in bullets
+
+
+def test_every_delivery_shipped_before_packed():
+    frame = DeliveryFrame.from_records([DeliveryRecord(1, 1, 1, PACK, PACK - 1)])
+    assert lead_times(frame) == {"deliveries": 0, "shipped_before_packed": 1, "histogram": {}}
+    report_sections(summarize(frame))
@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+
+import backups
+from backups import BackupStore
+from records import DeliveryRecord, date_to_ordinal
+
+PACK = date_to_ordinal("2025-05-01")
+
+
+def deliveries(n, restaurant_id=1):
+    return [DeliveryRecord(1 + i % 2, i % 1000 + 1, restaurant_id, PACK + i // 1000, PACK + i // 1000 + 1)
+            for i in range(n)]
+
+
+def segment_files(store):
+    return [os.path.join(root, name) for root, _, names in os.walk(store.segment_folder) for name in names]
+
+
+def test_create_and_restore(tmp_path):
+    store = BackupStore(str(tmp_path / "backups"))
+    records = deliveries(5000)
+    manifest = store.create(records)
+    assert manifest["records"] == 5000 and manifest["new_segments"] == len(manifest["segments"])
+
+    restored, skipped = store.records(manifest["file"])
+    assert skipped == 0
+    assert [r.label() for r in restored] == [r.label() for r in records]
+    assert [b["file"] for b in store.list()] == [manifest["file"]]
+
+    # Appending only writes the last chunk again
+    again = store.create(records + deliveries(10, restaurant_id=2))
+    assert again["new_segments"] <= 2
+    assert store.list()[0]["restaurants"] == {1: 5000, 2: 10}
+
+
+def test_collect_garbage_keeps_reused_segments(tmp_path):
+    store = BackupStore(str(tmp_path / "backups"))
+    old = store.create(deliveries(3000))
+    past = time.time() - 2 * backups.GC_GRACE_SECONDS
+    for path in segment_files(store):
+        os.utime(path, (past, past))
+
+    # A backup that reuses the old segments touches them before its manifest exists
+    reused = store.create(deliveries(3000))
+    assert reused["new_segments"] == 0
+    os.remove(os.path.join(store.folder, reused["file"]))
+    store.delete(old["file"])
+    assert len(segment_files(store)) == len(reused["segments"])
+
+    # Once they are old and unreferenced they go
+    for path in segment_files(store):
+        os.utime(path, (past, past))
+    assert store.collect_garbage() == len(reused["segments"])
+    assert segment_files(store) == []
+
+
+
+def test_describe_backup_missing_from_catalog(tmp_path, monkeypatch):
+    store = BackupStore(str(tmp_path / "backups"))
+    manifest = store.create(deliveries(10))
+    os.remove(os.path.join(store.folder, backups.CATALOG_FILE))
+    entry = store.describe(manifest["name"])
+    assert entry["records"] == 10 and entry["first_pack"] == PACK
+
+    # Unreadable by the time it is catalogued
+    os.remove(os.path.join(store.folder, backups.CATALOG_FILE))
+    monkeypatch.setattr(store, "_entry", lambda filename: None)
+    with pytest.raises(backups.BackupError):
+        store.describe(manifest["name"])
@@ -0,0 +1,64 @@
+import pytest
+
+from ingest import BulkValidationError, tuple_rows, validate_rows
+from manager import TraceabilityManager
+from storage import MemoryLogStore
+
+
+def test_mixed_batch_reports_every_bad_row():
+    rows = [
+        (1, 1, 1, "2025-05-01", "2025-05-02"),
+        ("Lion's Mane", "BOX002", "2 - Restaurant B", "2025-05-01", "2025-05-03"),
+        (9, 3, 1, "2025-05-01", "2025-05-02"),
+        (1, "box?", "Nowhere", "2025-05-01", ""),
+        {"mushroom_id": 2, "box_number": 5, "restaurant_id": 3, "pack_date": "05/01/2025", "ship_date": "2025-05-02"},
+        (2.0, 6.0, 3, "2025-05-01", "2025-05-04"),
+    ]
+    with pytest.raises(BulkValidationError) as failed:
+        validate_rows(tuple_rows(rows))
+    assert failed.value.errors == [
+        ("row 3", "unknown mushroom type id 9"),
+        ("row 4", "invalid box number 'box?', unknown restaurant 'Nowhere', missing ship date"),
+        ("row 5", "invalid pack date '05/01/2025' (expected YYYY-MM-DD)"),
+    ]
+    assert str(failed.value).startswith("3 invalid row(s): row 3: unknown mushroom type id 9")
+
+    good = validate_rows(tuple_rows([row for i, row in enumerate(rows) if i not in (2, 3, 4)]))
+    assert [r.tracking_number for r in good] == ["2025-05-01-BOX001", "2025-05-01-BOX002", "2025-05-01-BOX006"]
+    assert [(r.mushroom_id, r.restaurant_id) for r in good] == [(1, 1), (2, 2), (2, 3)]
+
+
+def test_duplicate_boxes_within_a_batch():
+    rows = [(1, 7, 1, "2025-05-01", "2025-05-02"), (2, 7, 2, "2025-05-02", "2025-05-03"),
+            (2, "BOX007", 3, "2025-05-01", "2025-05-04"), (1, 7, 1, "2025-05-01", "2025-05-02")]
+    with pytest.raises(BulkValidationError) as failed:
+        validate_rows(tuple_rows(rows))
+    assert failed.value.errors == [("row 3", "duplicate box 2025-05-01-BOX007 (also row 1)"),
+                                   ("row 4", "duplicate box 2025-05-01-BOX007 (also row 1)")]
+
+
+def test_nothing_is_stored_when_validation_fails(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    store = MemoryLogStore(str(path), hot_months=None)
+    store.load()
+    manager = TraceabilityManager(store)
+    with pytest.raises(BulkValidationError):
+        manager.add_deliveries([(1, box, 1, "2025-05-01", "2025-05-02") for box in range(1, 50)]
+                               + [(1, 50, 1, "2025-05-01", "never")])
+    with pytest.raises(BulkValidationError):
+        manager.add_box_range(1, 1, 20, "Restaurant Z", "2025-05-01", "2025-05-02")
+    csv_path = tmp_path / "deliveries.csv"
+    csv_path.write_text("Mushroom Type,Box Number,Restaurant Name,Packed Date,Shipped Date\n"
+                        "Blue Oyster,1,Restaurant A,2025-05-01,2025-05-02\n"
+                        "Blue Oyster,1,Restaurant A,2025-05-01,2025-05-02\n", encoding="utf-8")
+    with pytest.raises(BulkValidationError):
+        manager.import_deliveries(str(csv_path))
+    assert store.count() == 0
+    store.close()
+
+    store = MemoryLogStore(str(path), hot_months=None)
+    store.load()
+    assert store.count() == 0
+    assert len(TraceabilityManager(store).add_box_range(1, 1, 20, 1, "2025-05-01", "2025-05-02")) == 20
+    assert store.count() == 20
+    store.close()
@@ -0,0 +1,69 @@
+import datetime
+import os
+
+import pytest
+
+from invoices import group_deliveries, period_bounds, period_label, write_invoice_batch
+from records import DeliveryRecord, date_to_ordinal
+
+
+def day(text):
+    return date_to_ordinal(text)
+
+
+def bounds(ordinal, period):
+    first, last = period_bounds(ordinal, period)
+    return str(datetime.date.fromordinal(first)), str(datetime.date.fromordinal(last))
+
+
+def test_period_bounds_at_year_edges():
+    assert bounds(day("2024-12-31"), "month") == ("2024-12-01", "2024-12-31")
+    assert bounds(day("2025-01-01"), "month") == ("2025-01-01", "2025-01-31")
+    assert bounds(day("2024-02-29"), "month") == ("2024-02-01", "2024-02-29")
+    # Weeks run Monday to Sunday, across the new year
+    assert bounds(day("2024-12-31"), "week") == ("2024-12-30", "2025-01-05")
+    assert bounds(day("2025-01-05"), "week") == ("2024-12-30", "2025-01-05")
+    assert bounds(day("2025-01-06"), "week") == ("2025-01-06", "2025-01-12")
+    assert period_label(day("2024-12-30"), "week") == "2025-W01"
+    assert period_label(day("2026-12-28"), "week") == "2026-W53"
+    with pytest.raises(ValueError):
+        period_bounds(day("2025-01-01"), "year")
+
+
+def test_group_deliveries_per_restaurant():
+    records = [DeliveryRecord(1, 3, 1, day("2024-12-28"), day("2025-01-02")),
+               DeliveryRecord(2, 1, 2, day("2024-12-30"), day("2024-12-31")),
+               DeliveryRecord(1, 2, 1, day("2024-12-29"), day("2024-12-30")),
+               DeliveryRecord(2, 4, 1, day("2024-12-01"), day("2024-12-02")),
+               DeliveryRecord(1, 5, 1, day("2025-01-02"), day("2025-01-07"))]
+    months = group_deliveries(records, "month")
+    assert sorted(months) == [(1, day("2024-12-01")), (1, day("2025-01-01")), (2, day("2024-12-01"))]
+    assert [row[1] for row in months[(1, day("2024-12-01"))]] == [4, 2]
+    assert [row[1] for row in months[(1, day("2025-01-01"))]] == [3, 5]
+
+    # Grouped on the ship date, so the week of 2024-12-30 holds both years
+    weeks = group_deliveries(records, "week", start=day("2024-12-30"), end=day("2025-01-05"))
+    assert sorted(weeks) == [(1, day("2024-12-30")), (2, day("2024-12-30"))]
+    assert [row[1] for row in weeks[(1, day("2024-12-30"))]] == [2, 3]
+    assert weeks[(2, day("2024-12-30"))] == [(2, 1, 2, day("2024-12-30"), day("2024-12-31"))]
+
+
+def test_unchanged_invoices_are_reused(tmp_path):
+    folder = str(tmp_path / "invoices")
+    records = [DeliveryRecord(1 + box % 2, box, 1 + box % 3, day("2025-05-01"), day("2025-05-01") + box % 40)
+               for box in range(1, 61)]
+    first = write_invoice_batch(folder, records, workers=1)
+    assert len(first) == 6 and not any(entry["reused"] for entry in first)
+    stamps = {entry["file"]: os.stat(os.path.join(folder, entry["file"])).st_mtime_ns for entry in first}
+
+    again = write_invoice_batch(folder, records, workers=1)
+    assert all(entry["reused"] for entry in again)
+    assert {entry["file"]: os.stat(os.path.join(folder, entry["file"])).st_mtime_ns for entry in again} == stamps
+
+    # Another box for one restaurant and month renders only that invoice again
+    records[0] = DeliveryRecord(2, 99, records[0].restaurant_id, records[0].pack_date, records[0].ship_date)
+    changed = write_invoice_batch(folder, records, workers=1)
+    rendered = [entry["file"] for entry in changed if not entry["reused"]]
+    assert rendered == ["invoice_2025-05_restaurant-b.pdf"]
+    assert {entry["file"]: entry["digest"] for entry in changed if entry["reused"]} == \
+           {entry["file"]: entry["digest"] for entry in first if entry["file"] not in rendered}
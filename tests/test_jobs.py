@@ -0,0 +1,31 @@
+import time
+
+from jobs import JobQueue
+from metrics import REGISTRY
+
+
+def pump_until_finished(jobs, *submitted):
+    deadline = time.monotonic() + 10
+    while not all(job.finished for job in submitted) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    jobs.pump()
+
+
+def test_failing_callback_does_not_stop_the_others():
+    jobs = JobQueue(workers=1)
+    failures, results = [], []
+    jobs.on_callback_error = lambda job, e: failures.append((job.name, str(e)))
+    before = REGISTRY.snapshot()["counters"].get("errors.job.callback", 0)
+
+    def open_document(result):
+        raise OSError("no application is associated with this file")
+
+    first = jobs.submit("Export", lambda job: "report.pdf", on_done=open_document)
+    second = jobs.submit("Invoice", lambda job: "invoice.pdf", on_done=results.append)
+    third = jobs.submit("Charts", lambda job: 1 / 0, on_error=lambda e: results.append(type(e).__name__))
+    pump_until_finished(jobs, first, second, third)
+    jobs.shutdown()
+
+    assert failures == [("Export", "no application is associated with this file")]
+    assert results == ["invoice.pdf", "ZeroDivisionError"]
+    assert REGISTRY.snapshot()["counters"]["errors.job.callback"] == before + 1
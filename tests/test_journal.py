@@ -0,0 +1,156 @@
+import json
+
+import pytest
+
+import metrics
+from records import DeliveryRecord, date_to_ordinal
+from storage import MemoryLogStore
+
+PACK = date_to_ordinal("2025-05-01")
+
+
+def delivery(box, mushroom_id=1, restaurant_id=1):
+    return DeliveryRecord(mushroom_id, box, restaurant_id, PACK, PACK + 1)
+
+
+def open_store(path):
+    store = MemoryLogStore(str(path), hot_months=None)
+    skipped = store.load()
+    return store, skipped
+
+
+def test_unreadable_entries_survive_compaction(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    good = delivery(1).label()
+    unknown = good.replace("Blue Oyster", "Morel")
+    path.write_text(json.dumps(good) + "\n{damaged\n" + json.dumps(unknown) + "\n", encoding="utf-8")
+    with open(str(path) + ".journal", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"seq": 1, "op": "add", "label": "not a delivery"}) + "\n")
+
+    store, skipped = open_store(path)
+    assert skipped == 3
+    assert [r.label() for r in store.records] == [good]
+    store.add(delivery(2))
+    store.save()
+    store.close()
+
+    snapshot = path.read_text(encoding="utf-8")
+    assert "{damaged" in snapshot and json.dumps(unknown) in snapshot and "not a delivery" in snapshot
+    store, skipped = open_store(path)
+    assert skipped == 3
+    assert [r.box_number for r in store.records] == [1, 2]
+    store.close()
+
+
+def test_damaged_journal_line_is_skipped_and_kept(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    journal = tmp_path / "logs.ndjson.journal"
+    entries = [json.dumps({"seq": seq, "op": "add", "label": delivery(seq).label()}) for seq in (1, 2)]
+    journal.write_text(entries[0] + "\n{damaged\n" + entries[1] + "\n" + '{"seq": 3, "op": "a',
+                       encoding="utf-8")
+    errors = metrics.REGISTRY.snapshot()["counters"].get("errors.journal", 0)
+
+    store, _ = open_store(path)
+    assert [r.box_number for r in store.records] == [1, 2]
+    assert metrics.REGISTRY.snapshot()["counters"]["errors.journal"] == errors + 1
+    store.close()
+    # Only the torn write at the end is cut off
+    assert journal.read_text(encoding="utf-8") == entries[0] + "\n{damaged\n" + entries[1] + "\n"
+
+
+def test_unreadable_entries_in_older_history_survive_background_load(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    lines = ["{damaged"] + [json.dumps(delivery(box).label()) for box in range(1, 1501)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    store = MemoryLogStore(str(path), hot_months=None)
+    store.load(background=True)
+    assert store.loading
+    store.save()
+    assert store.load_skipped == 1
+    store.close()
+
+    assert path.read_text(encoding="utf-8").startswith("{damaged\n")
+    store, skipped = open_store(path)
+    assert skipped == 1 and len(store.records) == 1500
+    store.close()
+
+
+def test_round_trip_through_the_journal(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    store, _ = open_store(path)
+    store.add(delivery(1))
+    store.add_many([delivery(box) for box in range(2, 6)])
+    store.delete([store.records[1].rid, store.records[3].rid])
+    store.close()
+    assert not path.exists()
+
+    store, skipped = open_store(path)
+    assert skipped == 0
+    assert [r.box_number for r in store.records] == [1, 3, 5]
+    assert store.count() == 3 and store.stats.total == 3
+    store.close()
+
+
+def test_compaction_keeps_every_entry(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    store, _ = open_store(path)
+    store.journal.compact_every = 10
+    for box in range(1, 31):
+        store.add(delivery(box))
+    store.delete([store.records[0].rid])
+    store.journal.join()
+    assert store.journal.last_error is None
+    assert path.exists()
+    store.close()
+
+    entries = [json.loads(line) for line in open(str(path) + ".journal", encoding="utf-8")]
+    assert len(entries) < 31 and any(entry["op"] == "checkpoint" for entry in entries)
+    store, skipped = open_store(path)
+    assert skipped == 0
+    assert [r.box_number for r in store.records] == list(range(2, 31))
+    store.save()
+    store.close()
+
+    # A full compaction leaves the snapshot holding everything
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 29
+    store, _ = open_store(path)
+    assert [r.box_number for r in store.records] == list(range(2, 31))
+    store.close()
+
+
+def test_other_stations_changes_are_picked_up(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    first, _ = open_store(path)
+    second, _ = open_store(path)
+    first.add_many([delivery(box) for box in range(1, 4)])
+    assert second.refresh()
+    assert [r.box_number for r in second.records] == [1, 2, 3]
+    second.delete([second.records[0].rid])
+    assert first.refresh()
+    assert [r.box_number for r in first.records] == [2, 3]
+    first.close()
+    second.close()
+
+
+def test_failed_background_load_is_retried(tmp_path, monkeypatch):
+    path = tmp_path / "logs.ndjson"
+    path.write_text("".join(json.dumps(delivery(box).label()) + "\n" for box in range(1, 1501)), encoding="utf-8")
+    store = MemoryLogStore(str(path), hot_months=None)
+    store.load(background=True)
+    store._loader.join()
+    store._loader.error = OSError("read failed")
+
+    # Another station holds the logs: the reload times out and nothing is dropped
+    def held():
+        raise TimeoutError("held by another station")
+
+    monkeypatch.setattr(store.journal.lock, "_lock_file", held)
+    with pytest.raises(TimeoutError):
+        store.poll_load()
+    assert store.loading and len(store.records) < 1500
+
+    monkeypatch.undo()
+    assert store.poll_load()
+    assert not store.loading and len(store.records) == 1500
+    store.close()
@@ -0,0 +1,105 @@
+import datetime
+import gzip
+import os
+
+import pytest
+
+from records import DeliveryRecord, date_to_ordinal
+from storage import MemoryLogStore
+
+OLD = date_to_ordinal("2024-01-15")
+TODAY = datetime.date.today().toordinal()
+
+
+def deliveries(pack, n):
+    return [DeliveryRecord(1, box, 1, pack, pack + 1) for box in range(1, n + 1)]
+
+
+def files(folder):
+    # The lock file and the .stats cache (saved on close) aside
+    return {os.path.relpath(os.path.join(root, name), folder): os.stat(os.path.join(root, name)).st_mtime_ns
+            for root, _, names in os.walk(folder) for name in names if not name.endswith((".lock", ".stats"))}
+
+
+def write_history(path):
+    store = MemoryLogStore(str(path), hot_months=None)
+    store.load()
+    store.add_many(deliveries(OLD, 20) + deliveries(TODAY, 5))
+    store.save()
+    store.close()
+
+
+def test_loading_does_not_seal(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    write_history(path)
+    before = files(tmp_path)
+
+    store = MemoryLogStore(str(path))
+    store.load()
+    assert store.count() == 25 and not store.archive.partitions
+    store.close()
+    assert files(tmp_path) == before
+
+    store = MemoryLogStore(str(path))
+    store.load()
+    store.save()
+    assert [entry["month"] for entry in store.archive.partitions] == ["2024-01"]
+    assert len(store.records) == 5 and store.count() == 25
+    store.close()
+
+
+def test_text_count_of_a_month_skips_damaged_lines(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    write_history(path)
+    store = MemoryLogStore(str(path))
+    store.load()
+    store.save()
+    entry, = store.archive.partitions
+    month = os.path.join(store.archive.folder, entry["file"])
+    store.close()
+    with open(month, "rb") as f:
+        text = gzip.decompress(f.read()).decode("utf-8")
+    damaged = text.splitlines()[0]
+    text += damaged[:-9] + "\n" + damaged.replace("Blue Oyster", "Morel") + "\n"
+    with open(month, "wb") as f:
+        f.write(gzip.compress(text.encode("utf-8")))
+
+    # Counted from the text before anything has parsed the month
+    store = MemoryLogStore(str(path))
+    store.load()
+    assert store.count(search="2024-01-15-box") == 20
+    assert len(list(store.query(search="2024-01-15-box"))) == 20
+    store.close()
+
+
+def test_interrupted_seal_is_read_and_finished_by_the_next_write(tmp_path, monkeypatch):
+    path = tmp_path / "logs.ndjson"
+    write_history(path)
+    store = MemoryLogStore(str(path))
+    store.load()
+
+    def crash(*args, **kwargs):
+        raise OSError("power cut")
+
+    monkeypatch.setattr(store.journal, "compact", crash)
+    with pytest.raises(OSError):
+        store.save()
+    monkeypatch.undo()
+    store.close()
+
+    before = files(tmp_path)
+    store = MemoryLogStore(str(path))
+    store.load()
+    assert store.archive.pending is not None
+    assert len(store.records) == 5 and store.count() == 25
+    assert files(tmp_path) == before
+
+    store.add(DeliveryRecord(2, 99, 1, TODAY, TODAY + 1))
+    assert store.archive.pending is None
+    assert len(store.records) == 6 and store.count() == 26
+    store.close()
+
+    store = MemoryLogStore(str(path))
+    store.load()
+    assert len(store.records) == 6 and store.count() == 26
+    store.close()
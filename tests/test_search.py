@@ -0,0 +1,114 @@
+import datetime
+import random
+
+from records import DeliveryRecord, date_to_ordinal
+from search import SearchIndex, iter_rids
+from storage import MemoryLogStore
+
+PACK = date_to_ordinal("2024-12-28")
+OLD = date_to_ordinal("2024-01-15")
+TODAY = datetime.date.today().toordinal()
+
+
+def deliveries(pack, n, days=1):
+    return [DeliveryRecord(1 + i % 2, i % 120 + 1, 1 + i % 3, pack + i % days, pack + i % days + 1 + i % 5)
+            for i in range(n)]
+
+
+def queries(records, n=150):
+    # Fixed ones plus pieces of real labels that cross field boundaries
+    rng = random.Random(7)
+    found = ["", "box0", "box1", "-box", "2025-01", "12-3", "shipped: 2025", " - ", "1-0", "zzz"]
+    for record in rng.sample(records, min(n, len(records))):
+        label = record.label().lower()
+        start = rng.randrange(len(label))
+        found.append(label[start:start + rng.randint(1, 24)])
+    return found
+
+
+def scan(records, search, start=None, end=None):
+    return {r.rid for r in records if search in r.label().lower()
+            and (start is None or r.pack_date >= start) and (end is None or r.pack_date <= end)}
+
+
+def check(index, records, search, start=None, end=None, lookup=None):
+    mask = index.match(search, start, end, lookup=lookup)
+    rids = {r.rid for r in records} if mask is None else set(iter_rids(mask))
+    assert rids == scan(records, search.lower(), start, end), (search, start, end)
+
+
+def test_match_agrees_with_a_substring_scan():
+    records = deliveries(PACK, 1500, days=10)
+    for rid, record in enumerate(records, start=1):
+        record.rid = rid
+    index = SearchIndex()
+    index.add_many(records)
+    for search in queries(records):
+        check(index, records, search)
+        check(index, records, search.upper(), PACK + 2, PACK + 6)
+
+    # Removing every value of some fields, then adding new ones
+    for record in records[::4] + [r for r in records if r.restaurant_id == 3]:
+        if record in records:
+            index.remove(record)
+            records.remove(record)
+    added = deliveries(PACK + 40, 30, days=3)
+    for rid, record in enumerate(added, start=2000):
+        record.rid = rid
+        index.add(record)
+    records += added
+    for search in queries(records):
+        check(index, records, search)
+        check(index, records, search, PACK + 5)
+
+
+def test_refined_matches_agree_with_a_substring_scan():
+    records = deliveries(PACK, 3000, days=10)
+    for rid, record in enumerate(records, start=1):
+        record.rid = rid
+    by_rid = {r.rid: r for r in records}
+    index = SearchIndex()
+    index.add_many(records)
+    # Each step narrows the last one, so small results are refined row by row
+    for search, start, end in [("box1", None, None), ("box11", None, None), ("box11", PACK + 3, None),
+                               ("box11", PACK + 3, PACK + 5), ("-box11", PACK + 3, PACK + 5)]:
+        check(index, records, search, start, end, lookup=by_rid.get)
+    index.remove(by_rid[11])
+    records.remove(by_rid[11])
+    check(index, records, "-box11", PACK + 3, PACK + 5, lookup=by_rid.get)
+
+
+def test_store_search_covers_archived_months(tmp_path):
+    path = tmp_path / "logs.ndjson"
+    store = MemoryLogStore(str(path), hot_months=None)
+    store.load()
+    store.add_many(deliveries(OLD, 200, days=20) + deliveries(OLD + 40, 150, days=10) + deliveries(TODAY, 50))
+    store.close()
+
+    store = MemoryLogStore(str(path))
+    store.load()
+    store.save()
+    assert [entry["month"] for entry in store.archive.partitions] == ["2024-01", "2024-02", "2024-03"]
+
+    def agree(search, start=None, end=None):
+        everything = list(store.query())
+        expected = sorted(r.label() for r in everything if search.lower() in r.label().lower()
+                          and (start is None or r.pack_date >= start) and (end is None or r.pack_date <= end))
+        assert store.count(start, end, search) == len(expected), (search, start, end)
+        assert sorted(r.label() for r in store.query(start, end, search)) == expected, (search, start, end)
+
+    records = list(store.query())
+    for search in queries(records, 60):
+        agree(search)
+        agree(search, OLD + 10, OLD + 45)
+
+    archived = [r.rid for r in records if r.rid < 0][:5]
+    hot = [r.rid for r in records if r.rid > 0][:5]
+    assert store.delete(archived + hot) == 10
+    store.add_many(deliveries(TODAY, 20))
+    records = list(store.query())
+    assert len(records) == 410
+    for search in queries(records, 60):
+        agree(search)
+        agree(search, OLD, TODAY)
+    store.close()
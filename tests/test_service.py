@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+import service
+from manager import TraceabilityManager
+from records import DeliveryRecord, date_to_ordinal
+from service import TraceabilityService
+from storage import MemoryLogStore, SQLiteLogStore
+
+PACK = date_to_ordinal("2025-05-01")
+
+
+@pytest.fixture(params=["journal", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SQLiteLogStore(str(tmp_path / "history.db"))
+    else:
+        store = MemoryLogStore(str(tmp_path / "logs.ndjson"), hot_months=None)
+    store.load()
+    store.add_many([DeliveryRecord(1 + i % 2, i % 1000 + 1, 1 + i % 3, PACK + i // 1000, PACK + i // 1000 + 1)
+                    for i in range(2500)])
+    return store
+
+
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = b"" if body is None else json.dumps(body).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        data = b""
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            data += (await reader.readexactly(size + 2))[:-2]
+            if not size:
+                break
+        writer.close()
+        return status, [json.loads(line) for line in data.splitlines()]
+    data = await reader.readexactly(int(headers["content-length"]))
+    writer.close()
+    return status, json.loads(data)
+
+
+def run(store, client):
+    # Serves on a free port while `client(port)` runs
+    app = TraceabilityService(TraceabilityManager(store), workers=4)
+
+    async def main():
+        server = await asyncio.start_server(app.handle, "127.0.0.1", 0)
+        try:
+            return await client(server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    try:
+        return asyncio.run(main())
+    finally:
+        app.store_thread.submit(store.close).result()
+        app.workers.shutdown()
+        app.store_thread.shutdown()
+
+
+def test_stream(store, monkeypatch):
+    # Several chunks, so a lazy cursor is read by more than one encode call
+    monkeypatch.setattr(service, "STREAM_CHUNK", 100)
+
+    async def client(port):
+        everything = await request(port, "GET", "/deliveries/stream")
+        filtered = await request(port, "GET", "/deliveries/stream?restaurant=2&start=2025-05-02&limit=150")
+        return everything, filtered
+
+    (status, rows), (filtered_status, filtered) = run(store, client)
+    assert status == 200 and len(rows) == 2500
+    assert rows[0]["tracking_number"] == "2025-05-01-BOX001"
+    assert filtered_status == 200 and len(filtered) == 150
+    assert all(row["restaurant_id"] == 2 and row["pack_date"] >= "2025-05-02" for row in filtered)
+
+
+def test_query_endpoints(store):
+    async def client(port):
+        added = await request(port, "POST", "/deliveries", {"mushroom_id": 1, "box_number": 7, "restaurant_id": 3,
+                                                            "pack_date": "2025-06-01", "ship_date": "2025-06-02"})
+        page = await request(port, "GET", "/deliveries?restaurant=3&limit=10&newest=1")
+        counted = await request(port, "GET", "/deliveries/count?start=2025-05-03")
+        found = await request(port, "GET", "/deliveries/2025-06-01-BOX007")
+        missing = await request(port, "GET", "/deliveries/2025-06-01-BOX008")
+        bad = await request(port, "GET", "/deliveries?limit=0")
+        return added, page, counted, found, missing, bad
+
+    added, page, counted, found, missing, bad = run(store, client)
+    assert added[0] == 201 and added[1]["delivery"]["tracking_number"] == "2025-06-01-BOX007"
+    assert page[0] == 200 and len(page[1]["deliveries"]) == 10 and page[1]["next_offset"] == 10
+    assert page[1]["deliveries"][0]["tracking_number"] == "2025-06-01-BOX007"
+    assert counted == (200, {"count": 501})
+    assert found[0] == 200 and [row["box_number"] for row in found[1]["deliveries"]] == [7]
+    assert missing[0] == 404
+    assert bad[0] == 400
+
+
+def test_refresh_keeps_going_after_errors(monkeypatch, capsys):
+    monkeypatch.setattr(service, "REFRESH_SECONDS", 0)
+    store = MemoryLogStore()
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        raise RuntimeError("unexpected")
+
+    store.refresh = refresh
+    app = TraceabilityService(TraceabilityManager(store))
+
+    async def main():
+        refresher = asyncio.ensure_future(app.refresh_forever())
+        while len(calls) < 3:
+            await asyncio.sleep(0.01)
+        assert not refresher.done()
+        refresher.cancel()
+
+    asyncio.run(main())
+    app.workers.shutdown()
+    app.store_thread.shutdown()
+    assert capsys.readouterr().err.count("could not refresh") == 1
@@ -0,0 +1,100 @@
+import threading
+from collections import Counter
+
+from records import DeliveryRecord, date_to_ordinal
+from storage import SQLiteLogStore
+
+PACK = date_to_ordinal("2025-05-01")
+
+
+def deliveries(n, restaurant_id=1):
+    return [DeliveryRecord(1 + i % 2, i % 1000 + 1, restaurant_id, PACK + i // 1000, PACK + i // 1000 + 1)
+            for i in range(n)]
+
+
+def open_store(path):
+    store = SQLiteLogStore(str(path))
+    store.load()
+    return store
+
+
+def check_counts(store):
+    # delivery_stats must agree with the rows themselves
+    records = list(store.query())
+    assert store.count() == len(records)
+    start, end = PACK + 1, PACK + 2
+    assert store.count(start, end) == sum(start <= r.pack_date <= end for r in records)
+    for field in ("mushroom_id", "restaurant_id", "pack_date", "ship_date"):
+        assert store.count_by(field) == Counter(getattr(r, field) for r in records)
+        assert store.count_by(field, start, end) == Counter(getattr(r, field) for r in records
+                                                            if start <= r.pack_date <= end)
+
+
+def test_stats_follow_adds_deletes_and_replace_all(tmp_path):
+    store = open_store(tmp_path / "history.db")
+    check_counts(store)
+    added = store.add_many(deliveries(2500))
+    store.add(DeliveryRecord(2, 7, 3, PACK + 9, PACK + 12))
+    check_counts(store)
+
+    assert store.delete([r.rid for r in added[::3]]) == len(added[::3])
+    check_counts(store)
+    assert store.count_by("restaurant_id") == {1: 2500 - len(added[::3]), 3: 1}
+
+    store.replace_all(deliveries(40, restaurant_id=2))
+    check_counts(store)
+    assert store.count_by("restaurant_id") == {2: 40}
+    store.close()
+
+    # The counts outlive the connection
+    store = open_store(tmp_path / "history.db")
+    check_counts(store)
+    store.close()
+
+
+def test_delete_by_rid(tmp_path):
+    store = open_store(tmp_path / "history.db")
+    first, second, third = store.add_many(deliveries(3))
+    assert store.get(second.rid).label() == second.label()
+
+    assert store.delete([second.rid, 12345]) == 1
+    assert store.get(second.rid) is None
+    assert [r.rid for r in store.query()] == [first.rid, third.rid]
+    assert store.delete([second.rid]) == 0
+    check_counts(store)
+    store.close()
+
+
+def test_each_thread_has_its_own_connection(tmp_path):
+    store = open_store(tmp_path / "history.db")
+    store.add_many(deliveries(10))
+    seen = {}
+
+    def worker():
+        seen["conn"] = store._conn()
+        seen["count"] = store.count()
+        store.add_many(deliveries(5, restaurant_id=2))
+        store.close()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert seen["count"] == 10 and seen["conn"] is not store._conn()
+    # The worker closing its connection leaves this thread's open
+    assert store.count() == 15 and store.count_by("restaurant_id") == {1: 10, 2: 5}
+    check_counts(store)
+    store.close()
+
+
+def test_snapshot_leaves_out_later_adds(tmp_path):
+    store = open_store(tmp_path / "history.db")
+    store.add_many(deliveries(30))
+    snapshot = store.snapshot()
+    store.add_many(deliveries(5, restaurant_id=2))
+    assert len(list(snapshot)) == 30 and len(list(snapshot)) == 30
+
+    # replace_all does not hand out ids the snapshot already covers
+    store.replace_all(deliveries(40, restaurant_id=3))
+    assert list(snapshot) == []
+    assert len(list(store.snapshot())) == 40
+    store.close()